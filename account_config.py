@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from binance_futures import client_for
+
+NO_NEED_TO_CHANGE_MARGIN_TYPE = -4046
+SETUP_ERROR_CODES = (-2027, -2028)  # Order rejected for the position limit of the leverage, or leverage too high for the margin balance
+SETUP_RETRY_INTERVAL = 300  # Seconds before a failed leverage or margin type change is tried again
+
+logger = logging.getLogger(__name__)
+
+class AccountConfigCache:
+    """Known leverage and margin type per symbol, so that only differences to the config are sent."""
+
+    def __init__(self, client=None, store=None):
+        self.client = client  # FuturesClient of the account, or the keys passed to ensure are used
+        self.store = store  # StateStore the applied settings are saved to, optional
+        self.symbols = {}  # symbol -> {'leverage': int, 'margin_type': str}
+        self.failed_at = {}  # (symbol, setting) -> time of the last failed change
+        self._lock = threading.Lock()
+
+    def load(self, setup):
+        # Record known settings, {symbol: {'leverage': int, 'margin_type': str}}, from AccountSnapshot.setup
+        # or saved by an earlier run.
+        with self._lock:
+            for symbol, state in setup.items():
+                self.symbols.setdefault(symbol, {}).update(state)
+
+    def invalidate(self, symbol=None):
+        # Forget the known settings of one symbol, or of all symbols, so they are applied again.
+        with self._lock:
+            if symbol is None:
+                self.symbols.clear()
+                self.failed_at.clear()
+            else:
+                self.symbols.pop(symbol, None)
+                self.failed_at.pop((symbol, 'leverage'), None)
+                self.failed_at.pop((symbol, 'margin_type'), None)
+
+    def check_order_error(self, symbol, error):
+        # Forget the known settings of a symbol when an order was rejected because of its leverage, so that
+        # the next ensure applies them again.
+        if isinstance(error, dict) and error.get('code') in SETUP_ERROR_CODES:
+            logger.warning("Order rejected because of the leverage (%s), applying the settings again...", error.get('code'), extra={'symbol': symbol})
+            self.invalidate(symbol)
+
+    def _should_retry(self, symbol, setting):
+        failed_at = self.failed_at.get((symbol, setting))
+        return failed_at is None or time.monotonic() - failed_at > SETUP_RETRY_INTERVAL
+
+    def ensure(self, symbol, leverage, margin_type, api_key, api_secret):
+        # Change the leverage and margin type of a symbol only if they differ from the known state.
+        state = self.symbols.setdefault(symbol, {})
+        client = self.client or client_for(api_key, api_secret)
+        known = dict(state)
+
+        if state.get('leverage') != leverage and self._should_retry(symbol, 'leverage'):
+            response = client.change_leverage(symbol, leverage)
+            if isinstance(response, dict) and 'leverage' in response:
+                state['leverage'] = int(response['leverage'])
+                self.failed_at.pop((symbol, 'leverage'), None)
+            else:
+                state.pop('leverage', None)
+                self.failed_at[(symbol, 'leverage')] = time.monotonic()
+
+        if state.get('margin_type') != margin_type and self._should_retry(symbol, 'margin_type'):
+            response = client.change_margin_type(symbol, margin_type)
+            if isinstance(response, dict) and response.get('code') in (200, NO_NEED_TO_CHANGE_MARGIN_TYPE):
+                state['margin_type'] = margin_type
+                self.failed_at.pop((symbol, 'margin_type'), None)
+            else:
+                state.pop('margin_type', None)
+                self.failed_at[(symbol, 'margin_type')] = time.monotonic()
+
+        if self.store is not None and state != known:
+            self.store.save_setup(symbol, state)
+
+# Shared cache used by handle_orders
+account_config = AccountConfigCache()
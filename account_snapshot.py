@@ -0,0 +1,104 @@
+import logging
+import threading
+from binance_futures import client_for
+from payloads import Position, parse_positions, index_open_orders  # Filtered, indexed positionRisk and openOrders rows
+
+logger = logging.getLogger(__name__)
+
+class AccountSnapshot:
+    """Cycle-scoped view of positions and open orders, indexed by (symbol, positionSide).
+
+    Only the symbols passed in symbols are kept, all symbols if it is None. Of the positions only the open
+    ones are kept, as Position objects.
+    """
+
+    def __init__(self, positions, open_orders, symbols=None):
+        self._lock = threading.Lock()  # Orders placed during the cycle may update the snapshot
+        self.positions, self.setup = parse_positions(positions, symbols)  # (symbol, positionSide) -> Position, symbol -> leverage and margin type
+        self.open_orders = index_open_orders(open_orders, symbols)  # (symbol, positionSide) -> list of open order dicts
+
+    @classmethod
+    def fetch(cls, api_key, api_secret, client=None, symbols=None):
+        # Fetch all positions and all open orders with one request each, keeping those of symbols.
+        client = client or client_for(api_key, api_secret)
+        try:
+            positions = client.get_positions()
+        except Exception as e:  # Connection errors, or an error page that is not JSON
+            logger.error("Error getting positions: %s", e)
+            return None
+        if not isinstance(positions, list):
+            logger.error("Failed to get positions: %s", positions)
+            return None
+
+        open_orders = client.get_all_open_orders()
+        if open_orders is None:
+            return None
+
+        return cls(positions, open_orders, symbols)
+
+    @classmethod
+    def fetch_symbol(cls, symbol, api_key, api_secret, client=None):
+        # Fetch the positions and open orders of one symbol. Cheaper than fetch while only a few symbols are needed.
+        client = client or client_for(api_key, api_secret)
+        try:
+            positions = client.get_positions(symbol)
+        except Exception as e:
+            logger.error("Error getting positions: %s", e, extra={'symbol': symbol})
+            return None
+        if not isinstance(positions, list):
+            logger.error("Failed to get positions: %s", positions, extra={'symbol': symbol})
+            return None
+
+        open_orders = client.get_open_orders(symbol)
+        if open_orders is None:
+            return None
+
+        return cls(positions, open_orders)
+
+    def get_position(self, symbol, position_side):
+        # Return the Position for the symbol and side, or None if there is no open position.
+        return self.positions.get((symbol, position_side))
+
+    def has_positions(self, symbol):
+        # Check if there are any long or short positions for the given symbol.
+        long_position = self.get_position(symbol, 'LONG')
+        short_position = self.get_position(symbol, 'SHORT')
+        has_long = long_position is not None and long_position.amount > 0
+        has_short = short_position is not None and short_position.amount < 0
+        return has_long, has_short
+
+    def get_open_orders(self, symbol, position_side=None):
+        # Return the open orders for the symbol, optionally limited to one position side.
+        with self._lock:
+            if position_side is not None:
+                return list(self.open_orders.get((symbol, position_side), []))
+            return [order for (order_symbol, _), orders in self.open_orders.items() if order_symbol == symbol for order in orders]
+
+    def add_order(self, order):
+        # Record an order placed during the cycle, replacing any earlier copy of it. Error responses are ignored.
+        if not isinstance(order, dict) or 'orderId' not in order:
+            return
+        with self._lock:
+            key = (order['symbol'], order['positionSide'])
+            orders = [existing for existing in self.open_orders.get(key, []) if existing['orderId'] != order['orderId']]
+            orders.append(order)
+            self.open_orders[key] = orders
+
+    def update_position(self, symbol, position_side, position_amt, entry_price=None):
+        # Update a position from a stream event.
+        amount = float(position_amt)
+        with self._lock:
+            if amount == 0:
+                self.positions.pop((symbol, position_side), None)
+                return
+            current = self.positions.get((symbol, position_side))
+            if entry_price is None:
+                entry_price = current.entry_price if current is not None else 0
+            mark_price = current.mark_price if current is not None else 0
+            self.positions[(symbol, position_side)] = Position(symbol, position_side, position_amt, amount, float(entry_price), mark_price)
+
+    def remove_order(self, symbol, position_side, order_id):
+        # Forget an order cancelled during the cycle.
+        with self._lock:
+            orders = self.open_orders.get((symbol, position_side), [])
+            self.open_orders[(symbol, position_side)] = [order for order in orders if order['orderId'] != order_id]
@@ -0,0 +1,41 @@
+from config import base_url, leverage, margin_type, crypto_settings
+from config import http_pool_size, http_timeout, http_max_retries, http_backoff_factor
+from config import request_weight_limit, order_limit_10s, order_limit_1m, read_weight_reserve
+from config import time_sync_interval, time_sync_samples, time_sync_max_drift
+from http_client import HttpTransport
+from rate_limiter import RateLimiter
+from clock_sync import ClockSync
+from binance_futures import FuturesClient, default_client
+from account_config import AccountConfigCache, account_config
+
+class Account:
+    """One trading account: its client, its crypto_settings, its known leverage and margin type and its local state."""
+
+    def __init__(self, name, client, crypto_settings, leverage, margin_type, account_config=None, store=None):
+        self.name = name
+        self.client = client  # FuturesClient with the keys, transport, rate limiter and clock of the account
+        self.crypto_settings = crypto_settings
+        self.leverage = leverage
+        self.margin_type = margin_type
+        self.account_config = account_config or AccountConfigCache(client)
+        self.store = None  # StateStore of the account, see attach_store
+        if store is not None:
+            self.attach_store(store)
+
+    def attach_store(self, store):
+        # Record the orders and setup state of the account in the store and load the setup state it holds.
+        self.store = store
+        self.account_config.store = store
+        self.account_config.load(store.load_setup())
+
+def create_account(settings, weight_share=1.0, order_share=1.0):
+    # Build an account with its own transport, rate limiter and clock from an entry of config.accounts.
+    # weight_share and order_share scale the rate limits when the budget is split between processes.
+    limiter = RateLimiter(request_weight_limit, order_limit_10s, order_limit_1m, read_weight_reserve, weight_share, order_share)
+    transport = HttpTransport(settings.get('base_url', base_url), http_pool_size, http_timeout, http_max_retries, http_backoff_factor, limiter)
+    clock = ClockSync(time_sync_interval, time_sync_samples, time_sync_max_drift, transport)
+    client = FuturesClient(settings['api_key'], settings['api_secret'], transport, clock)
+    return Account(settings['name'], client, settings['crypto_settings'], settings.get('leverage', leverage), settings.get('margin_type', margin_type))
+
+# Account from the single-account settings in config.py, used by main.py
+default_account = Account('default', default_client, crypto_settings, leverage, margin_type, account_config)
@@ -0,0 +1,155 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from account_snapshot import AccountSnapshot
+from scheduler import POSITION_SIDES
+from strategy import position_roi
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_POLL_WEIGHT = 6  # positionRisk (5) and openOrders (1) of one symbol. Prices are loaded for all symbols at once by the price cache
+SNAPSHOT_WEIGHT = 45  # positionRisk (5) and openOrders (40) of all symbols
+MIN_IDLE_SHARE = 0.1  # Part of the budget kept for flat symbols when the ones with positions would need all of it
+
+class AdaptivePoller:
+    """Poll every symbol at its own interval instead of all symbols every cycle.
+
+    Symbols with a position are polled every position_interval, or every near_stop_interval once the position
+    lost near_stop_fraction of stop_loss_roi. Flat symbols start at idle_interval and back off up to
+    idle_max_interval while their orders do not change. The intervals are stretched when the polls would use
+    more than weight_budget request weight per minute, the flat symbols first.
+    """
+
+    def __init__(self, settings, scheduler, account, intervals, near_stop_fraction, weight_budget, store=None):
+        self.settings = settings
+        self.scheduler = scheduler  # Its handler is called for every poll
+        self.account = account
+        self.near_stop_interval, self.position_interval, self.idle_interval, self.idle_max_interval = intervals
+        self.near_stop_fraction = near_stop_fraction
+        self.weight_budget = weight_budget / 60  # Weight per second
+        self.store = store  # StateStore of the last run, limits the first poll to the sides that changed
+        self.heap = []  # (due time, sequence, symbol) of the symbols not in flight
+        self.sequence = itertools.count()  # Keeps the heap order stable for equal due times
+        self.state = {}  # symbol -> {'exposed': bool, 'idle_streak': int, 'orders': frozenset, 'load': float}
+        self.load = {True: 0.0, False: 0.0}  # Planned weight per second of the symbols with and without a position
+        self.results = {}  # symbol -> snapshot of its last poll, until it is rescheduled
+        self.seeded = False
+        self._cond = threading.Condition()
+
+    def push(self, symbol, due):
+        with self._cond:
+            heapq.heappush(self.heap, (due, next(self.sequence), symbol))
+            self._cond.notify()
+
+    def classify(self, symbol, snapshot):
+        # Return the number of open positions of the symbol, and whether one of them is close to the stop loss.
+        positions = 0
+        near_stop = False
+        stop_loss_roi = self.settings[symbol]['stop_loss_roi']
+        for position_side in POSITION_SIDES:
+            position = snapshot.get_position(symbol, position_side)
+            if position is None:
+                continue
+            positions += 1
+            roi = position_roi(position.entry_price, position.mark_price, position_side, self.account.leverage)
+            if roi <= stop_loss_roi * self.near_stop_fraction:
+                near_stop = True
+        return positions, near_stop
+
+    def budget_factor(self, exposed):
+        # How much the intervals have to be stretched to stay within the weight budget.
+        exposed_factor = max(1.0, self.load[True] / self.weight_budget)
+        if exposed:
+            return exposed_factor
+        remaining = max(self.weight_budget - self.load[True] / exposed_factor, self.weight_budget * MIN_IDLE_SHARE)
+        return max(1.0, self.load[False] / remaining)
+
+    def next_interval(self, symbol, snapshot):
+        # Seconds until the next poll of the symbol, from the snapshot of its last poll.
+        state = self.state.setdefault(symbol, {'exposed': False, 'idle_streak': 0, 'orders': None, 'load': 0.0})
+        if snapshot is None:
+            interval = self.position_interval if state['exposed'] else self.idle_interval  # Failed poll, retry soon
+        else:
+            positions, near_stop = self.classify(symbol, snapshot)
+            exposed = positions > 0
+            orders = frozenset(order['orderId'] for order in snapshot.get_open_orders(symbol))
+            if exposed:
+                state['idle_streak'] = 0
+                interval = self.near_stop_interval if near_stop else self.position_interval
+            else:
+                state['idle_streak'] = state['idle_streak'] + 1 if not state['exposed'] and orders == state['orders'] else 0
+                interval = min(self.idle_interval * 2 ** state['idle_streak'], self.idle_max_interval)
+            state['orders'] = orders
+            self.load[state['exposed']] -= state['load']
+            state['exposed'] = exposed
+            state['load'] = SYMBOL_POLL_WEIGHT / interval
+            self.load[exposed] += state['load']
+        return interval * self.budget_factor(state['exposed'])
+
+    def _poll(self, symbol, params, snapshot, position_sides):
+        # Runs on the scheduler pool: fetch the symbol unless a snapshot of all symbols was passed, then handle it.
+        if snapshot is None:
+            snapshot = AccountSnapshot.fetch_symbol(symbol, self.account.client.api_key, self.account.client.api_secret, self.account.client)
+            if snapshot is None:
+                return
+            self.account.account_config.load(snapshot.setup)
+        self.scheduler.handler(symbol, params, snapshot, position_sides)
+        self.results[symbol] = snapshot
+
+    def _done(self, symbol):
+        with self._cond:  # Tasks finish on several threads, the state and load are updated one at a time
+            self.push(symbol, time.monotonic() + self.next_interval(symbol, self.results.pop(symbol, None)))
+
+    def take_due(self):
+        # Wait for the next due symbol and return all symbols that are due with their due times.
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.heap and self.heap[0][0] <= now:
+                    break
+                self._cond.wait(self.heap[0][0] - now if self.heap else None)
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due_at, _, symbol = heapq.heappop(self.heap)
+                due.append((symbol, due_at))
+            if len(due) * SYMBOL_POLL_WEIGHT > SNAPSHOT_WEIGHT:
+                # A snapshot of all symbols is cheaper, so the symbols due soon come along with it
+                while self.heap and self.heap[0][0] <= now + self.position_interval:
+                    due_at, _, symbol = heapq.heappop(self.heap)
+                    due.append((symbol, due_at))
+            return due
+
+    def poll(self, due):
+        # Handle the due symbols on the scheduler pool. Every symbol is rescheduled when its task is done.
+        snapshot = None
+        if not self.seeded or len(due) * SYMBOL_POLL_WEIGHT > SNAPSHOT_WEIGHT:
+            snapshot = AccountSnapshot.fetch(self.account.client.api_key, self.account.client.api_secret, self.account.client, self.settings)
+
+        position_sides = {}
+        if snapshot is not None:
+            self.account.account_config.load(snapshot.setup)  # Leverage and margin type as the exchange reports them
+        if snapshot is not None and not self.seeded:
+            # Skip the sides that did not change since the last run
+            self.seeded = True
+            if self.store is not None:
+                position_sides = self.store.reconcile(snapshot, self.settings, self.account.leverage, self.account.margin_type)
+                for symbol, _ in due:
+                    if symbol not in position_sides:
+                        self.results[symbol] = snapshot
+                        self._done(symbol)
+                due = [(symbol, due_at) for symbol, due_at in due if symbol in position_sides]
+
+        for symbol, due_at in due:
+            future = self.scheduler.submit(symbol, self.settings[symbol], snapshot, position_sides.get(symbol, POSITION_SIDES), due_at, self._poll)
+            future.add_done_callback(lambda future, symbol=symbol: self._done(symbol))
+
+    def run_forever(self):
+        now = time.monotonic()
+        for symbol in self.settings:
+            self.push(symbol, now)
+        while True:
+            due = self.take_due()
+            logger.debug("Polling %s symbols", len(due))
+            self.poll(due)
@@ -0,0 +1,310 @@
+import argparse
+import itertools
+from decimal import Decimal
+import numpy as np
+from config import crypto_settings, leverage
+from exchange_filters import SymbolFilters
+from reconciler import index_orders, reconcile_side, TRAILING_STOP, STOP_LOSS, TAKE_PROFIT
+from strategy import entry_side, close_side
+
+# Column positions in the Binance data dump CSV files (data.binance.vision)
+KLINE_COLUMNS = (0, 1, 2, 3, 4)  # open_time, open, high, low, close
+AGG_TRADE_COLUMNS = (5, 1)  # transact_time, price
+KLINE_PARQUET_COLUMNS = ('open_time', 'open', 'high', 'low', 'close')
+AGG_TRADE_PARQUET_COLUMNS = ('transact_time', 'price')
+
+MIN_WINDOW = 64  # Bars searched at once right after an order is placed
+MAX_WINDOW = 1 << 16  # Upper limit for the doubling search window
+
+BACKTEST_SYMBOL = 'BACKTEST'  # Symbol of the simulated orders, the order rules do not depend on it
+NO_ROUNDING = SymbolFilters(Decimal('1E-12'), Decimal('1E-12'), Decimal(0), Decimal('Infinity'), Decimal(0))  # Used unless exchange filters are given
+
+TRADE_DTYPE = np.dtype([
+    ('entry_time', np.int64),
+    ('exit_time', np.int64),
+    ('entry_price', np.float64),
+    ('exit_price', np.float64),
+    ('quantity', np.float64),
+    ('pnl', np.float64),
+    ('stop_loss', np.bool_),  # True if the position was closed by the stop loss order
+])
+
+def _read_csv_chunks(path, usecols, chunk_size):
+    # Read a CSV file chunk_size rows at a time, skipping the header row if there is one.
+    with open(path) as f:
+        first = f.readline()
+        lines = [] if not first[:1].isdigit() else [first]
+        while True:
+            lines.extend(itertools.islice(f, chunk_size - len(lines)))
+            if not lines:
+                return
+            yield np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
+            lines = []
+
+def _read_parquet_chunks(path, columns, chunk_size):
+    # Read a Parquet file chunk_size rows at a time. Requires pyarrow.
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet files requires the pyarrow package (pip install pyarrow)")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=list(columns)):
+        yield np.column_stack([batch.column(i).to_numpy(zero_copy_only=False).astype(np.float64) for i in range(len(columns))])
+
+def load_prices(path, kind='klines', chunk_size=500000):
+    # Stream a kline or aggTrade file as chunks of time/open/high/low/close arrays.
+    parquet = path.endswith('.parquet')
+    if kind == 'klines':
+        rows = _read_parquet_chunks(path, KLINE_PARQUET_COLUMNS, chunk_size) if parquet else _read_csv_chunks(path, KLINE_COLUMNS, chunk_size)
+        for data in rows:
+            yield {'time': data[:, 0].astype(np.int64), 'open': data[:, 1], 'high': data[:, 2], 'low': data[:, 3], 'close': data[:, 4]}
+    elif kind == 'aggTrades':
+        rows = _read_parquet_chunks(path, AGG_TRADE_PARQUET_COLUMNS, chunk_size) if parquet else _read_csv_chunks(path, AGG_TRADE_COLUMNS, chunk_size)
+        for data in rows:
+            price = data[:, 1]  # Every trade is a bar with a single price
+            yield {'time': data[:, 0].astype(np.int64), 'open': price, 'high': price, 'low': price, 'close': price}
+    else:
+        raise ValueError(f"Unknown data kind: {kind}")
+
+def with_mark_prices(chunks, mark_chunks):
+    # Add the high and low of mark price klines to the chunks of the same period.
+    for chunk, mark in zip(chunks, mark_chunks):
+        if len(mark['time']) != len(chunk['time']) or mark['time'][0] != chunk['time'][0]:
+            raise ValueError("Mark price klines must have the same rows as the price data")
+        chunk['mark_high'] = mark['high']
+        chunk['mark_low'] = mark['low']
+        yield chunk
+
+def _trailing_hit(extreme, high, low, rate, sell):
+    # Find the first bar that triggers a trailing stop which started tracking at extreme.
+    # Returns (index, trigger level) on a hit, otherwise (-1, extreme to carry over).
+    # The extreme only includes earlier bars, so a bar never triggers on its own swing.
+    if sell:
+        peak = np.maximum.accumulate(np.concatenate(([extreme], high[:-1])))
+        levels = peak * (1 - rate)
+        hits = np.flatnonzero(low <= levels)
+        if hits.size:
+            return hits[0], levels[hits[0]]
+        return -1, max(peak[-1], high[-1])
+    trough = np.minimum.accumulate(np.concatenate(([extreme], low[:-1])))
+    levels = trough * (1 + rate)
+    hits = np.flatnonzero(high >= levels)
+    if hits.size:
+        return hits[0], levels[hits[0]]
+    return -1, min(trough[-1], low[-1])
+
+def _first(mask):
+    hits = np.flatnonzero(mask)
+    return hits[0] if hits.size else -1
+
+class SideSimulator:
+    """Replays the orders of one position side of one symbol against price bars.
+
+    Which orders are open is decided by reconcile_side, the function handle_orders uses: at the start of
+    the data and at the close of every bar in which an order filled, like handle_orders does on its next
+    cycle. The simulator only finds the bar in which an open order triggers and fills it.
+    """
+
+    def __init__(self, position_side, params, leverage, fee_rate, filters=None):
+        self.position_side = position_side
+        self.is_long = position_side == 'LONG'
+        self.entry_side = entry_side(position_side)
+        self.close_side = close_side(position_side)
+        self.params = params
+        self.leverage = leverage
+        self.fee_rate = fee_rate  # Taker fee per fill as a fraction of the notional
+        self.filters = filters or NO_ROUNDING  # SymbolFilters the quantities and prices are rounded to
+        self.use_mark = params['working_type'] == 'MARK_PRICE'
+        self.orders = []  # Open orders in the /fapi/v1/openOrders format
+        self.next_order_id = 1
+        self.position_amt = 0.0
+        self.extreme = None  # Price the open trailing stop order is tracking from
+        self.entry_price = None
+        self.entry_time = None
+        self.trades = []
+
+    def _reconcile(self, market_price):
+        # Apply the order changes handle_orders would send for the current position at market_price.
+        market_price = float(market_price)  # Prices from the arrays are numpy floats, the order rules round Python floats
+        actions = reconcile_side(BACKTEST_SYMBOL, self.position_side, self.params, self.leverage, self.position_amt, index_orders(self.orders), self.filters, market_price)
+        for action in actions:
+            if action.order is not None:
+                self.orders.remove(action.order)
+            if action.params is not None:
+                self._place(action.params, market_price)
+
+    def _place(self, params, market_price):
+        self.orders.append({
+            'orderId': self.next_order_id,
+            'symbol': params['symbol'],
+            'side': params['side'],
+            'type': params['type'],
+            'positionSide': params['positionSide'],
+            'origQty': str(params['quantity']),
+            'executedQty': '0',
+            'priceRate': str(params.get('callbackRate', 0)),
+            'stopPrice': params.get('stopPrice')
+        })
+        self.next_order_id += 1
+        if params['type'] == TRAILING_STOP:
+            self.extreme = market_price  # A trailing stop starts tracking from the price it was placed at
+
+    def _order(self, side, order_type):
+        for order in self.orders:
+            if order['side'] == side and order['type'] == order_type:
+                return order
+        return None
+
+    def process(self, chunk):
+        # Run the orders through one chunk of bars.
+        if self.use_mark and 'mark_high' in chunk:
+            high, low = chunk['mark_high'], chunk['mark_low']  # Stop prices trigger on the mark price
+        else:
+            high, low = chunk['high'], chunk['low']
+        if self.next_order_id == 1:
+            self._reconcile(chunk['open'][0])  # The first orders are placed at the start of the data
+
+        n = len(high)
+        i = 0
+        window = MIN_WINDOW
+        while i < n:
+            end = min(i + window, n)
+            if self.position_amt:
+                bar = self._position_step(chunk, high, low, i, end)
+            else:
+                bar = self._flat_step(chunk, high, low, i, end)
+            if bar < 0:
+                i = end
+                window = min(window * 2, MAX_WINDOW)
+            else:
+                i = bar + 1
+                window = MIN_WINDOW
+
+    def _fill_price(self, chunk, bar, level):
+        # Orders fill at their trigger level, limited to the last price range of the bar.
+        return min(max(level, chunk['low'][bar]), chunk['high'][bar])
+
+    def _flat_step(self, chunk, high, low, start, end):
+        entry = self._order(self.entry_side, TRAILING_STOP)
+        if entry is None:
+            return -1
+        hit, value = _trailing_hit(self.extreme, high[start:end], low[start:end], float(entry['priceRate']) / 100, sell=not self.is_long)
+        if hit < 0:
+            self.extreme = value
+            return -1
+
+        bar = start + hit
+        self.orders.remove(entry)
+        quantity = float(entry['origQty'])
+        self.position_amt = quantity if self.is_long else -quantity
+        self.entry_price = self._fill_price(chunk, bar, value)
+        self.entry_time = chunk['time'][bar]
+        self._reconcile(chunk['close'][bar])  # Stop loss and close or take profit order at the close of the fill bar
+        return bar
+
+    def _position_step(self, chunk, high, low, start, end):
+        high, low = high[start:end], low[start:end]
+        stop = self._order(self.close_side, STOP_LOSS)
+        stop_hit = -1
+        if stop is not None:
+            stop_price = float(stop['stopPrice'])
+            stop_hit = _first(low <= stop_price) if self.is_long else _first(high >= stop_price)
+
+        closer = self._order(self.close_side, TRAILING_STOP) or self._order(self.close_side, TAKE_PROFIT)
+        close_hit = -1
+        if closer is not None and closer['type'] == TRAILING_STOP:
+            close_hit, close_level = _trailing_hit(self.extreme, high, low, float(closer['priceRate']) / 100, sell=self.is_long)
+        elif closer is not None:
+            close_level = float(closer['stopPrice'])
+            close_hit = _first(high >= close_level) if self.is_long else _first(low <= close_level)
+
+        if stop_hit < 0 and close_hit < 0:
+            if closer is not None and closer['type'] == TRAILING_STOP:
+                self.extreme = close_level
+            return -1
+
+        # The stop loss wins when both trigger in the same bar
+        is_stop_loss = stop_hit >= 0 and (close_hit < 0 or stop_hit <= close_hit)
+        bar = start + (stop_hit if is_stop_loss else close_hit)
+        exit_price = self._fill_price(chunk, bar, stop_price if is_stop_loss else close_level)
+
+        quantity = abs(self.position_amt)
+        direction = 1 if self.is_long else -1
+        pnl = direction * (exit_price - self.entry_price) * quantity - self.fee_rate * (self.entry_price + exit_price) * quantity
+        self.trades.append((self.entry_time, chunk['time'][bar], self.entry_price, exit_price, quantity, pnl, is_stop_loss))
+
+        # The remaining close orders are cancelled and a new entry order placed, as handle_orders does once the side is flat
+        self.orders.remove(stop if is_stop_loss else closer)
+        self.position_amt = 0.0
+        self._reconcile(chunk['close'][bar])
+        return bar
+
+    def get_trades(self):
+        return np.array(self.trades, dtype=TRADE_DTYPE)
+
+def max_drawdown(pnl):
+    # Largest drop of the realized equity curve from its previous peak.
+    equity = np.concatenate(([0.0], np.cumsum(pnl)))
+    return float(np.max(np.maximum.accumulate(equity) - equity))
+
+def summarize(trades):
+    # Summarize the trades of one symbol or side.
+    trades = np.sort(trades, order='exit_time')
+    pnl = trades['pnl']
+    return {
+        'trades': len(trades),
+        'pnl': float(pnl.sum()),
+        'win_rate': float((pnl > 0).mean()) if len(trades) else 0.0,
+        'stop_losses': int(trades['stop_loss'].sum()),
+        'max_drawdown': max_drawdown(pnl)
+    }
+
+def backtest_symbol(chunks, params, leverage, fee_rate=0.0004):
+    # Run both position sides of one symbol through the price chunks. Returns the trades per side.
+    simulators = [SideSimulator(position_side, params, leverage, fee_rate) for position_side in ('LONG', 'SHORT')]
+    for chunk in chunks:
+        for simulator in simulators:
+            simulator.process(chunk)
+    return {simulator.position_side: simulator.get_trades() for simulator in simulators}
+
+def run_backtest(datasets, settings=crypto_settings, leverage=leverage, fee_rate=0.0004):
+    # Backtest every symbol in datasets (symbol -> price chunks) with its crypto_settings entry.
+    # Positions still open at the end of the data are not counted.
+    results = {}
+    for symbol, chunks in datasets.items():
+        trades = backtest_symbol(chunks, settings[symbol], leverage, fee_rate)
+        results[symbol] = {
+            'LONG': summarize(trades['LONG']),
+            'SHORT': summarize(trades['SHORT']),
+            'total': summarize(np.concatenate([trades['LONG'], trades['SHORT']]))
+        }
+    return results
+
+def parse_symbol_paths(values):
+    # Parse SYMBOL=path arguments.
+    paths = {}
+    for value in values or []:
+        symbol, path = value.split('=', 1)
+        paths[symbol.upper()] = path
+    return paths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest crypto_settings from config.py on historical klines or aggTrades.")
+    parser.add_argument('data', nargs='+', help="SYMBOL=path to a CSV or Parquet file")
+    parser.add_argument('--mark', action='append', help="SYMBOL=path to mark price klines with the same rows, used for MARK_PRICE symbols")
+    parser.add_argument('--kind', choices=('klines', 'aggTrades'), default='klines')
+    parser.add_argument('--fee', type=float, default=0.0004, help="Taker fee rate per fill")
+    parser.add_argument('--chunk-size', type=int, default=500000)
+    args = parser.parse_args()
+
+    data_paths = parse_symbol_paths(args.data)
+    mark_paths = parse_symbol_paths(args.mark)
+    datasets = {}
+    for symbol, path in data_paths.items():
+        chunks = load_prices(path, args.kind, args.chunk_size)
+        if symbol in mark_paths:
+            chunks = with_mark_prices(chunks, load_prices(mark_paths[symbol], 'klines', args.chunk_size))
+        datasets[symbol] = chunks
+
+    for symbol, result in run_backtest(datasets, fee_rate=args.fee).items():
+        for position_side, summary in result.items():
+            print(f"{symbol} {position_side}: trades={summary['trades']} pnl={summary['pnl']:.4f} win_rate={summary['win_rate']:.2%} stop_losses={summary['stop_losses']} max_drawdown={summary['max_drawdown']:.4f}")
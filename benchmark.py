@@ -0,0 +1,362 @@
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+import time
+import tracemalloc
+from decimal import Decimal
+import http_client
+from config import crypto_settings, max_concurrent_symbols, cycle_deadline
+from order_management import handle_symbol
+from account_snapshot import AccountSnapshot
+from account_config import account_config
+from exchange_filters import exchange_filters
+from clock_sync import clock
+from scheduler import SymbolScheduler
+from mock_server import MockFuturesServer, MockFuturesStream
+from price_cache import price_cache
+from exchange_filters import SymbolFilters
+from reconciler import index_orders, reconcile_side
+from strategy import entry_side, close_side
+import payloads
+
+PROTECTIVE_ORDER_TYPES = ('STOP_MARKET',)  # Orders that count as protecting a position
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+def run_cycle(server, scheduler, settings):
+    # Run one main.py cycle against the server. Returns the cycle time in seconds and the cycle start.
+    start = time.monotonic()
+    snapshot = AccountSnapshot.fetch('key', 'secret', symbols=settings)
+    if snapshot is None:
+        return time.monotonic() - start, start
+    account_config.load(snapshot.setup)
+    scheduler.run_cycle(settings, snapshot)
+    return time.monotonic() - start, start
+
+def time_to_protective_order(server, start):
+    # Seconds from the cycle start until the first protective order of every open position arrived.
+    first = {}
+    for received, symbol, position_side, order_type in server.order_log:
+        if order_type in PROTECTIVE_ORDER_TYPES and (symbol, position_side) not in first:
+            first[(symbol, position_side)] = received - start
+    return list(first.values())
+
+def benchmark(symbols, rounds=3, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=False, seed=1):
+    # Benchmark the cycles of one symbol count. A cold cycle starts from positions without protective
+    # orders, the steady cycle that follows has nothing left to do.
+    server = MockFuturesServer(symbols, latency, jitter, error_rate, seed=seed).start()
+    http_client.transport.base_url = server.url
+    limiter = http_client.transport.limiter
+    if not rate_limit:
+        http_client.transport.limiter = None  # Cycles run back to back here, not every 10 seconds
+    template = next(iter(crypto_settings.values()))
+    # Every other symbol is priced from the last price, which the ticker reports with an old trade time
+    settings = {symbol: dict(template, working_type=('MARK_PRICE', 'LAST_PRICE')[i % 2]) for i, symbol in enumerate(server.symbols)}
+    scheduler = SymbolScheduler(handle_symbol, max_concurrent_symbols, cycle_deadline)
+
+    try:
+        exchange_filters.invalidate()
+        exchange_filters.get(server.symbols[0])  # Load the filters and sync the clock before timing
+        clock.resync()
+
+        result = {'symbols': symbols, 'cold_cycle': [], 'cold_requests': [], 'cold_weight': [], 'steady_cycle': [], 'steady_requests': [], 'steady_weight': [], 'time_to_protective_order': [], 'errors': 0}
+        for _ in range(rounds):
+            server.reset()
+            account_config.invalidate()
+            cycle_time, start = run_cycle(server, scheduler, settings)
+            result['cold_cycle'].append(cycle_time)
+            result['cold_requests'].append(server.stats['requests'])
+            result['cold_weight'].append(server.stats['weight'])
+            result['time_to_protective_order'].extend(time_to_protective_order(server, start))
+            result['errors'] += server.stats['errors']
+
+            server.reset_stats()
+            cycle_time, _ = run_cycle(server, scheduler, settings)
+            result['steady_cycle'].append(cycle_time)
+            result['steady_requests'].append(server.stats['requests'])
+            result['steady_weight'].append(server.stats['weight'])
+            result['errors'] += server.stats['errors']
+    finally:
+        scheduler.shutdown()
+        server.stop()
+        http_client.transport.limiter = limiter
+
+    return {
+        'symbols': symbols,
+        'cold_cycle_ms': 1000 * sum(result['cold_cycle']) / rounds,
+        'cold_requests': sum(result['cold_requests']) / rounds,
+        'cold_weight': sum(result['cold_weight']) / rounds,
+        'steady_cycle_ms': 1000 * sum(result['steady_cycle']) / rounds,
+        'steady_requests': sum(result['steady_requests']) / rounds,
+        'steady_weight': sum(result['steady_weight']) / rounds,
+        'protective_p50_ms': 1000 * percentile(result['time_to_protective_order'], 50),
+        'protective_p99_ms': 1000 * percentile(result['time_to_protective_order'], 99),
+        'protected_positions': len(result['time_to_protective_order']) / rounds,
+        'errors': result['errors']
+    }
+
+def synthetic_state(rng, template, filters):
+    # A random account state of one symbol: positions on none, one or both sides and open orders that are
+    # missing, duplicated or left with a drifted quantity.
+    settings = dict(template, take_profit_enabled=rng.random() < 0.5)
+    positions = {}
+    orders = []
+    for position_side in ('LONG', 'SHORT'):
+        amount = rng.choice((0, 0, rng.randint(1, 50))) * filters.step_size
+        positions[position_side] = amount
+        if amount:
+            kinds = [(close_side(position_side), 'STOP_MARKET'), (close_side(position_side), 'TRAILING_STOP_MARKET'), (close_side(position_side), 'TAKE_PROFIT_MARKET')]
+        else:
+            kinds = [(entry_side(position_side), 'TRAILING_STOP_MARKET'), (close_side(position_side), 'STOP_MARKET')]
+        for side, order_type in kinds:
+            for _ in range(rng.choice((0, 1, 1, 1, 2))):
+                quantity = amount or Decimal(str(settings['order_quantity'])) * 10
+                if rng.random() < 0.2:
+                    quantity += filters.step_size * rng.randint(1, 5)  # Partial fill or changed settings
+                orders.append({'orderId': len(orders) + 1, 'symbol': 'SYNUSDT', 'side': side, 'type': order_type, 'positionSide': position_side,
+                               'origQty': str(quantity), 'executedQty': '0', 'priceRate': str(settings['callback_rate_close'] if amount else settings['callback_rate']),
+                               'stopPrice': '0' if order_type == 'TRAILING_STOP_MARKET' else str(rng.randint(40000, 60000))})
+    return settings, positions, orders
+
+def benchmark_reconciler(states=10000, seed=1):
+    # Time index_orders and reconcile_side of both sides over random account states.
+    rng = random.Random(seed)
+    filters = SymbolFilters(Decimal('0.001'), Decimal('0.01'), Decimal('0.001'), Decimal('1000'), Decimal('5'))
+    template = next(iter(crypto_settings.values()))
+    samples = [synthetic_state(rng, template, filters) for _ in range(states)]
+
+    actions = {}
+    start = time.perf_counter()
+    for settings, positions, orders in samples:
+        index = index_orders(orders)
+        for position_side, amount in positions.items():
+            for action in reconcile_side('SYNUSDT', position_side, settings, 10, amount, index, filters, 50000.0):
+                actions[action.action] = actions.get(action.action, 0) + 1
+    elapsed = time.perf_counter() - start
+    return {'states': states, 'total_ms': 1000 * elapsed, 'per_state_us': 1e6 * elapsed / states, 'actions': actions}
+
+def synthetic_payloads(rng, symbols, listed=400):
+    # positionRisk and openOrders bodies of an account trading symbols of the listed exchange symbols.
+    # positionRisk has a row for both sides of every listed symbol, open or not.
+    names = [f"SYM{i:03d}USDT" for i in range(listed)]
+    rows = []
+    for index, name in enumerate(names):
+        for position_side in ('LONG', 'SHORT'):
+            amount = rng.randint(1, 50) / 1000 if index < symbols and rng.random() < 0.5 else 0
+            amount = -amount if position_side == 'SHORT' else amount
+            rows.append({'symbol': name, 'positionAmt': f"{amount:.3f}", 'entryPrice': '100.0', 'breakEvenPrice': '0.0', 'markPrice': '101.0',
+                         'unRealizedProfit': '0.00000000', 'liquidationPrice': '0', 'leverage': '10', 'maxNotionalValue': '1000000',
+                         'marginType': 'isolated', 'isolatedMargin': '0.00000000', 'isAutoAddMargin': 'false', 'positionSide': position_side,
+                         'notional': '0', 'isolatedWallet': '0', 'updateTime': 1700000000000})
+    orders = []
+    for name in names[:symbols]:
+        for position_side in ('LONG', 'SHORT'):
+            orders.append({'orderId': len(orders) + 1, 'symbol': name, 'status': 'NEW', 'clientOrderId': f"tb-{len(orders)}", 'price': '0', 'avgPrice': '0',
+                           'origQty': '0.010', 'executedQty': '0', 'type': 'STOP_MARKET', 'side': 'SELL' if position_side == 'LONG' else 'BUY',
+                           'positionSide': position_side, 'stopPrice': '95.0', 'workingType': 'MARK_PRICE', 'priceRate': '0', 'updateTime': 1700000000000})
+    return json.dumps(rows).encode(), json.dumps(orders).encode(), names[:symbols]
+
+def scan_cycle(position_body, order_body, symbols):
+    # One cycle as before the snapshot: decode everything and scan all rows for every symbol and side.
+    positions = json.loads(position_body)
+    orders = json.loads(order_body)
+    for symbol in symbols:
+        for position_side in ('LONG', 'SHORT'):
+            next((p for p in positions if p['symbol'] == symbol and p['positionSide'] == position_side and float(p['positionAmt']) != 0), None)
+            [o for o in orders if o['symbol'] == symbol and o['positionSide'] == position_side]
+
+def snapshot_cycle(position_body, order_body, symbols, keep=None):
+    # One cycle with AccountSnapshot: decode once, index, and look every symbol and side up.
+    snapshot = AccountSnapshot(payloads.loads(position_body), payloads.loads(order_body), keep)
+    for symbol in symbols:
+        for position_side in ('LONG', 'SHORT'):
+            snapshot.get_position(symbol, position_side)
+            snapshot.get_open_orders(symbol, position_side)
+
+def measure(cycle, rounds):
+    # CPU milliseconds per cycle, and the peak of memory allocated during one cycle in KB.
+    start = time.process_time()
+    for _ in range(rounds):
+        cycle()
+    cpu = (time.process_time() - start) / rounds
+    tracemalloc.start()
+    cycle()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return 1000 * cpu, peak / 1024
+
+def benchmark_payloads(counts=(10, 100, 300), rounds=50, seed=1):
+    # Compare decoding and lookups of positionRisk and openOrders per cycle.
+    rng = random.Random(seed)
+    backend = 'orjson' if payloads.orjson is not None else 'json'
+    results = []
+    for count in counts:
+        position_body, order_body, symbols = synthetic_payloads(rng, count)
+        keep = set(symbols)
+        for name, cycle in (('linear scans', lambda: scan_cycle(position_body, order_body, symbols)),
+                            (f"all rows ({backend})", lambda: snapshot_cycle(position_body, order_body, symbols)),
+                            (f"filtered ({backend})", lambda: snapshot_cycle(position_body, order_body, symbols, keep))):
+            cpu_ms, peak_kb = measure(cycle, rounds)
+            results.append({'symbols': count, 'method': name, 'cpu_ms': cpu_ms, 'peak_kb': peak_kb})
+    return results
+
+def wait_for(condition, timeout):
+    # Poll condition until it returns something true or timeout seconds passed.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.005)
+    return None
+
+def benchmark_stream(symbols=5, timeout=10, seed=1):
+    # Drive the event-driven mode through the mock REST and stream servers. Every scenario changes the
+    # account on the server, which sends the stream events, and waits for the order the bot should send in
+    # response. Returns whether each scenario passed and the milliseconds from the event to that order.
+    from event_manager import EventDrivenManager  # Needs websocket-client
+    server = MockFuturesServer(symbols, position_ratio=0, seed=seed).start()
+    stream = MockFuturesStream(server).start()
+    http_client.transport.base_url = server.url
+    limiter = http_client.transport.limiter
+    http_client.transport.limiter = None
+    template = next(iter(crypto_settings.values()))
+    settings = {symbol: dict(template) for symbol in server.symbols}
+    scheduler = SymbolScheduler(handle_symbol, max_concurrent_symbols, cycle_deadline)
+    manager = EventDrivenManager(settings, scheduler, 'key', 'secret', stream.url, 60)
+    manager.stream.reconnect_delay = 0.1
+    manager.stream.keepalive_interval = 0.2
+    symbol = server.symbols[0]
+    results = []
+
+    def new_order(position_side, order_type, known=()):
+        # The newest open order of a side and type that is not in known.
+        orders = [order for order in server.find_orders(symbol, position_side, order_type) if order['orderId'] not in known]
+        return orders[-1] if orders else None
+
+    def scenario(name, action, condition):
+        start = time.monotonic()
+        try:
+            action()
+            passed = wait_for(condition, timeout) is not None
+        except Exception as e:  # For example no order to fill because an earlier scenario failed
+            logging.getLogger(__name__).error("Scenario %s failed: %s", name, e)
+            passed = False
+        results.append({'scenario': name, 'passed': passed, 'ms': 1000 * (time.monotonic() - start) if passed else None})
+        return passed
+
+    try:
+        exchange_filters.invalidate()
+        exchange_filters.get(symbol)
+        clock.resync()
+        account_config.invalidate()
+        threading.Thread(target=manager.run_forever, name='event-manager', daemon=True).start()
+
+        # Startup: REST reconciliation places an entry order on both sides of every symbol
+        scenario('startup entry orders', lambda: None, lambda: len(server.orders) == 2 * symbols and stream.connects)
+
+        # The LONG entry order fills: ACCOUNT_UPDATE opens the position, a stop loss and a close order follow
+        entry = new_order('LONG', 'TRAILING_STOP_MARKET')
+        scenario('entry fill -> stop loss', lambda: server.fill_order(entry['orderId']),
+                 lambda: new_order('LONG', 'STOP_MARKET') and [o for o in server.find_orders(symbol, 'LONG', 'TRAILING_STOP_MARKET') if o['side'] == 'SELL'])
+
+        # The stop loss is cancelled outside the bot: ORDER_TRADE_UPDATE CANCELED, the bot places it again
+        stop = new_order('LONG', 'STOP_MARKET')
+        scenario('external cancel -> stop loss', lambda: server.cancel_order(stop['orderId']), lambda: new_order('LONG', 'STOP_MARKET', {stop['orderId']}))
+
+        # Half of the close order fills: it stays open and keeps trailing, the stop loss is replaced for the
+        # rest at its old stop price
+        closers = lambda: [order for order in server.find_orders(symbol, 'LONG', 'TRAILING_STOP_MARKET') if order['side'] == 'SELL']
+        closer, stop = (closers() or [None])[0], new_order('LONG', 'STOP_MARKET')
+        half = float(closer['origQty']) / 2 if closer else 0
+        scenario('partial fill -> stop loss resized', lambda: server.fill_order(closer['orderId'], half),
+                 lambda: [order['orderId'] for order in closers()] == [closer['orderId']] and stop['orderId'] not in server.orders and
+                 [order for order in server.find_orders(symbol, 'LONG', 'STOP_MARKET') if order['stopPrice'] == stop['stopPrice'] and float(order['origQty']) == float(closer['origQty']) - half])
+
+        # The listen key is kept alive with PUT requests
+        scenario('listen key keepalive', lambda: None, lambda: server.stats['endpoints'].get('PUT /fapi/v1/listenKey'))
+
+        # The listen key expires: the stream reconnects with a new one and its events are handled again
+        scenario('listen key expiry -> reconnect', server.expire_listen_key, lambda: stream.connects >= 2 and len(server.listen_keys) >= 2 and stream.connections)
+        entry = new_order('SHORT', 'TRAILING_STOP_MARKET')
+        scenario('entry fill after reconnect -> stop loss', lambda: server.fill_order(entry['orderId']), lambda: new_order('SHORT', 'STOP_MARKET'))
+
+        # The stop loss is cancelled and its replacement rejected once: the side is handled again after a
+        # second, long before the next REST reconciliation
+        stop = new_order('SHORT', 'STOP_MARKET')
+        def reject_once():
+            server.reject_orders = 1
+            server.cancel_order(stop['orderId'])
+        scenario('rejected stop loss -> retry', reject_once, lambda: server.reject_orders == 0 and new_order('SHORT', 'STOP_MARKET', {stop['orderId']}))
+
+        # The stop loss is cancelled while the connection is down, so its event is lost: the reconnect
+        # triggers a REST reconciliation, which places it again
+        stop = new_order('SHORT', 'STOP_MARKET')
+        def cancel_unseen():
+            stream.muted = True
+            try:
+                server.cancel_order(stop['orderId'])
+                stream.drop_connections()
+            finally:
+                stream.muted = False
+        connects = stream.connects
+        scenario('events missed while disconnected -> reconcile', cancel_unseen, lambda: stream.connects > connects and new_order('SHORT', 'STOP_MARKET', {stop['orderId']}))
+
+        # Mark prices from the stream reach the price cache without a request
+        price = server.prices[symbol] * 1.01
+        scenario('mark price -> price cache', lambda: stream.push_mark_prices({symbol: price}),
+                 lambda: price_cache.prices['MARK_PRICE'].get(symbol, (None,))[0] == round(price, 2))
+    finally:
+        manager.stream.stop()
+        stream.stop()
+        server.stop()
+        http_client.transport.limiter = limiter
+    return results
+
+def print_results(results):
+    print(f"{'symbols':>7} {'cold ms':>9} {'cold req':>8} {'cold wt':>8} {'steady ms':>9} {'steady req':>10} {'steady wt':>9} {'prot p50':>9} {'prot p99':>9} {'protected':>9} {'errors':>6}")
+    for r in results:
+        print(f"{r['symbols']:>7} {r['cold_cycle_ms']:>9.1f} {r['cold_requests']:>8.0f} {r['cold_weight']:>8.0f} {r['steady_cycle_ms']:>9.1f} {r['steady_requests']:>10.0f} {r['steady_weight']:>9.0f} {r['protective_p50_ms']:>9.1f} {r['protective_p99_ms']:>9.1f} {r['protected_positions']:>9.0f} {r['errors']:>6}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark main.py cycles against an in-process mock of the Binance Futures API.")
+    parser.add_argument('--symbols', default='1,10,50,100,200', help="Comma separated symbol counts")
+    parser.add_argument('--rounds', type=int, default=3, help="Cold and steady cycle pairs per symbol count")
+    parser.add_argument('--latency', type=float, default=0.0, help="Added delay per response in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra delay per response, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 503 error")
+    parser.add_argument('--rate-limit', action='store_true', help="Keep the client-side rate limiter enabled")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--log-level', default='CRITICAL', help="Log level of the bot while benchmarking")
+    parser.add_argument('--reconciler', type=int, metavar='STATES', help="Only benchmark the order reconciler over this many random account states")
+    parser.add_argument('--payloads', action='store_true', help="Only benchmark decoding positionRisk and openOrders at 10, 100 and 300 symbols")
+    parser.add_argument('--stream', action='store_true', help="Only run the event-driven mode against the mock REST and WebSocket servers")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    if args.reconciler:
+        result = benchmark_reconciler(args.reconciler)
+        print(f"{result['states']} states in {result['total_ms']:.1f} ms, {result['per_state_us']:.1f} us per state, actions: {result['actions']}")
+        raise SystemExit
+    if args.payloads:
+        print(f"{'symbols':>7} {'method':<22} {'cpu ms':>8} {'peak KB':>8}")
+        for r in benchmark_payloads():
+            print(f"{r['symbols']:>7} {r['method']:<22} {r['cpu_ms']:>8.3f} {r['peak_kb']:>8.0f}")
+        raise SystemExit
+    if args.stream:
+        results = benchmark_stream()
+        for r in results:
+            print(f"{r['scenario']:<46} {'ok' if r['passed'] else 'FAILED':<7} {'' if r['ms'] is None else format(r['ms'], '.1f') + ' ms'}")
+        raise SystemExit(0 if all(r['passed'] for r in results) else 1)
+    results = [benchmark(int(count), args.rounds, args.latency, args.jitter, args.error_rate, args.rate_limit) for count in args.symbols.split(',')]
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
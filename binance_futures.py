@@ -1,157 +1,207 @@
-import requests
 import hashlib
 import hmac
-import time
-from config import api_key, api_secret, base_url
+import logging
+from urllib.parse import urlencode
+from config import api_key, api_secret, recv_window
+import http_client  # Shared pooled HTTP transport
+from payloads import loads  # JSON decoding, with orjson when it is installed
+from clock_sync import clock as default_clock  # Synced server time for signed requests
+from metrics import timed  # Call timing, the functions are left undecorated while metrics are disabled
+
+TIMESTAMP_ERROR_CODE = -1021  # Timestamp outside of recvWindow
+
+logger = logging.getLogger(__name__)
 
 # Common functions
+@timed('binance_call_seconds')
 def get_server_time():
     # Retrieve server time from the API.
-    response = requests.get(base_url + '/fapi/v1/time')
+    response = http_client.get('/fapi/v1/time')
     server_time = response.json()['serverTime']
-    print(f"Server time: {server_time}")
+    logger.debug("Server time: %s", server_time)
     return server_time
 
 def create_signature(query_string, secret):
     # Create HMAC SHA256 signature for the query string using the secret key.
     signature = hmac.new(secret.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256).hexdigest()
-    print(f"Signature: {signature}")
+    logger.debug("Signature: %s", signature)
     return signature
 
-def get_positions(api_key, api_secret):
-    # Retrieve positions from the API.
-    endpoint = '/fapi/v2/positionRisk'
-    timestamp = get_server_time()
-
-    query_string = f'timestamp={timestamp}'
-    signature = create_signature(query_string, api_secret)
-    
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-    
-    response = requests.get(base_url + endpoint + '?' + query_string + '&signature=' + signature, headers=headers)
-    positions = response.json()
-    return positions
-
-def has_positions(api_key, api_secret, symbol):
-    # Check if there are any positions for the given symbol.
-    print("Checking positions...")
-    positions = get_positions(api_key, api_secret)
-    has_long = False
-    has_short = False
-
-    for position in positions:
-        if position['symbol'] == symbol:
-            if position['positionSide'] == 'LONG' and float(position['positionAmt']) > 0:
-                has_long = True
-            elif position['positionSide'] == 'SHORT' and float(position['positionAmt']) < 0:
-                has_short = True
-
-    print(f"Has LONG: {has_long}, Has SHORT: {has_short}")
-    return has_long, has_short
-
-def check_if_positions_exist(symbol):
-    # Check if there are any long or short positions for the given symbol.
-    has_long, has_short = has_positions(api_key, api_secret, symbol)
-    return has_long, has_short
-
-def change_leverage(symbol, leverage, api_key, api_secret):
-    # Change the leverage for a specific symbol.
-    print("Changing leverage...")
-    endpoint = '/fapi/v1/leverage'
-    timestamp = int(time.time() * 1000)
-    params = {
-        'symbol': symbol,
-        'leverage': leverage,
-        'timestamp': timestamp
-    }
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-    
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    response = requests.post(base_url + endpoint, headers=headers, data=params)
-    print(f"Leverage change response: {response.json()}")
-    return response.json()
-
-def change_margin_type(symbol, margin_type, api_key, api_secret):
-    # Change the margin type for a specific symbol.
-    print("Changing margin type...")
-    endpoint = '/fapi/v1/marginType'
-    timestamp = int(time.time() * 1000)
-    params = {
-        'symbol': symbol,
-        'marginType': margin_type,
-        'timestamp': timestamp
-    }
-    
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-    
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    response = requests.post(base_url + endpoint, headers=headers, data=params)
-    print(f"Margin type change response: {response.json()}")
-    return response.json()
-
-def get_market_price(symbol, api_key, api_secret):
-    # Retrieve the current market price for a specific symbol.
+def is_timestamp_error(response):
+    # Check if the server rejected the request because of the timestamp.
+    if response.status_code != 400:
+        return False
     try:
-        endpoint = '/fapi/v1/ticker/price'
+        return response.json().get('code') == TIMESTAMP_ERROR_CODE
+    except ValueError:
+        return False
+
+class FuturesClient:
+    """API access of one account: its keys, the transport it sends through and the clock it signs with.
+
+    The transport carries the rate limiter, so accounts with their own transport also have their own
+    request weight and order budget. Without a transport and clock the shared ones are used.
+    """
+
+    def __init__(self, api_key, api_secret, transport=None, clock=None):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.transport = transport or http_client.transport
+        self.clock = clock or default_clock
+
+    @timed('binance_call_seconds')
+    def send_signed_request(self, method, endpoint, params):
+        # Sign the parameters with the synced server time and send the request. Retries once after a -1021 error.
+        for attempt in range(2):
+            request_params = dict(params)
+            request_params['timestamp'] = self.clock.now_ms()
+            request_params['recvWindow'] = recv_window
+
+            query_string = urlencode(request_params)
+            request_params['signature'] = create_signature(query_string, self.api_secret)
+
+            headers = {
+                'X-MBX-APIKEY': self.api_key
+            }
+
+            if method == 'POST' or method == 'PUT':
+                response = self.transport.request(method, endpoint, headers=headers, data=request_params)
+            else:
+                response = self.transport.request(method, endpoint, headers=headers, params=request_params)
+
+            if attempt == 0 and is_timestamp_error(response):
+                self.clock.resync()
+                continue
+            return response
+
+    @timed('binance_call_seconds')
+    def get_positions(self, symbol=None):
+        # Retrieve positions from the API, of all symbols or of one.
+        endpoint = '/fapi/v2/positionRisk'
+        response = self.send_signed_request('GET', endpoint, {'symbol': symbol} if symbol else {})
+        positions = loads(response.content)
+        return positions
+
+    @timed('binance_call_seconds')
+    def change_leverage(self, symbol, leverage):
+        # Change the leverage for a specific symbol.
+        logger.debug("Changing leverage...")
+        endpoint = '/fapi/v1/leverage'
         params = {
-            'symbol': symbol
+            'symbol': symbol,
+            'leverage': leverage
         }
 
-        response = requests.get(base_url + endpoint, params=params)
-        print("Market price response:", response.text)
+        response = self.send_signed_request('POST', endpoint, params)
+        result = response.json()
+        logger.info("Leverage change response: %s", result, extra={'symbol': symbol, 'response': result})
+        return result
 
-        if response.status_code == 200:
-            return float(response.json()['price'])
-        else:
-            print("Error: Failed to get market price. Status code:", response.status_code)
-            return None
-    except Exception as e:
-        print(f"Error getting market price: {e}")
-        return None
-    
-def get_open_orders(symbol, api_key, api_secret):
-    # Retrieve the list of open orders for a specific symbol.
-    try:
-        endpoint = '/fapi/v1/openOrders'
-        timestamp = int(time.time() * 1000)
+    @timed('binance_call_seconds')
+    def change_margin_type(self, symbol, margin_type):
+        # Change the margin type for a specific symbol.
+        logger.debug("Changing margin type...")
+        endpoint = '/fapi/v1/marginType'
         params = {
             'symbol': symbol,
-            'timestamp': timestamp
+            'marginType': margin_type
         }
 
-        query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-        signature = create_signature(query_string, api_secret)
-        params['signature'] = signature
+        response = self.send_signed_request('POST', endpoint, params)
+        result = response.json()
+        logger.info("Margin type change response: %s", result, extra={'symbol': symbol, 'response': result})
+        return result
+
+    @timed('binance_call_seconds')
+    def get_market_price(self, symbol):
+        # Retrieve the current market price for a specific symbol.
+        try:
+            endpoint = '/fapi/v1/ticker/price'
+            params = {
+                'symbol': symbol
+            }
+
+            response = self.transport.request('GET', endpoint, params=params)
+            if logger.isEnabledFor(logging.DEBUG):  # response.text decodes the whole body
+                logger.debug("Market price response: %s", response.text)
+
+            if response.status_code == 200:
+                return float(response.json()['price'])
+            else:
+                logger.error("Failed to get market price. Status code: %s", response.status_code, extra={'symbol': symbol})
+                return None
+        except Exception as e:
+            logger.error("Error getting market price: %s", e, extra={'symbol': symbol})
+            return None
 
-        headers = {
-            'X-MBX-APIKEY': api_key
-        }
+    @timed('binance_call_seconds')
+    def get_open_orders(self, symbol):
+        # Retrieve the list of open orders for a specific symbol.
+        try:
+            endpoint = '/fapi/v1/openOrders'
+            params = {
+                'symbol': symbol
+            }
+
+            logger.debug("Getting open orders... Params: %s", params)
+
+            response = self.send_signed_request('GET', endpoint, params)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Open orders response: %s", response.text)
+
+            if response.status_code == 200:
+                return loads(response.content)
+            else:
+                logger.error("Failed to get open orders. Status code: %s %s", response.status_code, response.text, extra={'symbol': symbol})
+                return None
+        except Exception as e:
+            logger.error("Error getting open orders: %s", e, extra={'symbol': symbol})
+            return None
+
+    @timed('binance_call_seconds')
+    def get_all_open_orders(self):
+        # Retrieve the open orders for all symbols with a single request.
+        try:
+            endpoint = '/fapi/v1/openOrders'
+
+            logger.debug("Getting all open orders...")
+            response = self.send_signed_request('GET', endpoint, {})
+
+            if response.status_code == 200:
+                return loads(response.content)
+            else:
+                logger.error("Failed to get all open orders. Status code: %s %s", response.status_code, response.text)
+                return None
+        except Exception as e:
+            logger.error("Error getting all open orders: %s", e)
+            return None
 
-        print("Getting open orders...")
-        print("Params:", params)
-        print("Query string:", query_string)
+# Client of the account in config.py, on the shared transport and clock
+default_client = FuturesClient(api_key, api_secret)
 
-        response = requests.get(base_url + endpoint, headers=headers, params=params)
-        print("Open orders response:", response.text)
+def client_for(api_key, api_secret):
+    # Return a client for keys passed to the module functions below.
+    if api_key == default_client.api_key and api_secret == default_client.api_secret:
+        return default_client
+    return FuturesClient(api_key, api_secret)
 
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print("Error: Failed to get open orders. Status code:", response.status_code)
-            print(response.json())
-            return None
-    except Exception as e:
-        print(f"Error getting open orders: {e}")
-        return None
+def send_signed_request(method, endpoint, params, api_key, api_secret):
+    return client_for(api_key, api_secret).send_signed_request(method, endpoint, params)
+
+def get_positions(api_key, api_secret):
+    return client_for(api_key, api_secret).get_positions()
+
+def change_leverage(symbol, leverage, api_key, api_secret):
+    return client_for(api_key, api_secret).change_leverage(symbol, leverage)
+
+def change_margin_type(symbol, margin_type, api_key, api_secret):
+    return client_for(api_key, api_secret).change_margin_type(symbol, margin_type)
+
+def get_market_price(symbol, api_key, api_secret):
+    return client_for(api_key, api_secret).get_market_price(symbol)
+
+def get_open_orders(symbol, api_key, api_secret):
+    return client_for(api_key, api_secret).get_open_orders(symbol)
+
+def get_all_open_orders(api_key, api_secret):
+    return client_for(api_key, api_secret).get_all_open_orders()
@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+import http_client  # Shared pooled HTTP transport
+from config import time_sync_interval, time_sync_samples, time_sync_max_drift
+
+logger = logging.getLogger(__name__)
+
+class ClockSync:
+    """Keep a local estimate of the offset between the local clock and the server clock."""
+
+    def __init__(self, interval, samples, max_drift, transport=None):
+        self.transport = transport or http_client.transport  # Transport of the account this clock signs for
+        self.interval = interval  # Seconds between background syncs
+        self.samples = samples  # Samples taken per sync, the one with the lowest round-trip time wins
+        self.max_drift = max_drift  # Milliseconds of offset change that trigger an immediate resync
+        self.offset = 0.0  # Server time minus local time in milliseconds
+        self.rtt = None  # Round-trip time of the sample the offset is based on
+        self.last_sync = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        # Measure one offset sample, assuming the server stamped the time halfway through the round trip.
+        start = time.time() * 1000
+        response = self.transport.request('GET', '/fapi/v1/time')
+        end = time.time() * 1000
+        server_time = response.json()['serverTime']
+        rtt = end - start
+        return server_time - (start + end) / 2, rtt
+
+    def sync(self):
+        # Take a few samples and keep the offset of the fastest round trip.
+        best = None
+        for _ in range(self.samples):
+            try:
+                offset, rtt = self.sample()
+            except Exception as e:
+                logger.warning("Error syncing server time: %s", e)
+                continue
+            if best is None or rtt < best[1]:
+                best = (offset, rtt)
+
+        if best is None:
+            return False
+
+        with self._lock:
+            drift = abs(best[0] - self.offset)
+            self.offset, self.rtt = best
+            synced_before = self.last_sync is not None
+            self.last_sync = time.time()
+        logger.debug("Clock offset: %.1f ms (rtt %.1f ms)", self.offset, self.rtt)
+        return not (synced_before and drift > self.max_drift)
+
+    def now_ms(self):
+        # Return the current server time estimate in milliseconds.
+        if self.last_sync is None:
+            self.sync()
+        return int(time.time() * 1000 + self.offset)
+
+    def resync(self):
+        # Force a sync, for example after the server rejected a timestamp (-1021).
+        logger.info("Resyncing server time...")
+        self.sync()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.sync():
+                logger.warning("Clock drift detected, resyncing...")
+                self.sync()
+
+    def start(self):
+        # Sync once and keep syncing in a background thread.
+        if self._thread is not None:
+            return
+        self.sync()
+        self._thread = threading.Thread(target=self._run, name='clock-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+# Shared clock used by all signed requests
+clock = ClockSync(time_sync_interval, time_sync_samples, time_sync_max_drift)
+
+def now_ms():
+    return clock.now_ms()
@@ -4,14 +4,94 @@ api_secret = 'YOUR_API_SECRET'  # Binance API Secret
 
 # Testnet URL
 base_url = 'https://testnet.binancefuture.com'  # URL for Binance Futures Testnet
+ws_base_url = 'wss://stream.binancefuture.com'  # WebSocket URL for Binance Futures Testnet
 
 # Production URL (uncomment this line if you want to use the production environment)
 #base_url = 'https://fapi.binance.com'  # URL for Binance Futures Production
+#ws_base_url = 'wss://fstream.binance.com'  # WebSocket URL for Binance Futures Production
 
 # Settings
 leverage = 10  # Leverage to use for the positions. Can vary between 1-125 depending on the symbol. Adjust this setting based on your risk management decision.
 margin_type = 'ISOLATED'  # Margin type: ISOLATED or CROSSED
 
+# Scheduler settings
+max_concurrent_symbols = 8  # Maximum number of symbols handled at the same time
+cycle_deadline = 8  # Seconds to wait for all symbols in one cycle before moving on
+
+# HTTP transport settings
+http_pool_size = 10  # Number of keep-alive connections kept open to the API
+http_timeout = 10  # Request timeout in seconds
+http_max_retries = 3  # Retries on connection errors and 5xx responses (orders are not re-sent on 5xx, 429 pauses all requests instead)
+http_backoff_factor = 0.5  # Backoff between retries: factor * 2 ** (retry - 1) seconds
+
+# Rate limit settings (Binance Futures defaults, check /fapi/v1/exchangeInfo rateLimits for your account)
+request_weight_limit = 2400  # Request weight per minute
+order_limit_10s = 300  # Orders per 10 seconds
+order_limit_1m = 1200  # Orders per minute
+read_weight_reserve = 0.2  # Share of the weight budget that only order placement and cancellation may use
+
+# Server time sync settings
+recv_window = 5000  # Milliseconds a signed request stays valid after its timestamp
+time_sync_interval = 60  # Seconds between background server time syncs
+time_sync_samples = 3  # Samples per sync, the one with the lowest round-trip time is used
+time_sync_max_drift = 500  # Milliseconds of offset change that trigger an immediate resync
+
+# Exchange info settings
+exchange_info_ttl = 3600  # Seconds the symbol precision rules from /fapi/v1/exchangeInfo are cached
+
+# Price settings
+price_cache_ttl = 1  # Seconds a price is used before the prices of all symbols are loaded again
+price_max_age = 5  # Seconds after which a price is too old to place a stop loss or take profit order with
+
+# Event-driven mode settings
+event_driven = False  # If True, react to user data and mark price stream events instead of polling every cycle
+rest_reconcile_interval = 60  # Seconds between full REST reconciliations in the event-driven mode
+
+# Adaptive polling settings
+adaptive_polling = False  # If True, poll every symbol at its own interval instead of all symbols every 10 seconds
+poll_interval_near_stop = 0.5  # Seconds between polls of a symbol whose position is close to its stop loss
+poll_interval_position = 1  # Seconds between polls of a symbol with an open position
+poll_interval_idle = 10  # Seconds between polls of a flat symbol, doubled while nothing changes
+poll_interval_idle_max = 60  # Upper limit for the interval of a flat symbol
+poll_near_stop_fraction = 0.5  # Share of stop_loss_roi a position must have lost to count as close to its stop loss
+poll_weight_budget = 1200  # Request weight per minute the polls may use, intervals are stretched beyond it
+
+# Local state settings
+state_enabled = True  # If True, record sent orders, handled positions and leverage/margin type in a local SQLite database
+state_dir = 'state'  # Directory for the state databases
+
+# Logging settings
+log_dir = 'logs'  # Directory for the log files
+log_file = 'bot.jsonl'  # Log file name, one JSON object per line
+log_level = 'INFO'  # Default level: DEBUG, INFO, WARNING or ERROR
+log_levels = {}  # Levels per module, for example {'binance_futures': 'DEBUG', 'order_management': 'INFO'}
+log_console_level = 'INFO'  # Level of the messages also shown in the console
+log_rotation = 'size'  # 'size' or 'time'
+log_max_bytes = 10 * 1024 * 1024  # File size that starts a new file when log_rotation is 'size'
+log_rotate_when = 'midnight'  # When to start a new file when log_rotation is 'time' (see logging.handlers.TimedRotatingFileHandler)
+log_backup_count = 7  # Number of old log files kept
+
+# Metrics settings
+metrics_enabled = False  # If True, record timings and order counters and serve them on /metrics
+metrics_host = '127.0.0.1'  # Address of the metrics endpoint, keep it local
+metrics_port = 9108  # Port of the metrics endpoint
+profiler_interval = 0  # Seconds between stack samples of the sampling profiler served on /profile, 0 disables it
+
+# Multi-account settings, used by runner.py instead of the single account above
+accounts = [
+    # {
+    #     "name": "sub1",                 # Name used in logs and log file names
+    #     "api_key": "SUB1_API_KEY",
+    #     "api_secret": "SUB1_API_SECRET",
+    #     "base_url": base_url,           # Optional, defaults to base_url
+    #     "leverage": 10,                 # Optional, defaults to leverage
+    #     "margin_type": "ISOLATED",      # Optional, defaults to margin_type
+    #     "crypto_settings": {...},       # Same format as crypto_settings below
+    # },
+]
+symbols_per_worker = 50  # Maximum symbols of one account handled by one worker process
+worker_restart_delay = 5  # Seconds before a crashed worker is restarted, doubled after every quick crash up to 5 minutes
+
 # Cryptocurrency-specific settings. You can add multiple symbols using this template.
 crypto_settings = {
     "BTCUSDT": {
@@ -29,8 +109,43 @@ crypto_settings = {
 # api_key: Your Binance API key.
 # api_secret: Your Binance API secret key.
 # base_url: The base URL for the Binance Futures API. Use the testnet URL for testing and the production URL for real trading.
+# ws_base_url: The base URL for the Binance Futures WebSocket streams. Must match base_url (testnet or production).
 # leverage: The leverage level you want to use for trading.
 # margin_type: The type of margin you want to use ('ISOLATED' or 'CROSSED').
+# max_concurrent_symbols: The maximum number of symbols whose orders are handled concurrently.
+# cycle_deadline: The time in seconds one cycle may take before pending symbols are dropped until the next cycle.
+# http_pool_size: The number of pooled keep-alive connections. Should be at least max_concurrent_symbols.
+# http_timeout: The timeout in seconds for a single HTTP request.
+# http_max_retries: How many times a failed request is retried. Every retry passes the rate limiter like a new request. A 429 response is not retried: the rate limiter stops all requests for the Retry-After time, since retrying right away can get the IP banned (418).
+# http_backoff_factor: The base of the exponential backoff between retries.
+# request_weight_limit: The request weight the bot may use per minute. Requests wait when the budget is used up.
+# order_limit_10s: The number of orders the bot may place per 10 seconds.
+# order_limit_1m: The number of orders the bot may place per minute.
+# read_weight_reserve: The share of the weight budget kept free for placing and cancelling orders, so that polling cannot starve them.
+# recv_window: How long in milliseconds the server accepts a signed request after its timestamp.
+# time_sync_interval: How often in seconds the local clock offset to the server is re-estimated.
+# time_sync_samples: How many /fapi/v1/time samples are taken per sync.
+# time_sync_max_drift: The offset change in milliseconds between two syncs that triggers an immediate resync.
+# exchange_info_ttl: How long in seconds the step size, tick size and quantity limits of the symbols are cached. They are also reloaded after an order is rejected because of them.
+# price_cache_ttl: How long in seconds the last and mark prices are reused before all of them are loaded again with one request. Orders with working_type MARK_PRICE are priced from the mark price, the others from the last price. In the event-driven mode the mark prices come from the stream once per second and need no requests, as long as price_cache_ttl is at least 2.
+# price_max_age: The age in seconds, measured with the server time, above which a price is not used. No stop loss or take profit order is placed until a recent price is available.
+# event_driven: If set to True, the bot listens to the user data stream and handles a symbol only when its orders or positions change. Requires the websocket-client package.
+# rest_reconcile_interval: How often in seconds the event-driven mode re-reads all positions and open orders over REST as a fallback. They are also re-read after every reconnect of the stream. Sides whose orders failed are handled again after 1 second, then after twice as long each time up to 60 seconds.
+# adaptive_polling: If set to True, symbols with an open position are polled every poll_interval_position seconds, or every poll_interval_near_stop seconds once the position lost poll_near_stop_fraction of its stop_loss_roi. Flat symbols are polled every poll_interval_idle seconds, backing off up to poll_interval_idle_max while their orders do not change. Ignored when event_driven is True.
+# poll_weight_budget: The request weight per minute the polls may use. A poll of one symbol uses 6, with or without a position, since the prices of stop loss and take profit orders are loaded for all symbols at once (see price_cache_ttl). When more symbols are due at once than that, all symbols are read with one request. The intervals are stretched when the budget would be exceeded, those of the flat symbols first.
+# state_enabled: If set to True, every order gets a newClientOrderId and is recorded in state_dir before it is sent, together with the positions the symbols were last handled with and their leverage and margin type. After a restart, one request for the positions and one for the open orders are compared with this state, and only the symbols that changed while the bot was stopped are handled in the first cycle. An order whose answer was lost is resent with the same newClientOrderId, so it cannot be placed twice.
+# state_dir: Where the state databases are kept. main.py uses bot.db, runner.py one file per worker. Delete them to start from scratch.
+# log_dir, log_file: Where the log is written. Every line is a JSON object with the time, level, module and message, plus fields such as the order response.
+# log_level: The lowest level that is logged. DEBUG includes every request, response and decision of the bot.
+# log_levels: Overrides log_level for single modules, for example to debug only the order placement.
+# log_console_level: The lowest level that is also printed to the console.
+# log_rotation: Whether a new log file is started by size (log_max_bytes) or by time (log_rotate_when).
+# log_backup_count: How many rotated log files are kept before the oldest is deleted.
+# metrics_enabled: If set to True, request latencies per endpoint, handle_orders phase timings per symbol, order counters and the scheduler, HTTP and rate limit stats are served in the Prometheus format on http://metrics_host:metrics_port/metrics. When False, nothing is recorded.
+# profiler_interval: If above 0 (and metrics_enabled is True), the stacks of all threads are sampled every profiler_interval seconds and served as folded stacks on /profile, for example for flamegraph.pl. 0.01 is a reasonable value.
+# accounts: A list of accounts for runner.py, each with its own keys and crypto_settings. main.py ignores it and uses api_key, api_secret and crypto_settings.
+# symbols_per_worker: How many symbols of one account a worker process handles. Accounts with more symbols are split between several workers, which share the rate limits of the account.
+# worker_restart_delay: How long runner.py waits before restarting a worker process that exited.
 # crypto_settings: A dictionary containing specific settings for different cryptocurrency pairs.
 #   - order_quantity: The amount of the cryptocurrency you want to trade.
 #   - callback_rate: The callback rate percentage for the trailing stop order (when it opens).
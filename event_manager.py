@@ -0,0 +1,151 @@
+import logging
+import queue
+import time
+from account_snapshot import AccountSnapshot
+from account_config import account_config
+from config import leverage, margin_type
+from user_stream import FuturesStream, STREAM_CONNECTED
+from price_cache import price_cache
+
+logger = logging.getLogger(__name__)
+
+OPEN_ORDER_STATUSES = ('NEW', 'PARTIALLY_FILLED')
+RETRY_DELAY = 1  # Seconds before a side that could not be settled is handled again
+MAX_RETRY_DELAY = 60  # The retry delay doubles after every failure up to this
+
+def order_from_event(event_order):
+    # Convert the order of an ORDER_TRADE_UPDATE event to the format returned by /fapi/v1/openOrders.
+    return {
+        'symbol': event_order['s'],
+        'orderId': event_order['i'],
+        'clientOrderId': event_order.get('c'),
+        'side': event_order['S'],
+        'type': event_order['o'],
+        'positionSide': event_order['ps'],
+        'origQty': event_order.get('q'),
+        'executedQty': event_order.get('z'),  # Filled so far, the reconciler compares the rest with the position
+        'stopPrice': event_order.get('sp'),
+        'priceRate': event_order.get('cr'),
+        'workingType': event_order.get('wt'),
+        'status': event_order['X']
+    }
+
+class EventDrivenManager:
+    """Keep positions and orders up to date from the stream and handle only the symbols that changed."""
+
+    def __init__(self, settings, scheduler, api_key, api_secret, ws_base_url, reconcile_interval, store=None):
+        self.settings = settings
+        self.scheduler = scheduler
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.reconcile_interval = reconcile_interval  # Seconds between REST reconciliations
+        self.store = store  # StateStore of the last run, limits the first reconciliation to the sides that changed
+        self.snapshot = None
+        self.dirty = {}  # symbol -> set of position sides that need handling
+        self.retries = {}  # (symbol, positionSide) -> [due time or None once marked dirty, delay] of unsettled sides
+        self.reconciled_at = None  # time.monotonic() at the start of the last reconciliation
+        self.resync = False  # The stream reconnected after the last reconciliation, events may have been missed
+        self.events = queue.Queue()
+        self.stream = FuturesStream(ws_base_url, api_key, settings.keys(), self.events.put)
+
+    def mark_dirty(self, symbol, position_side):
+        if symbol in self.settings:
+            self.dirty.setdefault(symbol, set()).add(position_side)
+
+    def apply_event(self, event):
+        # Update the local positions and orders from one stream event.
+        event_type = event.get('e')
+
+        if event_type == 'ORDER_TRADE_UPDATE':
+            order = order_from_event(event['o'])
+            if order['status'] in OPEN_ORDER_STATUSES:
+                self.snapshot.add_order(order)
+            else:
+                # A filled, cancelled or expired order may leave the side without protection
+                self.snapshot.remove_order(order['symbol'], order['positionSide'], order['orderId'])
+                self.mark_dirty(order['symbol'], order['positionSide'])
+
+        elif event_type == 'ACCOUNT_UPDATE':
+            for position in event['a'].get('P', []):
+                self.snapshot.update_position(position['s'], position['ps'], position['pa'], position.get('ep'))
+                self.mark_dirty(position['s'], position['ps'])
+
+        elif event_type == 'markPriceUpdate':
+            price_cache.update(event['s'], 'MARK_PRICE', event['p'], event['E'])  # Stop prices of MARK_PRICE orders need no request
+
+        elif event_type == STREAM_CONNECTED:
+            # Events sent while the stream was down are lost, a reconciliation picks up what they changed
+            if self.reconciled_at is None or event['time'] > self.reconciled_at:
+                self.resync = True
+
+    def reconcile(self):
+        # Replace the local state with a fresh REST snapshot and handle every symbol.
+        logger.debug("Reconciling positions and open orders...")
+        self.reconciled_at = time.monotonic()
+        snapshot = AccountSnapshot.fetch(self.api_key, self.api_secret, symbols=self.settings)
+        if snapshot is None:
+            logger.warning("Failed to reconcile, keeping the local state.")
+            return False
+        first = self.snapshot is None
+        account_config.load(snapshot.setup)  # Leverage and margin type as the exchange reports them
+        self.snapshot = snapshot
+        if first and self.store is not None:
+            for symbol, sides in self.store.reconcile(snapshot, self.settings, leverage, margin_type).items():
+                self.dirty.setdefault(symbol, set()).update(sides)
+            return True
+        for symbol in self.settings:
+            self.dirty[symbol] = {'LONG', 'SHORT'}
+        return True
+
+    def handle_dirty(self):
+        # Handle the symbols and sides that changed since the last dispatch, and those whose retry is due.
+        now = time.monotonic()
+        for (symbol, position_side), retry in self.retries.items():
+            if retry[0] is not None and retry[0] <= now:
+                retry[0] = None
+                self.mark_dirty(symbol, position_side)
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, {}
+        settings = {symbol: self.settings[symbol] for symbol in dirty}
+        failed = {}
+        self.scheduler.run_cycle(settings, self.snapshot, dirty, failed)
+
+        # Sides with failed orders or without a price are handled again after a growing delay
+        now = time.monotonic()
+        for symbol, position_sides in dirty.items():
+            for position_side in position_sides:
+                key = (symbol, position_side)
+                if position_side not in failed.get(symbol, ()):
+                    self.retries.pop(key, None)
+                    continue
+                delay = min(self.retries[key][1] * 2, MAX_RETRY_DELAY) if key in self.retries else RETRY_DELAY
+                self.retries[key] = [now + delay, delay]
+                logger.warning("%s %s not settled, retrying in %ss", symbol, position_side, delay, extra={'symbol': symbol})
+
+    def next_wakeup(self, next_reconcile):
+        # Monotonic time of the next reconciliation or retry, whichever comes first.
+        return min([next_reconcile] + [retry[0] for retry in self.retries.values() if retry[0] is not None])
+
+    def run_forever(self):
+        # Consume stream events, falling back to periodic REST reconciliation.
+        self.stream.start()
+        self.stream.connected.wait(self.reconcile_interval)  # Events from the connect on are received, the reconciliation covers the rest
+        while not self.reconcile():
+            time.sleep(self.reconcile_interval)
+        next_reconcile = time.monotonic() + self.reconcile_interval
+
+        while True:
+            self.handle_dirty()  # Before waiting, so that a reconciliation is handled without waiting for an event
+
+            try:
+                self.apply_event(self.events.get(timeout=max(self.next_wakeup(next_reconcile) - time.monotonic(), 0)))
+                while True:
+                    self.apply_event(self.events.get_nowait())  # Apply everything already queued before handling
+            except queue.Empty:
+                pass
+
+            if self.resync or time.monotonic() >= next_reconcile:
+                self.resync = False
+                self.reconcile()
+                next_reconcile = time.monotonic() + self.reconcile_interval
@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+import http_client  # Shared pooled HTTP transport
+from config import exchange_info_ttl
+from strategy import entry_side
+
+logger = logging.getLogger(__name__)
+
+ONE = Decimal(1)
+RETRY_DELAY = 5  # Seconds before a failed reload is tried again, doubled after every failure
+MAX_RETRY_DELAY = 300
+FILTER_ERROR_CODES = (-1111, -1013, -4003, -4014)  # Precision, filter failure, quantity and tick size errors. A min notional error (-4164) depends on the price, reloading does not help
+
+class SymbolFilters:
+    """Trading rules of one symbol from /fapi/v1/exchangeInfo."""
+
+    __slots__ = ('step_size', 'tick_size', 'min_qty', 'max_qty', 'min_notional')
+
+    def __init__(self, step_size, tick_size, min_qty, max_qty, min_notional):
+        self.step_size = step_size
+        self.tick_size = tick_size
+        self.min_qty = min_qty
+        self.max_qty = max_qty
+        self.min_notional = min_notional
+
+    @classmethod
+    def from_symbol_info(cls, symbol_info):
+        filters = {f['filterType']: f for f in symbol_info['filters']}
+        lot_size = filters['LOT_SIZE']
+        max_qty = Decimal(lot_size['maxQty'])
+        if 'MARKET_LOT_SIZE' in filters:
+            max_qty = min(max_qty, Decimal(filters['MARKET_LOT_SIZE']['maxQty']))  # Stop and trailing orders execute as market orders
+        min_notional = Decimal(filters['MIN_NOTIONAL']['notional']) if 'MIN_NOTIONAL' in filters else Decimal(0)
+        return cls(
+            Decimal(lot_size['stepSize']).normalize(),
+            Decimal(filters['PRICE_FILTER']['tickSize']).normalize(),
+            Decimal(lot_size['minQty']),
+            max_qty,
+            min_notional
+        )
+
+def round_step(value, step, rounding):
+    # Round value to a multiple of step without float error.
+    return (Decimal(repr(value)) / step).quantize(ONE, rounding=rounding) * step
+
+class ExchangeFilters:
+    """Cache of the trading rules of every symbol, refreshed after ttl seconds or after a filter error.
+
+    While a reload fails the rules loaded last are kept in use, and the reload is retried with a growing delay.
+    """
+
+    def __init__(self, ttl, transport=None):
+        self.ttl = ttl
+        self.transport = transport or http_client.transport  # Its rate limiter counts the reloads
+        self.symbols = {}  # symbol -> SymbolFilters
+        self.loaded_at = None
+        self.retry_at = None  # time.monotonic() before which a failed reload is not tried again
+        self.retry_delay = RETRY_DELAY
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # Load the trading rules of all symbols with one request.
+        try:
+            response = self.transport.request('GET', '/fapi/v1/exchangeInfo')
+            if response.status_code != 200:
+                logger.error("Failed to get exchange info. Status code: %s", response.status_code)
+                return False
+            symbols = {}
+            for symbol_info in response.json()['symbols']:
+                try:
+                    symbols[symbol_info['symbol']] = SymbolFilters.from_symbol_info(symbol_info)
+                except KeyError:
+                    continue  # Symbols without the usual filters cannot be traded by the bot
+        except Exception as e:
+            logger.error("Error getting exchange info: %s", e)
+            return False
+        self.symbols = symbols
+        self.loaded_at = time.monotonic()
+        return True
+
+    def expired(self, now):
+        # Whether a reload is due: the cache is older than ttl or was invalidated, and no failed reload is backing off.
+        if self.retry_at is not None and now < self.retry_at:
+            return False
+        return self.loaded_at is None or now - self.loaded_at > self.ttl
+
+    def get(self, symbol):
+        # Return the filters of a symbol, reloading the cache when it has expired. Returns None for unknown
+        # symbols, or if the rules were never loaded.
+        if self.expired(time.monotonic()):
+            with self._lock:
+                if self.expired(time.monotonic()):
+                    if self.refresh():
+                        self.retry_at, self.retry_delay = None, RETRY_DELAY
+                    else:
+                        logger.warning("Keeping the loaded exchange info, retrying in %ss", self.retry_delay)
+                        self.retry_at = time.monotonic() + self.retry_delay
+                        self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+        return self.symbols.get(symbol)
+
+    def invalidate(self):
+        # Reload on the next lookup, or once a failed reload may be retried. The loaded rules stay in use until then.
+        self.loaded_at = None
+
+# Shared cache used by every order builder
+exchange_filters = ExchangeFilters(exchange_info_ttl)
+
+def round_quantity(filters, quantity):
+    # Round the quantity down to the step size in filters and return it as a string.
+    if filters is None:
+        return round(quantity, 3)  # Fall back to the old fixed precision if the rules are unavailable
+    return format(round_step(quantity, filters.step_size, ROUND_DOWN), 'f')
+
+def round_price(filters, price):
+    # Round the price to the nearest tick in filters and return it as a string.
+    if filters is None:
+        return round(price, 7)
+    return format(round_step(price, filters.tick_size, ROUND_HALF_UP), 'f')
+
+def validate_order(params, price=None):
+    # Check a built order against the filters of its symbol. Returns an error message or None.
+    # The notional is only checked when a reference price (float or string) is given, and only for orders
+    # that open a position. Orders that close one are reduce-only, the exchange does not apply it to them.
+    filters = exchange_filters.get(params['symbol'])
+    if filters is None:
+        return None
+    quantity = Decimal(str(params['quantity']))
+    if quantity < filters.min_qty:
+        return f"Quantity {quantity} is below the minimum {filters.min_qty}"
+    if quantity > filters.max_qty:
+        return f"Quantity {quantity} is above the maximum {filters.max_qty}"
+    opens = params['side'] == entry_side(params['positionSide'])
+    if opens and price is not None and quantity * Decimal(str(price)) < filters.min_notional:
+        return f"Notional {quantity * Decimal(str(price))} is below the minimum {filters.min_notional}"
+    return None
+
+def check_filter_error(response):
+    # Reload the filters if the server rejected an order because of them.
+    if isinstance(response, dict) and response.get('code') in FILTER_ERROR_CODES:
+        logger.warning("Order rejected by exchange filters (%s), reloading exchange info...", response.get('code'))
+        exchange_filters.invalidate()
@@ -0,0 +1,125 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rate_limiter import limiter  # Shared request weight and order rate budget
+from metrics import observe  # Latency histograms, no-op while metrics are disabled
+from config import base_url, http_pool_size, http_timeout, http_max_retries, http_backoff_factor
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)  # Not 429, the rate limiter pauses every thread for Retry-After instead
+RETRY_METHODS = frozenset(['GET', 'PUT', 'DELETE'])  # Orders are never re-sent on a status retry
+MAX_BACKOFF = 120  # Upper limit of the delay between retries in seconds
+
+class HttpTransport:
+    """Shared keep-alive HTTP session for all requests to the Binance Futures API."""
+
+    def __init__(self, base_url, pool_size, timeout, max_retries, backoff_factor, limiter=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limiter = limiter  # Optional RateLimiter that every request must pass
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # urllib3 only retries connection errors, for all methods because the request was not sent, and read
+        # errors of idempotent methods. Error responses are retried in request, where every attempt passes the
+        # rate limiter and reports its weight to it.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            allowed_methods=RETRY_METHODS,
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'errors': 0,  # Requests that raised before a response was received
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            'endpoints': {},  # endpoint -> {'requests': int, 'total_latency': float, 'max_latency': float}
+        }
+
+    def request(self, method, endpoint, **kwargs):
+        # Send a request, retrying 5xx responses of idempotent methods up to max_retries times.
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = self.max_retries + 1 if method in RETRY_METHODS else 1
+        for attempt in range(attempts):
+            response = self._send(method, endpoint, kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == attempts - 1:
+                return response
+            time.sleep(self.retry_delay(response, attempt))
+
+    def retry_delay(self, response, attempt):
+        # Seconds to wait after failed attempt number attempt, counted from 0: the Retry-After of the response
+        # if it has one, or an exponential backoff.
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(int(retry_after), MAX_BACKOFF)
+        return min(self.backoff_factor * 2 ** attempt, MAX_BACKOFF)
+
+    def _send(self, method, endpoint, kwargs):
+        # Send one attempt through the pooled session and record its latency.
+        if self.limiter is not None:
+            self.limiter.acquire(method, endpoint, kwargs.get('params') or kwargs.get('data'))
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + endpoint, **kwargs)
+            if self.limiter is not None:
+                self.limiter.update(response)
+            return response
+        except Exception:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - start)
+
+    def _record(self, endpoint, latency):
+        observe('http_request_seconds', latency, endpoint=endpoint)
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['total_latency'] += latency
+            self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+            endpoint_stats = self.stats['endpoints'].setdefault(endpoint, {'requests': 0, 'total_latency': 0.0, 'max_latency': 0.0})
+            endpoint_stats['requests'] += 1
+            endpoint_stats['total_latency'] += latency
+            endpoint_stats['max_latency'] = max(endpoint_stats['max_latency'], latency)
+
+    def connections_opened(self):
+        # Count the TCP connections the pools have opened so far.
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def get_stats(self):
+        # Return the request counters together with connection reuse figures.
+        with self._lock:
+            stats = dict(self.stats)
+            stats['endpoints'] = {endpoint: dict(values) for endpoint, values in self.stats['endpoints'].items()}
+        stats['connections_opened'] = self.connections_opened()
+        stats['connections_reused'] = max(stats['requests'] - stats['connections_opened'], 0)
+        stats['avg_latency'] = stats['total_latency'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+# Shared transport used by all endpoint helpers
+transport = HttpTransport(base_url, http_pool_size, http_timeout, http_max_retries, http_backoff_factor, limiter)
+
+def get(endpoint, **kwargs):
+    return transport.request('GET', endpoint, **kwargs)
+
+def post(endpoint, **kwargs):
+    return transport.request('POST', endpoint, **kwargs)
+
+def put(endpoint, **kwargs):
+    return transport.request('PUT', endpoint, **kwargs)
+
+def delete(endpoint, **kwargs):
+    return transport.request('DELETE', endpoint, **kwargs)
+
+def get_stats():
+    return transport.get_stats()
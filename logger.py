@@ -1,32 +1,90 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import time
+from config import log_dir, log_file, log_level, log_levels, log_console_level, log_rotation, log_max_bytes, log_rotate_when, log_backup_count
 
-LOG_DIR = "logs"
+LOG_DIR = log_dir
 
-def setup_logger():
-    # Luo lokituskansion, jos se ei ole jo olemassa
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR)
+# Attributes every LogRecord has. Anything else on a record was passed with extra= and is written as a field.
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
 
-    # Määritä lokitustaso
-    logging.basicConfig(level=logging.INFO)
+_listener = None  # Background writer, set by setup_logger
 
-def log_open_order(symbol, side, quantity, price, position_side, order_type):
-    log_file = os.path.join(LOG_DIR, "orders.log")
-    logger = logging.getLogger("order_logger")
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON line."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue as they are. The message is formatted by the writer thread.
+
+    The queue never leaves the process, so the record does not have to be made picklable first.
+    Objects passed as arguments must not be changed after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
 
-    # Määritä lokitiedoston muotoilu
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+def _file_handler(path):
+    if log_rotation == 'time':
+        return logging.handlers.TimedRotatingFileHandler(path, when=log_rotate_when, backupCount=log_backup_count, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(path, maxBytes=log_max_bytes, backupCount=log_backup_count, encoding='utf-8')
 
-    # Luo tiedostokäsittelijä lokitiedostolle
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
+def setup_logger(file_name=log_file):
+    # Send all log records through a queue to a background thread that writes the file and the console.
+    # Logging on the order path only puts the record on the queue, it never waits for disk I/O.
+    # Processes that run at the same time must use different file names, rotation is not shared.
+    global _listener
+    if _listener is not None:
+        return
 
-    # Lisää tiedostokäsittelijä loggeriin
-    logger.addHandler(file_handler)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    file_handler = _file_handler(os.path.join(LOG_DIR, file_name))
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(log_console_level)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
 
-    # Kirjoita lokimerkintä
-    logger.info(f"Opened {order_type} order for {position_side}: Symbol={symbol}, Side={side}, Quantity={quantity}, Price={price}")
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
 
-    # Poista tiedostokäsittelijä loggerista
-    logger.removeHandler(file_handler)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(log_level)
+    for name, level in log_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener.start()
+    atexit.register(stop_logger)
+
+def stop_logger():
+    # Write the records still in the queue and stop the background thread.
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def log_open_order(symbol, side, quantity, price, position_side, order_type):
+    logging.getLogger("order_logger").info(
+        "Opened %s order for %s: Symbol=%s, Side=%s, Quantity=%s, Price=%s", order_type, position_side, symbol, side, quantity, price,
+        extra={'symbol': symbol, 'side': side, 'quantity': quantity, 'price': price, 'position_side': position_side, 'order_type': order_type}
+    )
@@ -1,23 +1,79 @@
 import time
-from order_management import handle_orders  # Import the handle_orders function from the order_management module
-from config import crypto_settings  # Import the crypto_settings dictionary from the config module
+import logging
+from order_management import handle_symbol  # Handles the orders of one crypto_settings entry, also used by the benchmark
+from config import crypto_settings, api_key, api_secret, ws_base_url, max_concurrent_symbols, cycle_deadline, event_driven, rest_reconcile_interval  # Import settings and API credentials from the config module
+from account_snapshot import AccountSnapshot  # Positions and open orders fetched once per loop
+from scheduler import SymbolScheduler  # Runs the symbols concurrently
+from clock_sync import clock  # Server time used to sign requests
+from account_config import account_config  # Known leverage and margin type per symbol
+from logger import setup_logger  # Background log writer
+import metrics  # Prometheus style /metrics endpoint
+import http_client  # Shared transport, for its request stats
+from rate_limiter import limiter  # Shared rate limiter, for its budget metrics
+from price_cache import price_cache  # Shared price cache, for its hit and refresh counts
+from config import metrics_enabled, metrics_host, metrics_port, profiler_interval
+from config import state_enabled, leverage, margin_type
+from config import adaptive_polling, poll_interval_near_stop, poll_interval_position, poll_interval_idle, poll_interval_idle_max, poll_near_stop_fraction, poll_weight_budget
+from accounts import default_account  # Account of the config.py settings, handled by handle_symbol
+from state_store import open_store  # Orders, positions and setup state of the last run
+
+setup_logger()  # Start the background log writer before anything logs
+logger = logging.getLogger(__name__)
+
+scheduler = SymbolScheduler(handle_symbol, max_concurrent_symbols, cycle_deadline)
+clock.start()  # Keep the local clock offset to the server up to date in the background
+
+store = None
+if state_enabled:
+    store = open_store('bot')
+    default_account.attach_store(store)  # Also loads the leverage and margin type saved by the last run
+
+if metrics_enabled:
+    # Export the existing scheduler, HTTP and rate limit stats next to the recorded timings and counters
+    metrics.registry.register_collector('scheduler', scheduler.get_metrics, {'symbol_lag': 'symbol', 'symbol_duration': 'symbol'})
+    metrics.registry.register_collector('http', http_client.get_stats, {'endpoints': 'endpoint'})
+    metrics.registry.register_collector('rate_limiter', limiter.get_metrics)
+    metrics.registry.register_collector('price_cache', price_cache.get_stats)
+    if profiler_interval:
+        metrics.start_profiler(profiler_interval)
+    metrics.start_server(metrics_host, metrics_port)
+
+if event_driven:
+    # React to stream events and reconcile over REST periodically
+    from event_manager import EventDrivenManager
+    EventDrivenManager(crypto_settings, scheduler, api_key, api_secret, ws_base_url, rest_reconcile_interval, store).run_forever()
+
+if adaptive_polling:
+    # Poll the symbols with open positions often and the flat ones rarely
+    from adaptive_poller import AdaptivePoller
+    intervals = (poll_interval_near_stop, poll_interval_position, poll_interval_idle, poll_interval_idle_max)
+    AdaptivePoller(crypto_settings, scheduler, default_account, intervals, poll_near_stop_fraction, poll_weight_budget, store).run_forever()
 
 # Infinite loop to continuously check and manage orders
+seeded = False
 while True:
-    # Iterate through each symbol and its parameters in the crypto_settings dictionary
-    for symbol, params in crypto_settings.items():
-        # Extract individual parameters for the current symbol
-        order_quantity = params["order_quantity"]  # The order quantity for the symbol
-        callback_rate = params["callback_rate"]  # The callback rate for the trailing stop order
-        callback_rate_close = params["callback_rate_close"]  # The callback rate for closing the trailing stop order
-        working_type = params["working_type"]  # The type of price to use ('MARK_PRICE' or 'LAST_PRICE')
-        stop_loss_roi = params["stop_loss_roi"]  # The stop loss return on investment percentage
-        take_profit_roi = params["take_profit_roi"]  # The take profit return on investment percentage
-        take_profit_enabled = params["take_profit_enabled"]  # Whether to enable take profit order instead of trailing stop close order
-        
-        # Call the handle_orders function with the extracted parameters
-        handle_orders(symbol, order_quantity, callback_rate, callback_rate_close, working_type, stop_loss_roi, take_profit_roi, take_profit_enabled)
-    
+    # Fetch positions and open orders for all symbols once per loop
+    snapshot = AccountSnapshot.fetch(api_key, api_secret, symbols=crypto_settings)
+    if snapshot is None:
+        logger.warning("Failed to get account snapshot, retrying...")
+        time.sleep(10)
+        continue
+
+    # Take the leverage and margin type of every symbol from the snapshot, they may have been changed outside the bot
+    account_config.load(snapshot.setup)
+
+    if not seeded:
+        seeded = True
+        if store is not None:
+            # Compare the snapshot with the last run and handle only the sides that changed since then
+            position_sides = store.reconcile(snapshot, crypto_settings, leverage, margin_type)
+            scheduler.run_cycle({symbol: crypto_settings[symbol] for symbol in position_sides}, snapshot, position_sides)
+            time.sleep(10)
+            continue
+
+    # Handle every symbol in the crypto_settings dictionary concurrently
+    scheduler.run_cycle(crypto_settings, snapshot)
+
     # Sleep for xx seconds before the next iteration to avoid overwhelming the API with requests. You can adjust this starting from 1 second.
     time.sleep(10)
 
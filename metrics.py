@@ -0,0 +1,250 @@
+import bisect
+import functools
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import metrics_enabled
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+
+enabled = metrics_enabled  # Checked by every helper, nothing is recorded while False
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus format."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """Counters and histograms keyed by name and labels, plus collectors that export existing stats dicts."""
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.collectors = []  # (prefix, getter, label names)
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount, labels):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def register_collector(self, prefix, getter, label_names=None):
+        # Export the numbers of getter() as gauges named prefix_key. Nested dicts become labelled series,
+        # label_names maps the key of a nested dict to its label name (the default label is 'key').
+        self.collectors.append((prefix, getter, label_names or {}))
+
+    def render(self):
+        # Return all metrics in the Prometheus text exposition format.
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count) for key, histogram in self.histograms.items()}
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (series, labels), value in counters.items():
+                if series == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series, labels), (buckets, counts, total, count) in histograms.items():
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for prefix, getter, label_names in self.collectors:
+            try:
+                stats = getter()
+            except Exception as e:
+                lines.append(f"# {prefix} collector failed: {e}")
+                continue
+            lines.extend(_gauge_lines(prefix, stats, label_names))
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in labels) + '}'
+
+def _is_number(value):
+    return isinstance(value, (int, float))  # bool included
+
+def _gauge_lines(prefix, stats, label_names):
+    # Flatten a stats dict into gauge lines.
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if _is_number(value):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+        elif isinstance(value, dict):
+            label = label_names.get(key, 'key')
+            series = {}  # metric name -> lines
+            for label_value, entry in value.items():
+                if _is_number(entry):
+                    series.setdefault(name, []).append(f"{name}{_format_labels(((label, label_value),))} {float(entry)}")
+                elif isinstance(entry, dict):
+                    for field, field_value in entry.items():
+                        if _is_number(field_value):
+                            series.setdefault(f"{name}_{field}", []).append(f"{name}_{field}{_format_labels(((label, label_value),))} {float(field_value)}")
+            for series_name, series_lines in series.items():
+                lines.append(f"# TYPE {series_name} gauge")
+                lines.extend(series_lines)
+    return lines
+
+registry = Registry()
+
+def inc(name, amount=1, **labels):
+    # Increase a counter.
+    if enabled:
+        registry.inc(name, amount, tuple(sorted(labels.items())))
+
+def observe(name, value, **labels):
+    # Record a value in a histogram.
+    if enabled:
+        registry.observe(name, value, tuple(sorted(labels.items())))
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+def timer(name, **labels):
+    # Context manager that records the duration of the block in a histogram.
+    if not enabled:
+        return NULL_TIMER
+    return _Timer(name, tuple(sorted(labels.items())))
+
+def timed(name, **labels):
+    # Decorator that records the duration of every call, with the function name as a label.
+    # While metrics are disabled at import time the function is returned unchanged.
+    def decorator(func):
+        if not enabled:
+            return func
+        func_labels = tuple(sorted(dict(labels, function=func.__name__).items()))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start, func_labels)
+        return wrapper
+    return decorator
+
+class SamplingProfiler:
+    """Samples the stacks of all threads every interval seconds and counts them in the folded stack format."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()  # 'thread;outer;...;inner' -> samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def render(self):
+        # Folded stacks, one 'stack count' per line, as used by flamegraph tools.
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+profiler = None  # SamplingProfiler, set by start_profiler
+
+def start_profiler(interval):
+    global profiler
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    return profiler
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = registry.render().encode()
+        elif self.path == '/profile' and profiler is not None:
+            body = profiler.render().encode()
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line
+
+def start_server(host, port):
+    # Serve /metrics (and /profile when the profiler runs) from a background thread.
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,500 @@
+import base64
+import hashlib
+import json
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from rate_limiter import request_cost
+
+SIGNED_ENDPOINTS = ('/fapi/v2/positionRisk', '/fapi/v1/openOrders', '/fapi/v1/order', '/fapi/v1/batchOrders', '/fapi/v1/leverage', '/fapi/v1/marginType')
+INTERNAL_ERROR = {'code': -1001, 'msg': 'Internal error; unable to process your request. Please try again.'}
+UNKNOWN_ORDER = {'code': -2011, 'msg': 'Unknown order sent.'}
+UNKNOWN_LISTEN_KEY = {'code': -1125, 'msg': 'This listenKey does not exist.'}
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'  # Appended to Sec-WebSocket-Key in the handshake (RFC 6455)
+
+class MockFuturesServer:
+    """In-process fake of the Binance Futures REST endpoints the bot uses.
+
+    Every symbol starts with a LONG and a SHORT position (for position_ratio of the symbols) and no open
+    orders. Orders are accepted and stay open until they are cancelled or filled with fill_order, nothing
+    fills by itself. latency and jitter add a delay in seconds to every response and error_rate is the share
+    of requests answered with a 503 error. With a MockFuturesStream attached, order and position changes
+    are also sent as user data stream events.
+    """
+
+    def __init__(self, symbols=10, latency=0.0, jitter=0.0, error_rate=0.0, position_ratio=1.0, leverage=10, margin_type='ISOLATED', seed=None, port=0):
+        self.symbols = [f"SYM{i:03d}USDT" for i in range(symbols)]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.position_ratio = position_ratio
+        self.leverage = leverage
+        self.margin_type = margin_type
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stream = None  # MockFuturesStream the user data events are sent to
+        self.listen_key = None  # Active listen key, a new one is handed out after it expired
+        self.listen_keys = []  # Every listen key handed out
+        self.reject_orders = 0  # New orders still to reject with -2019, like an account that ran out of margin
+        self.reset()
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def reset(self):
+        # Restore the starting positions, drop all orders and clear the counters.
+        with self._lock:
+            self.prices = {symbol: round(self.random.uniform(1, 50000), 2) for symbol in self.symbols}
+            # Time of the last trade, which ticker/price reports like it does for a quiet symbol
+            self.trade_time = int(time.time() * 1000) - 60000
+            self.positions = {}  # (symbol, positionSide) -> position amount
+            self.settings = {symbol: {'leverage': self.leverage, 'margin_type': self.margin_type} for symbol in self.symbols}
+            for symbol in self.symbols:
+                has_position = self.random.random() < self.position_ratio
+                self.positions[(symbol, 'LONG')] = round(10 / self.prices[symbol], 3) + 0.001 if has_position else 0.0
+                self.positions[(symbol, 'SHORT')] = -self.positions[(symbol, 'LONG')]
+            self.orders = {}  # orderId -> order
+            self.next_order_id = 1
+            self.reset_stats()
+
+    def reset_stats(self):
+        # Clear the request counters and the order log, for example at the start of a cycle.
+        self.stats = {
+            'requests': 0,
+            'weight': 0,
+            'errors': 0,  # Injected errors
+            'endpoints': {},  # 'METHOD /path' -> request count
+        }
+        self.order_log = []  # (time.monotonic() when received, symbol, positionSide, type) per created order
+        self._weight_log = deque()  # (time.monotonic(), weight) of the requests in the last minute
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-fapi', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, method, path, params):
+        # Return (status, payload, headers) for one request.
+        now = time.monotonic()
+        weight, _ = request_cost(method, path, params)
+        with self._lock:
+            key = f"{method} {path}"
+            self.stats['requests'] += 1
+            self.stats['weight'] += weight
+            self.stats['endpoints'][key] = self.stats['endpoints'].get(key, 0) + 1
+            self._weight_log.append((now, weight))
+            while self._weight_log[0][0] < now - 60:
+                self._weight_log.popleft()
+            used_weight = sum(entry[1] for entry in self._weight_log)
+            inject_error = self.random.random() < self.error_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        if delay:
+            time.sleep(delay)
+        headers = {'X-MBX-USED-WEIGHT-1M': str(used_weight)}
+        if inject_error:
+            with self._lock:
+                self.stats['errors'] += 1
+            return 503, INTERNAL_ERROR, headers
+
+        route = ROUTES.get((method, path))
+        if route is None:
+            return 404, {'code': -1, 'msg': f"Mock server has no {method} {path}"}, headers
+        if path in SIGNED_ENDPOINTS and ('signature' not in params or 'timestamp' not in params):
+            return 400, {'code': -1022, 'msg': 'Signature for this request is not valid.'}, headers
+        with self._lock:
+            status, payload = route(self, params)
+        return status, payload, headers
+
+    def _time(self, params):
+        return 200, {'serverTime': int(time.time() * 1000)}
+
+    def _exchange_info(self, params):
+        symbols = [{
+            'symbol': symbol,
+            'status': 'TRADING',
+            'filters': [
+                {'filterType': 'PRICE_FILTER', 'tickSize': '0.01', 'minPrice': '0.01', 'maxPrice': '1000000'},
+                {'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001', 'maxQty': '1000'},
+                {'filterType': 'MARKET_LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001', 'maxQty': '500'},
+                {'filterType': 'MIN_NOTIONAL', 'notional': '5'}
+            ]
+        } for symbol in self.symbols]
+        return 200, {'symbols': symbols}
+
+    def _position_risk(self, params):
+        rows = []
+        for (symbol, position_side), amount in self.positions.items():
+            if 'symbol' in params and params['symbol'] != symbol:
+                continue
+            rows.append({
+                'symbol': symbol,
+                'positionSide': position_side,
+                'positionAmt': f"{amount:.3f}",
+                'entryPrice': f"{self.prices[symbol]:.2f}",
+                'markPrice': f"{self.prices[symbol]:.2f}",
+                'leverage': str(self.settings[symbol]['leverage']),
+                'marginType': self.settings[symbol]['margin_type'].lower().replace('crossed', 'cross')
+            })
+        return 200, rows
+
+    def _open_orders(self, params):
+        return 200, [order for order in self.orders.values() if params.get('symbol', order['symbol']) == order['symbol']]
+
+    def _ticker_price(self, params):
+        if 'symbol' in params:
+            if params['symbol'] not in self.prices:
+                return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+            return 200, {'symbol': params['symbol'], 'price': f"{self.prices[params['symbol']]:.2f}", 'time': self.trade_time}
+        return 200, [{'symbol': symbol, 'price': f"{price:.2f}", 'time': self.trade_time} for symbol, price in self.prices.items()]
+
+    def _premium_index(self, params):
+        now = int(time.time() * 1000)
+        rows = [{'symbol': symbol, 'markPrice': f"{price:.2f}", 'indexPrice': f"{price:.2f}", 'lastFundingRate': '0.0001', 'time': now} for symbol, price in self.prices.items()]
+        if 'symbol' in params:
+            return 200, next((row for row in rows if row['symbol'] == params['symbol']), {'code': -1121, 'msg': 'Invalid symbol.'})
+        return 200, rows
+
+    def _create_order(self, params):
+        if self.reject_orders:
+            self.reject_orders -= 1
+            return 400, {'code': -2019, 'msg': 'Margin is insufficient.'}
+        if params.get('symbol') not in self.prices:
+            return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+        for field in ('side', 'type', 'positionSide', 'quantity'):
+            if field not in params:
+                return 400, {'code': -1102, 'msg': f"Mandatory parameter '{field}' was not sent, was empty/null, or malformed."}
+        if 'newClientOrderId' in params and any(order['clientOrderId'] == params['newClientOrderId'] for order in self.orders.values()):
+            return 400, {'code': -4116, 'msg': 'ClientOrderId is duplicated.'}
+        order = {
+            'orderId': self.next_order_id,
+            'symbol': params['symbol'],
+            'status': 'NEW',
+            'clientOrderId': params.get('newClientOrderId', f"mock{self.next_order_id}"),
+            'price': '0',
+            'avgPrice': '0',
+            'origQty': params['quantity'],
+            'executedQty': '0',
+            'type': params['type'],
+            'side': params['side'],
+            'positionSide': params['positionSide'],
+            'stopPrice': params.get('stopPrice', '0'),
+            'workingType': params.get('workingType', 'CONTRACT_PRICE'),
+            'priceRate': params.get('callbackRate', '0'),
+            'updateTime': int(time.time() * 1000)
+        }
+        self.next_order_id += 1
+        self.orders[order['orderId']] = order
+        self.order_log.append((time.monotonic(), order['symbol'], order['positionSide'], order['type']))
+        self._emit(order_event(order, 'NEW'))
+        return 200, order
+
+    def _cancel_order(self, params):
+        order = self.orders.get(int(params.get('orderId', 0)))
+        if order is None or order['symbol'] != params.get('symbol'):
+            return 400, UNKNOWN_ORDER
+        del self.orders[order['orderId']]
+        self._emit(order_event(order, 'CANCELED'))
+        return 200, dict(order, status='CANCELED')
+
+    def _create_batch(self, params):
+        results = []
+        for item in json.loads(params['batchOrders']):
+            _, result = self._create_order(item)
+            results.append(result)
+        return 200, results
+
+    def _cancel_batch(self, params):
+        results = []
+        for order_id in json.loads(params['orderIdList']):
+            _, result = self._cancel_order({'symbol': params.get('symbol'), 'orderId': order_id})
+            results.append(result)
+        return 200, results
+
+    def _leverage(self, params):
+        self.settings[params['symbol']]['leverage'] = int(params['leverage'])
+        return 200, {'symbol': params['symbol'], 'leverage': int(params['leverage']), 'maxNotionalValue': '1000000'}
+
+    def _margin_type(self, params):
+        if self.settings[params['symbol']]['margin_type'] == params['marginType']:
+            return 400, {'code': -4046, 'msg': 'No need to change margin type.'}
+        self.settings[params['symbol']]['margin_type'] = params['marginType']
+        return 200, {'code': 200, 'msg': 'success'}
+
+    def _create_listen_key(self, params):
+        # Like the exchange, the active listen key is returned again until it expired.
+        if self.listen_key is None:
+            self.listen_key = f"mockListenKey{len(self.listen_keys) + 1}"
+            self.listen_keys.append(self.listen_key)
+        return 200, {'listenKey': self.listen_key}
+
+    def _keepalive_listen_key(self, params):
+        if self.listen_key is None:
+            return 400, UNKNOWN_LISTEN_KEY
+        return 200, {}
+
+    def _emit(self, event):
+        if self.stream is not None:
+            self.stream.push(event)
+
+    def fill_order(self, order_id, quantity=None):
+        # Fill an open order, partially if quantity is less than what is left of it, and move the position.
+        with self._lock:
+            order = self.orders[order_id]
+            remaining = float(order['origQty']) - float(order['executedQty'])
+            quantity = remaining if quantity is None else min(quantity, remaining)
+            order['executedQty'] = f"{float(order['executedQty']) + quantity:.3f}"
+            if quantity < remaining:
+                self._emit(order_event(order, 'PARTIALLY_FILLED'))
+            else:
+                del self.orders[order_id]
+                self._emit(order_event(order, 'FILLED'))
+            key = (order['symbol'], order['positionSide'])
+            self.positions[key] = round(self.positions[key] + (quantity if order['side'] == 'BUY' else -quantity), 3)
+            self._emit(account_event(order['symbol'], order['positionSide'], self.positions[key], self.prices[order['symbol']]))
+
+    def cancel_order(self, order_id):
+        # Cancel an open order from outside the bot, for example in the web interface.
+        with self._lock:
+            order = self.orders[order_id]
+            return self._cancel_order({'symbol': order['symbol'], 'orderId': order_id})
+
+    def find_orders(self, symbol, position_side, order_type):
+        # Return the open orders of one side and type, oldest first.
+        with self._lock:
+            return [order for order in self.orders.values() if order['symbol'] == symbol and order['positionSide'] == position_side and order['type'] == order_type]
+
+    def expire_listen_key(self):
+        # Expire the active listen key like the exchange does after 60 minutes without keepalive.
+        with self._lock:
+            listen_key, self.listen_key = self.listen_key, None
+        if listen_key is not None and self.stream is not None:
+            self.stream.push({'e': 'listenKeyExpired', 'E': int(time.time() * 1000), 'listenKey': listen_key}, listen_key=listen_key)
+
+def order_event(order, status):
+    # ORDER_TRADE_UPDATE event of an order in the mock server.
+    now = int(time.time() * 1000)
+    return {'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now, 'o': {
+        's': order['symbol'], 'c': order['clientOrderId'], 'S': order['side'], 'o': order['type'], 'q': order['origQty'],
+        'sp': order['stopPrice'], 'cr': order['priceRate'], 'wt': order['workingType'], 'ps': order['positionSide'],
+        'x': 'TRADE' if status in ('PARTIALLY_FILLED', 'FILLED') else status, 'X': status, 'i': order['orderId'], 'z': order['executedQty']
+    }}
+
+def account_event(symbol, position_side, amount, entry_price):
+    # ACCOUNT_UPDATE event of one changed position.
+    now = int(time.time() * 1000)
+    return {'e': 'ACCOUNT_UPDATE', 'E': now, 'T': now, 'a': {'m': 'ORDER', 'B': [], 'P': [
+        {'s': symbol, 'pa': f"{amount:.3f}", 'ep': f"{entry_price:.2f}" if amount else '0', 'ps': position_side, 'up': '0', 'mt': 'isolated'}
+    ]}}
+
+ROUTES = {
+    ('GET', '/fapi/v1/premiumIndex'): MockFuturesServer._premium_index,
+    ('GET', '/fapi/v1/time'): MockFuturesServer._time,
+    ('GET', '/fapi/v1/exchangeInfo'): MockFuturesServer._exchange_info,
+    ('GET', '/fapi/v2/positionRisk'): MockFuturesServer._position_risk,
+    ('GET', '/fapi/v1/openOrders'): MockFuturesServer._open_orders,
+    ('GET', '/fapi/v1/ticker/price'): MockFuturesServer._ticker_price,
+    ('POST', '/fapi/v1/order'): MockFuturesServer._create_order,
+    ('DELETE', '/fapi/v1/order'): MockFuturesServer._cancel_order,
+    ('POST', '/fapi/v1/batchOrders'): MockFuturesServer._create_batch,
+    ('DELETE', '/fapi/v1/batchOrders'): MockFuturesServer._cancel_batch,
+    ('POST', '/fapi/v1/leverage'): MockFuturesServer._leverage,
+    ('POST', '/fapi/v1/marginType'): MockFuturesServer._margin_type,
+    ('POST', '/fapi/v1/listenKey'): MockFuturesServer._create_listen_key,
+    ('PUT', '/fapi/v1/listenKey'): MockFuturesServer._keepalive_listen_key,
+}
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+        disable_nagle_algorithm = True  # Headers and body are written separately, do not wait for the ACK in between
+
+        def _dispatch(self):
+            url = urlsplit(self.path)
+            params = dict(parse_qsl(url.query))
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                params.update(parse_qsl(self.rfile.read(length).decode()))
+            status, payload, headers = server.handle(self.command, url.path, params)
+
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+        def log_message(self, format, *args):
+            pass  # Keep the benchmark output readable
+
+    return Handler
+
+class MockFuturesStream:
+    """In-process fake of the combined user data and mark price stream (wss://fstream.binance.com/stream).
+
+    Accepts /stream?streams=<listenKey>/<symbol>@markPrice@1s connections for the listen keys handed out
+    by server, and sends them the user data events of server and the mark prices pushed with
+    push_mark_prices. Pings are answered and close frames returned, enough for websocket-client.
+    """
+
+    def __init__(self, server, port=0):
+        self.server = server
+        server.stream = self
+        self.connections = []  # {'socket', 'listen_key', 'symbols', 'lock'} of the open connections
+        self.connects = 0  # Connections accepted so far, reconnects included
+        self.muted = False  # While True events are dropped, like during a network outage
+        self._lock = threading.Lock()
+        self.tcp = socketserver.ThreadingTCPServer(('127.0.0.1', port), _make_ws_handler(self), bind_and_activate=False)
+        self.tcp.daemon_threads = True
+        self.tcp.allow_reuse_address = True
+        self.tcp.server_bind()
+        self.tcp.server_activate()
+        self.url = f"ws://127.0.0.1:{self.tcp.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.tcp.serve_forever, name='mock-fstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.tcp.shutdown()
+        self.tcp.server_close()
+        with self._lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection['socket'].close()
+
+    def connect(self, sock, listen_key, symbols):
+        connection = {'socket': sock, 'listen_key': listen_key, 'symbols': symbols, 'lock': threading.Lock()}
+        with self._lock:
+            self.connections.append(connection)
+            self.connects += 1
+        return connection
+
+    def disconnect(self, connection):
+        with self._lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+
+    def drop_connections(self):
+        # Cut every open connection without a close frame, as a lost network connection would.
+        with self._lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection['socket'].shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def send(self, connection, opcode, payload):
+        try:
+            with connection['lock']:
+                connection['socket'].sendall(_ws_frame(opcode, payload))
+        except OSError:
+            self.disconnect(connection)
+
+    def push(self, event, listen_key=None, symbol=None):
+        # Send an event to the connections of a listen key (the active one by default), or of a mark price
+        # stream if symbol is given.
+        if self.muted:
+            return
+        listen_key = listen_key or self.server.listen_key
+        with self._lock:
+            connections = list(self.connections)
+        for connection in connections:
+            if symbol is not None:
+                if symbol not in connection['symbols']:
+                    continue
+                name = f"{symbol.lower()}@markPrice@1s"
+            elif connection['listen_key'] == listen_key:
+                name = listen_key
+            else:
+                continue
+            self.send(connection, 0x1, json.dumps({'stream': name, 'data': event}).encode())
+
+    def push_mark_prices(self, prices=None):
+        # Send a markPriceUpdate for every symbol, with the server prices unless prices gives others.
+        now = int(time.time() * 1000)
+        for symbol, price in (prices or self.server.prices).items():
+            self.push({'e': 'markPriceUpdate', 'E': now, 's': symbol, 'p': f"{price:.2f}", 'i': f"{price:.2f}", 'r': '0.0001', 'T': now}, symbol=symbol)
+
+def _ws_frame(opcode, payload):
+    # Unmasked final frame, as sent by a server.
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+def _read_ws_frame(rfile):
+    # Return (opcode, payload) of the next frame, or (None, b'') when the connection was closed.
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None, b''
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if header[1] & 0x80 else None  # Client frames are always masked
+    payload = rfile.read(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return header[0] & 0x0F, payload
+
+def _make_ws_handler(stream):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request_line = self.rfile.readline().decode()
+            headers = {}
+            while True:
+                line = self.rfile.readline().decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            streams = dict(parse_qsl(urlsplit(request_line.split()[1]).query)).get('streams', '').split('/')
+            listen_key = streams[0]
+            if listen_key != stream.server.listen_key or 'sec-websocket-key' not in headers:
+                self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                return
+            accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode()).digest()).decode()
+            self.wfile.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+
+            symbols = {name.split('@')[0].upper() for name in streams[1:]}
+            connection = stream.connect(self.connection, listen_key, symbols)
+            try:
+                while True:
+                    opcode, payload = _read_ws_frame(self.rfile)
+                    if opcode is None:
+                        break
+                    if opcode == 0x8:
+                        stream.send(connection, 0x8, payload[:2])  # Echo the close code, then hang up
+                        break
+                    if opcode == 0x9:
+                        stream.send(connection, 0xA, payload)
+            finally:
+                stream.disconnect(connection)
+
+    return Handler
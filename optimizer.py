@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import pprint
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import crypto_settings, leverage
+from backtest import load_prices, with_mark_prices, backtest_symbol, summarize, parse_symbol_paths
+
+SWEEP_FIELDS = ('callback_rate', 'callback_rate_close', 'stop_loss_roi', 'take_profit_roi', 'take_profit_enabled', 'leverage')
+PRICE_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'mark_high', 'mark_low')
+
+# Price arrays opened by this worker process, shared with the other workers through the page cache
+_worker_data = {}
+
+def prepare_data(symbol, path, kind, cache_dir, mark_path=None):
+    # Convert a price file to one .npy file per column so workers can memory-map them.
+    # The conversion is skipped when the source files have not changed since the last run.
+    sources = [path] + ([mark_path] if mark_path else [])
+    fingerprint = hashlib.sha1(json.dumps([[source, os.path.getsize(source), os.path.getmtime(source)] for source in sources] + [kind]).encode()).hexdigest()
+    prefix = os.path.join(cache_dir, f"{symbol}-{fingerprint[:12]}")
+    if os.path.exists(prefix + '-close.npy'):
+        return prefix, fingerprint
+
+    chunks = load_prices(path, kind)
+    if mark_path:
+        chunks = with_mark_prices(chunks, load_prices(mark_path, 'klines'))
+    columns = {}
+    for chunk in chunks:
+        for name, values in chunk.items():
+            columns.setdefault(name, []).append(values)
+    for name, parts in columns.items():
+        np.save(f"{prefix}-{name}.npy", np.concatenate(parts))
+    return prefix, fingerprint
+
+def _load_data(prefix):
+    # Memory-map the price columns of a prepared file once per worker process.
+    if prefix not in _worker_data:
+        chunk = {}
+        for name in PRICE_COLUMNS:
+            if os.path.exists(f"{prefix}-{name}.npy"):
+                chunk[name] = np.load(f"{prefix}-{name}.npy", mmap_mode='r')
+        _worker_data[prefix] = chunk
+    return _worker_data[prefix]
+
+def _evaluate(task):
+    # Run one parameter combination for one symbol. Executed in a worker process.
+    key, prefix, params, symbol_leverage, fee_rate = task
+    trades = backtest_symbol([_load_data(prefix)], params, symbol_leverage, fee_rate)
+    return key, summarize(np.concatenate([trades['LONG'], trades['SHORT']]))
+
+def build_grid(grid, base_params, base_leverage):
+    # Expand the grid into unique (params, leverage) combinations.
+    # Fields that have no effect in a combination are left at their base value so it is only evaluated once.
+    values = [grid.get(field, [base_leverage if field == 'leverage' else base_params[field]]) for field in SWEEP_FIELDS]
+    combinations = {}
+    for combination in itertools.product(*values):
+        params = dict(base_params)
+        params.update(zip(SWEEP_FIELDS[:-1], combination[:-1]))
+        if params['take_profit_enabled']:
+            params['callback_rate_close'] = base_params['callback_rate_close']  # Not used with take profit
+        else:
+            params['take_profit_roi'] = base_params['take_profit_roi']  # Not used with the closing trailing stop
+        combinations[json.dumps([params, combination[-1]], sort_keys=True)] = (params, combination[-1])
+    return list(combinations.values())
+
+def task_key(symbol, fingerprint, params, symbol_leverage, fee_rate):
+    # Cache key of one evaluation. Changes whenever the data, parameters or fee change.
+    return hashlib.sha1(json.dumps([symbol, fingerprint, params, symbol_leverage, fee_rate], sort_keys=True).encode()).hexdigest()
+
+def load_cache(path):
+    cache = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                cache[entry['key']] = entry['summary']
+    return cache
+
+def run_sweep(data_paths, grid, kind='klines', mark_paths=None, fee_rate=0.0004, cache_dir='sweep_cache', workers=None):
+    # Evaluate every grid combination for every symbol on a process pool. Returns the results per symbol.
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, 'results.jsonl')
+    cache = load_cache(cache_path)
+    mark_paths = mark_paths or {}
+    default_params = next(iter(crypto_settings.values()))
+
+    results = {}
+    pending = []
+    for symbol, path in data_paths.items():
+        prefix, fingerprint = prepare_data(symbol, path, kind, cache_dir, mark_paths.get(symbol))
+        results[symbol] = []
+        for params, symbol_leverage in build_grid(grid, crypto_settings.get(symbol, default_params), leverage):
+            key = task_key(symbol, fingerprint, params, symbol_leverage, fee_rate)
+            entry = {'params': params, 'leverage': symbol_leverage, 'summary': cache.get(key)}
+            results[symbol].append(entry)
+            if entry['summary'] is None:
+                pending.append(((key, prefix, params, symbol_leverage, fee_rate), entry))
+
+    print(f"{sum(len(entries) for entries in results.values())} combinations, {len(pending)} not cached yet")
+    if pending:
+        entries = {task[0]: entry for task, entry in pending}
+        with ProcessPoolExecutor(max_workers=workers) as executor, open(cache_path, 'a') as cache_file:
+            chunksize = max(1, len(pending) // ((workers or os.cpu_count() or 1) * 4))
+            for key, summary in executor.map(_evaluate, [task for task, _ in pending], chunksize=chunksize):
+                entries[key]['summary'] = summary
+                cache_file.write(json.dumps({'key': key, 'summary': summary}) + '\n')
+
+    for entries in results.values():
+        entries.sort(key=lambda entry: (-entry['summary']['pnl'], entry['summary']['max_drawdown']))
+    return results
+
+def best_settings(results):
+    # Pick the leverage with the highest combined PnL and the best parameters of each symbol for it.
+    leverages = {entry['leverage'] for entries in results.values() for entry in entries}
+    best = None
+    for candidate in leverages:
+        settings = {}
+        total = 0.0
+        for symbol, entries in results.items():
+            entry = next((entry for entry in entries if entry['leverage'] == candidate), None)
+            if entry is None:
+                break
+            settings[symbol] = entry['params']
+            total += entry['summary']['pnl']
+        else:
+            if best is None or total > best[0]:
+                best = (total, candidate, settings)
+    return best[1], best[2]
+
+def print_table(symbol, entries, top):
+    print(f"\n{symbol}")
+    print(f"{'rank':>4} {'pnl':>12} {'max_dd':>10} {'trades':>7} {'win':>6}  parameters")
+    for rank, entry in enumerate(entries[:top], 1):
+        summary = entry['summary']
+        params = ' '.join(f"{field}={entry['leverage'] if field == 'leverage' else entry['params'][field]}" for field in SWEEP_FIELDS)
+        print(f"{rank:>4} {summary['pnl']:>12.4f} {summary['max_drawdown']:>10.4f} {summary['trades']:>7} {summary['win_rate']:>6.1%}  {params}")
+
+def parse_grid(values):
+    # Parse field=v1,v2,... arguments.
+    grid = {}
+    for value in values or []:
+        field, options = value.split('=', 1)
+        if field not in SWEEP_FIELDS:
+            raise ValueError(f"Unknown sweep field: {field}")
+        if field == 'take_profit_enabled':
+            grid[field] = [option.strip().lower() in ('1', 'true', 'yes') for option in options.split(',')]
+        elif field == 'leverage':
+            grid[field] = [int(option) for option in options.split(',')]
+        else:
+            grid[field] = [float(option) for option in options.split(',')]
+    return grid
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Grid search over the crypto_settings fields with the backtest engine.")
+    parser.add_argument('data', nargs='+', help="SYMBOL=path to a CSV or Parquet file")
+    parser.add_argument('--grid', action='append', help="field=v1,v2,... for one of: " + ', '.join(SWEEP_FIELDS))
+    parser.add_argument('--mark', action='append', help="SYMBOL=path to mark price klines with the same rows")
+    parser.add_argument('--kind', choices=('klines', 'aggTrades'), default='klines')
+    parser.add_argument('--fee', type=float, default=0.0004, help="Taker fee rate per fill")
+    parser.add_argument('--cache-dir', default='sweep_cache', help="Directory for the memory-mapped prices and cached results")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, all cores by default")
+    parser.add_argument('--top', type=int, default=10, help="Rows shown per symbol")
+    args = parser.parse_args()
+
+    results = run_sweep(parse_symbol_paths(args.data), parse_grid(args.grid), args.kind, parse_symbol_paths(args.mark), args.fee, args.cache_dir, args.workers)
+    for symbol, entries in results.items():
+        print_table(symbol, entries, args.top)
+
+    best_leverage, settings = best_settings(results)
+    print("\n# Best settings for config.py")
+    print(f"leverage = {best_leverage}")
+    print("crypto_settings = " + pprint.pformat(settings, sort_dicts=False))
@@ -1,243 +1,99 @@
-import requests  # For making HTTP requests
-import hashlib  # For using hash functions
-import hmac  # For using HMAC (Hash-based Message Authentication Code) functions
-import time  # For using time functions
 import logging  # For using logging functions
-from config import api_key, api_secret, base_url, leverage, margin_type  # Import configuration values
-from binance_futures import get_positions, get_server_time, create_signature, change_leverage, change_margin_type, get_market_price, get_open_orders  # Import Binance Futures functions
-
-# Setup logger
+from account_snapshot import AccountSnapshot  # Cycle-scoped positions and open orders
+from order_queue import OrderQueue  # Batches order creation and cancellation
+from exchange_filters import exchange_filters  # Symbol precision rules
+from accounts import default_account  # Keys, transport, settings and known leverage and margin type of the config.py account
+from reconciler import index_orders, reconcile_side  # Minimal order changes per side, the only order builders
+from scheduler import POSITION_SIDES
+from price_cache import price_cache  # Prices of all symbols, loaded with one request
+from metrics import timer  # Phase timings, no-op while metrics are disabled
+from state_store import settings_key, SETTINGS_FIELDS  # Fingerprint of the settings a side was handled with
+
+# Records go to the queue of the background log writer set up by logger.setup_logger
 logger = logging.getLogger('order_management')  # Create a logger named 'order_management'
-logger.setLevel(logging.INFO)  # Set logger level to INFO
-fh = logging.FileHandler('order_management.log')  # Create a file handler for 'order_management.log'
-fh.setLevel(logging.INFO)  # Set file handler level to INFO
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')  # Create a formatter
-fh.setFormatter(formatter)  # Set the formatter for the file handler
-logger.addHandler(fh)  # Add the file handler to the logger
-
-def open_trailing_stop_order(symbol, side, quantity, callback_rate, api_key, api_secret, position_side, working_type):
-    # Open a trailing stop order.
-    print(f"Opening trailing stop order for {position_side}...")
-    endpoint = '/fapi/v1/order'
-    timestamp = int(time.time() * 1000)
-    params = {
-        'symbol': symbol,
-        'side': side,
-        'type': 'TRAILING_STOP_MARKET',
-        'quantity': abs(round(quantity, 3)),  # Ensure quantity is positive and round to 3 decimal places
-        'callbackRate': callback_rate,
-        'timestamp': timestamp,
-        'positionSide': position_side,
-        'workingType': working_type
-    }
-
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret) # Create a signature
-    params['signature'] = signature
-    
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    response = requests.post(base_url + endpoint, headers=headers, data=params)
-    print(f"Trailing stop order response: {response.json()}")
-    logger.info(f"Trailing stop order response: {response.json()}")
-    return response.json()
-
-def check_and_set_stop_loss(symbol, position_side, api_key, api_secret, working_type, stop_loss_roi):
-    """Check if a stop loss order exists for a position, and create one if it doesn't."""
-    positions = get_positions(api_key, api_secret) # Get positions
-    market_price = get_market_price(symbol, api_key, api_secret) # Get market price
-    
-    # Calculate stop loss price based on leverage and ROI
-    stop_loss_price = market_price * (1 + stop_loss_roi / leverage / 100) if position_side == 'LONG' else market_price * (1 - stop_loss_roi / leverage / 100)
-
-    if market_price is None:
-        print("Error: Could not retrieve market price.")
-        return
-
-    for position in positions:
-        if position['symbol'] == symbol and position['positionSide'] == position_side and float(position['positionAmt']) != 0:
-            quantity = abs(float(position['positionAmt']))
-            open_orders = get_open_orders(symbol, api_key, api_secret)
-
-            if open_orders is None:
-                print("Failed to get open orders.")
-                return
-
-            side = 'SELL' if position_side == 'LONG' else 'BUY'
-            has_stop_loss_order = any(order['type'] == 'STOP_MARKET' and order['side'] == side and order['positionSide'] == position_side for order in open_orders)
-            print(f"Has stop loss order: {has_stop_loss_order}")
-
-            if not has_stop_loss_order:
-                print(f"No stop loss order for {position_side} side detected, opening one...")
-                response = open_stop_loss_order(symbol, side, quantity, stop_loss_price, api_key, api_secret, position_side, working_type)
-                print("Stop loss order response:", response)
-                logger.info(f"Stop loss order opened: {response}")
-            else:
-                print(f"Stop loss order for {position_side} side already exists.")
-                
-def open_stop_loss_order(symbol, side, quantity, stop_price, api_key, api_secret, position_side, working_type):
-    """Open a stop loss order."""
-    print(f"Opening stop loss order for {position_side}...")
-    endpoint = '/fapi/v1/order'
-    timestamp = int(time.time() * 1000)
-    params = {
-        'symbol': symbol,
-        'side': side,
-        'type': 'STOP_MARKET',
-        'quantity': round(quantity, 3),  # Round to 3 decimal places
-        'stopPrice': round(stop_price, 7),  # Round to 7 decimal places
-        'timestamp': timestamp,
-        'positionSide': position_side,
-        'workingType': working_type
-    }
-
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-    
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    response = requests.post(base_url + endpoint, headers=headers, data=params)
-    print(f"Stop loss order response: {response.json()}")
-    return response.json()
-
-def cancel_existing_orders(symbol, side, position_side, api_key, api_secret):
-    # Cancel existing open orders for a specific symbol.
-    open_orders = get_open_orders(symbol, api_key, api_secret) # Get open orders
-    if open_orders:
-        for order in open_orders:
-            if order['side'] == side and order['positionSide'] == position_side:
-                print(f"Cancelling order ID: {order['orderId']} for {symbol}")
-                endpoint = '/fapi/v1/order'
-                timestamp = int(time.time() * 1000)
-                params = {
-                    'symbol': symbol,
-                    'orderId': order['orderId'],
-                    'timestamp': timestamp
-                }
-
-                query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-                signature = create_signature(query_string, api_secret)
-                params['signature'] = signature
 
-                headers = {
-                    'X-MBX-APIKEY': api_key
-                }
-
-                response = requests.delete(base_url + endpoint, headers=headers, params=params)
-                print(f"Cancel order response: {response.json()}")
-                
-def open_take_profit_order(symbol, side, quantity, take_profit_price, api_key, api_secret, position_side, working_type):
-    """Open a take profit order."""
-    print(f"Opening take profit order for {position_side}...")
-    endpoint = '/fapi/v1/order'
-    timestamp = int(time.time() * 1000)
-    params = {
-        'symbol': symbol,
-        'side': side,
-        'type': 'TAKE_PROFIT_MARKET',
-        'quantity': round(quantity, 3),  # Round to 3 decimal places
-        'stopPrice': round(take_profit_price, 7),  # Round to 2 decimal places
-        'timestamp': timestamp,
-        'positionSide': position_side,
-        'workingType': working_type
+def handle_orders(symbol, order_quantity,callback_rate,callback_rate_close,working_type, stop_loss_roi, take_profit_roi, take_profit_enabled, snapshot=None, position_sides=('LONG', 'SHORT'), account=None):
+    """Main function to handle the orders. Returns the position sides that could not be brought to the desired orders."""
+    account = account or default_account # The config.py account unless another one is given
+    api_key, api_secret = account.client.api_key, account.client.api_secret
+    if snapshot is None:
+        snapshot = AccountSnapshot.fetch(api_key, api_secret, account.client, [symbol]) # Positions and open orders for this call only
+        if snapshot is None:
+            logger.error("Failed to get positions and open orders.")
+            return set(position_sides)
+        account.account_config.load(snapshot.setup)
+
+    # Change leverage and margin type if they differ from the known state
+    with timer('handle_orders_phase_seconds', phase='account_config', symbol=symbol):
+        account.account_config.ensure(symbol, account.leverage, account.margin_type, api_key, api_secret)
+
+    # Orders to create and cancel are collected first and sent together at the end
+    order_queue = OrderQueue(account.client, account.store)
+    settings = {
+        'order_quantity': order_quantity,
+        'callback_rate': callback_rate,
+        'callback_rate_close': callback_rate_close,
+        'working_type': working_type,
+        'stop_loss_roi': stop_loss_roi,
+        'take_profit_roi': take_profit_roi,
+        'take_profit_enabled': take_profit_enabled
     }
-
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    response = requests.post(base_url + endpoint, headers=headers, data=params)
-    print(f"Take profit order response: {response.json()}")
-    return response.json()
-
-def check_and_set_take_profit(symbol, position_side, take_profit_roi, working_type, api_key, api_secret):
-    """Check if a take profit order exists for a position, and create one if it doesn't."""
-    positions = get_positions(api_key, api_secret)
-    market_price = get_market_price(symbol, api_key, api_secret)
-    
-    # Calculate take profit price based on leverage and ROI
-    take_profit_price = market_price * (1 + take_profit_roi / leverage / 100) if position_side == 'LONG' else market_price * (1 - take_profit_roi / leverage / 100)
-
-    if market_price is None:
-        print("Error: Could not retrieve market price.")
-        return
-
-    for position in positions:
-        if position['symbol'] == symbol and position['positionSide'] == position_side and float(position['positionAmt']) != 0:
-            quantity = abs(float(position['positionAmt']))
-            open_orders = get_open_orders(symbol, api_key, api_secret)
-
-            if open_orders is None:
-                print("Failed to get open orders.")
-                return
-
-            side = 'SELL' if position_side == 'LONG' else 'BUY'
-            has_take_profit_order = any(order['type'] == 'TAKE_PROFIT_MARKET' and order['side'] == side and order['positionSide'] == position_side for order in open_orders)
-            print(f"Has take profit order: {has_take_profit_order}")
-
-            if not has_take_profit_order:
-                print(f"No take profit order for {position_side} side detected, opening one...")
-                response = open_take_profit_order(symbol, side, quantity, take_profit_price, api_key, api_secret, position_side, working_type)
-                print("Take profit order response:", response)
-                logger.info(f"Take profit order opened: {response}")
-            else:
-                print(f"Take profit order for {position_side} side already exists.")
-            
-def handle_orders(symbol, order_quantity,callback_rate,callback_rate_close,working_type, stop_loss_roi, take_profit_roi, take_profit_enabled):
-    """Main function to handle the orders."""
-    positions = get_positions(api_key, api_secret)
-    open_orders = get_open_orders(symbol, api_key, api_secret)
-    
-    # Change leverage and margin type
-    change_leverage(symbol, leverage, api_key, api_secret)
-    change_margin_type(symbol, margin_type, api_key, api_secret)
-    
-    # Calculate leveraged quantity
-    leveraged_quantity = order_quantity * leverage
-    print(f"Leveraged quantity: {leveraged_quantity}")
-
-    # Check LONG positions and orders
-    long_position = next((p for p in positions if p['positionSide'] == 'LONG' and p['symbol'] == symbol and float(p['positionAmt']) != 0), None)
-    if long_position:
-        position_amt = abs(float(long_position['positionAmt']))  # Ensure quantity is positive
-        has_long_close_order = any(order['side'] == 'SELL' and order['type'] == 'TRAILING_STOP_MARKET' and order['positionSide'] == 'LONG' for order in open_orders)
-        if not has_long_close_order and take_profit_enabled == False: 
-            open_trailing_stop_order(symbol, 'SELL', position_amt, callback_rate_close, api_key, api_secret, 'LONG', working_type) # Open trailing stop order
-        elif not has_long_close_order and take_profit_enabled == True:
-            check_and_set_take_profit(symbol, 'LONG', take_profit_roi, working_type, api_key, api_secret) # Check and set take profit order
-        check_and_set_stop_loss(symbol, 'LONG', api_key, api_secret, working_type, stop_loss_roi) # Check and set stop loss order
-    else:
-        has_long_order = any(order['side'] == 'BUY' and order['positionSide'] == 'LONG' for order in open_orders)
-        if not has_long_order:
-            cancel_existing_orders(symbol, 'SELL', 'LONG', api_key, api_secret) # Cancel existing SELL orders
-            open_trailing_stop_order(symbol, 'BUY', leveraged_quantity, callback_rate, api_key, api_secret, 'LONG', working_type)
-
-    # Check SHORT positions and orders
-    short_position = next((p for p in positions if p['positionSide'] == 'SHORT' and p['symbol'] == symbol and float(p['positionAmt']) != 0), None)
-    if short_position:
-        position_amt = abs(float(short_position['positionAmt']))  # Ensure quantity is positive
-        has_short_close_order = any(order['side'] == 'BUY' and order['type'] == 'TRAILING_STOP_MARKET' and order['positionSide'] == 'SHORT' for order in open_orders)
-        if not has_short_close_order and take_profit_enabled == False:
-            open_trailing_stop_order(symbol, 'BUY', position_amt, callback_rate_close, api_key, api_secret, 'SHORT', working_type)
-        elif not has_short_close_order and take_profit_enabled == True:
-            check_and_set_take_profit(symbol, 'SHORT', take_profit_roi, working_type, api_key, api_secret)
-        check_and_set_stop_loss(symbol, 'SHORT', api_key, api_secret, working_type, stop_loss_roi)
-    else:
-        has_short_order = any(order['side'] == 'SELL' and order['positionSide'] == 'SHORT' for order in open_orders)
-        if not has_short_order:
-            cancel_existing_orders(symbol, 'BUY', 'SHORT', api_key, api_secret) # Cancel existing BUY orders
-            open_trailing_stop_order(symbol, 'SELL', leveraged_quantity, callback_rate, api_key, api_secret, 'SHORT', working_type)
-
-
-
-
-
+    orders = index_orders(snapshot.get_open_orders(symbol))  # Open orders by (side, type, positionSide)
+    filters = exchange_filters.get(symbol)
+    market_price = None
+    unpriced = set()  # Sides whose stop loss or take profit order could not be placed for lack of a price
+
+    for position_side in POSITION_SIDES:
+        if position_side not in position_sides:
+            continue
+        with timer('handle_orders_phase_seconds', phase=position_side.lower(), symbol=symbol):
+            # Compare the open orders of the side with the ones its position and settings require
+            position = snapshot.get_position(symbol, position_side)
+            position_amt = position.amount if position else 0
+            actions = reconcile_side(symbol, position_side, settings, account.leverage, position_amt, orders, filters, market_price)
+            if any(action.action == 'needs_price' for action in actions):
+                # A stop loss or take profit order has to be placed, which needs a recent last or mark price
+                market_price = price_cache.get(symbol, working_type)
+                if market_price is None:
+                    for action in actions:
+                        if action.action == 'needs_price':
+                            logger.error("Could not retrieve a recent market price, not placing the %s.", action.label, extra={'symbol': symbol})
+                    unpriced.add(position_side)
+                else:
+                    actions = reconcile_side(symbol, position_side, settings, account.leverage, position_amt, orders, filters, market_price)
+            for action in actions:
+                if action.action == 'needs_price':
+                    continue  # The other actions of the side do not need the price and are sent anyway
+                price = None
+                if action.kind == 'entry' and action.params is not None:
+                    # Entry orders are trailing stops without a stop price, their min notional is checked at the market price
+                    market_price = market_price or price_cache.get(symbol, working_type)
+                    price = market_price
+                if action.action == 'create':
+                    order_queue.create(action.params, action.label, price)
+                elif action.action == 'cancel':
+                    order_queue.cancel(action.order, action.label)
+                elif action.kind == 'entry':
+                    # Two entry orders could both fill, the old one goes first
+                    order_queue.cancel(action.order, f"{action.label}: cancel {action.order['orderId']}")
+                    order_queue.create(action.params, action.label, price)
+                else:
+                    order_queue.replace(action.order, action.params, action.label, price)  # The position stays protected in between
+
+    # Send all queued cancels and orders of this symbol in as few requests as possible
+    with timer('handle_orders_phase_seconds', phase='flush', symbol=symbol):
+        intents = order_queue.flush(api_key, api_secret, snapshot)
+    for intent in intents:
+        if intent.error is not None:
+            account.account_config.check_order_error(symbol, intent.error)  # Leverage errors make ensure apply the settings again
+
+    # Remember what the sides were handled with, so that a restart can skip the ones that did not change
+    failed = {intent.position_side for intent in intents if intent.error is not None} | unpriced
+    if account.store is not None:
+        key = settings_key([settings[field] for field in SETTINGS_FIELDS], account.leverage, account.margin_type)
+        account.store.record_handled(symbol, position_sides, snapshot, key, failed)
+    return failed
+
+def handle_symbol(symbol, params, snapshot=None, position_sides=('LONG', 'SHORT'), account=None):
+    """Handle the orders of one crypto_settings entry. Returns the position sides that could not be brought to the desired orders."""
+    return handle_orders(symbol, params["order_quantity"], params["callback_rate"], params["callback_rate_close"], params["working_type"], params["stop_loss_roi"], params["take_profit_roi"], params["take_profit_enabled"], snapshot, position_sides, account)
@@ -0,0 +1,173 @@
+import json
+import logging
+from binance_futures import client_for
+from exchange_filters import validate_order, check_filter_error
+from metrics import inc  # Order counters, no-op while metrics are disabled
+from logger import log_open_order  # One order_logger record per placed order
+
+logger = logging.getLogger('order_management')
+
+MAX_BATCH_CREATE = 5  # Maximum orders per /fapi/v1/batchOrders POST
+MAX_BATCH_CANCEL = 10  # Maximum order IDs per /fapi/v1/batchOrders DELETE
+
+class OrderIntent:
+    """An order to create or cancel, together with the result once the queue has been flushed."""
+
+    def __init__(self, action, symbol, position_side, params, label, replacement=None):
+        self.action = action  # 'create' or 'cancel'
+        self.replacement = replacement  # Create intent that must succeed before this order is cancelled
+        self.symbol = symbol
+        self.position_side = position_side
+        self.params = params  # Order parameters for 'create', {'orderId': ...} for 'cancel'
+        self.label = label  # Human readable description used in logs
+        self.response = None
+        self.error = None  # Error payload ({'code': ..., 'msg': ...}) if the item failed
+
+    def set_result(self, response):
+        self.response = response
+        if not isinstance(response, dict) or ('code' in response and 'orderId' not in response):
+            self.error = response
+
+def to_batch_item(params):
+    # batchOrders expects every value as a string.
+    return {key: str(value) for key, value in params.items()}
+
+class OrderQueue:
+    """Collect the orders to create and cancel during a cycle and send them in batches."""
+
+    def __init__(self, client=None, store=None):
+        self.client = client  # FuturesClient of the account, or the keys passed to flush are used
+        self.store = store  # StateStore that records the orders before and after they are sent, optional
+        self.intents = []
+
+    def __len__(self):
+        return len(self.intents)
+
+    def create(self, params, label, price=None):
+        # Queue an order to create. Orders that break the symbol filters fail without being sent.
+        # price is the reference price of the min notional check, by default the stopPrice of the order.
+        if self.store is not None:
+            params['newClientOrderId'] = self.store.client_order_id(params)
+        intent = OrderIntent('create', params['symbol'], params['positionSide'], params, label)
+        error = validate_order(params, price if price is not None else params.get('stopPrice'))
+        if error is not None:
+            intent.set_result({'code': None, 'msg': error})
+        self.intents.append(intent)
+        return intent
+
+    def cancel(self, order, label, replacement=None):
+        # Queue an open order to cancel. With a replacement it is only cancelled after that order was placed.
+        intent = OrderIntent('cancel', order['symbol'], order['positionSide'], {'orderId': order['orderId']}, label, replacement)
+        self.intents.append(intent)
+        return intent
+
+    def replace(self, order, params, label, price=None):
+        # Queue an order to create and the open order it replaces, which stays open if the new one fails.
+        intent = self.create(params, label, price)
+        self.cancel(order, f"{label}: cancel {order['orderId']}", intent)
+        return intent
+
+    def flush(self, api_key, api_secret, snapshot=None):
+        # Send cancels first, then creates, then the cancels of replaced orders whose replacement was placed.
+        # Returns the flushed intents with their results.
+        intents, self.intents = self.intents, []
+        client = self.client or client_for(api_key, api_secret)
+        cancels = [intent for intent in intents if intent.action == 'cancel']
+        creates = [intent for intent in intents if intent.action == 'create' and intent.error is None]
+        if self.store is not None and creates:
+            self.store.record_intents(creates)  # Written before sending, so a lost answer can be matched later
+
+        self._send_all_cancels([intent for intent in cancels if intent.replacement is None], client)
+        for i in range(0, len(creates), MAX_BATCH_CREATE):
+            self._send_creates(creates[i:i + MAX_BATCH_CREATE], client)
+        replaced = []
+        for intent in cancels:
+            if intent.replacement is not None:
+                if intent.replacement.error is None:
+                    replaced.append(intent)
+                else:
+                    intent.set_result({'code': None, 'msg': "Kept open, its replacement was not placed"})
+        self._send_all_cancels(replaced, client)
+        if self.store is not None:
+            self.store.record_results(cancels + creates)
+
+        for intent in intents:
+            if intent.action == 'create':
+                inc('orders_placed_total' if intent.error is None else 'orders_rejected_total', symbol=intent.symbol, type=intent.params['type'])
+            else:
+                inc('orders_cancelled_total' if intent.error is None else 'order_cancels_failed_total', symbol=intent.symbol)
+            if intent.error is not None:
+                check_filter_error(intent.error)
+                logger.error("%s failed: %s", intent.label, intent.error, extra={'symbol': intent.symbol, 'error': intent.error})
+                continue
+            if intent.action == 'create':
+                params = intent.params
+                log_open_order(intent.symbol, params['side'], params.get('quantity'), params.get('stopPrice') or params.get('activationPrice'), intent.position_side, params['type'])
+                logger.debug("%s response: %s", intent.label, intent.response, extra={'symbol': intent.symbol, 'response': intent.response})
+            else:
+                logger.info("%s response: %s", intent.label, intent.response, extra={'symbol': intent.symbol, 'response': intent.response})
+            if snapshot is not None:
+                if intent.action == 'create':
+                    snapshot.add_order(intent.response)
+                else:
+                    snapshot.remove_order(intent.symbol, intent.position_side, intent.params['orderId'])
+        return intents
+
+    def _send_all_cancels(self, cancels, client):
+        # Batch requests cancel orders of one symbol only.
+        symbols = []
+        for intent in cancels:
+            if intent.symbol not in symbols:
+                symbols.append(intent.symbol)
+        for symbol in symbols:
+            symbol_cancels = [intent for intent in cancels if intent.symbol == symbol]
+            for i in range(0, len(symbol_cancels), MAX_BATCH_CANCEL):
+                self._send_cancels(symbol, symbol_cancels[i:i + MAX_BATCH_CANCEL], client)
+
+    def _send_creates(self, intents, client):
+        # A single order goes to /fapi/v1/order, more are sent as one batch.
+        try:
+            if len(intents) == 1:
+                response = client.send_signed_request('POST', '/fapi/v1/order', intents[0].params)
+                intents[0].set_result(response.json())
+                return
+
+            params = {
+                'batchOrders': json.dumps([to_batch_item(intent.params) for intent in intents], separators=(',', ':'))
+            }
+            response = client.send_signed_request('POST', '/fapi/v1/batchOrders', params)
+            self._map_results(intents, response.json())
+        except Exception as e:
+            for intent in intents:
+                intent.set_result({'code': None, 'msg': str(e)})
+
+    def _send_cancels(self, symbol, intents, client):
+        # A single cancel goes to /fapi/v1/order, more are sent as one batch.
+        try:
+            if len(intents) == 1:
+                params = {
+                    'symbol': symbol,
+                    'orderId': intents[0].params['orderId']
+                }
+                response = client.send_signed_request('DELETE', '/fapi/v1/order', params)
+                intents[0].set_result(response.json())
+                return
+
+            params = {
+                'symbol': symbol,
+                'orderIdList': json.dumps([intent.params['orderId'] for intent in intents], separators=(',', ':'))
+            }
+            response = client.send_signed_request('DELETE', '/fapi/v1/batchOrders', params)
+            self._map_results(intents, response.json())
+        except Exception as e:
+            for intent in intents:
+                intent.set_result({'code': None, 'msg': str(e)})
+
+    def _map_results(self, intents, results):
+        # Batch responses list one result per item in request order. A failed request returns a single error.
+        if not isinstance(results, list):
+            for intent in intents:
+                intent.set_result(results)
+            return
+        for intent, result in zip(intents, results):
+            intent.set_result(result)
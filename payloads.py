@@ -0,0 +1,64 @@
+import json
+
+try:
+    import orjson  # Optional, decodes several times faster than json
+except ImportError:
+    orjson = None
+
+# positionRisk reports the margin type in lower case and 'cross' instead of 'CROSSED'
+MARGIN_TYPES = {
+    'isolated': 'ISOLATED',
+    'cross': 'CROSSED',
+    'crossed': 'CROSSED'
+}
+
+def loads(data):
+    # Decode a JSON response body, bytes or str.
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class Position:
+    """Open position of one (symbol, positionSide) with the /fapi/v2/positionRisk fields the bot uses."""
+
+    __slots__ = ('symbol', 'position_side', 'position_amt', 'amount', 'entry_price', 'mark_price')
+
+    def __init__(self, symbol, position_side, position_amt, amount, entry_price, mark_price):
+        self.symbol = symbol
+        self.position_side = position_side
+        self.position_amt = position_amt  # positionAmt as sent by the exchange, negative for SHORT
+        self.amount = amount  # positionAmt as a float
+        self.entry_price = entry_price
+        self.mark_price = mark_price
+
+    def __repr__(self):
+        return f"Position({self.symbol!r}, {self.position_side!r}, {self.position_amt!r})"
+
+def parse_positions(rows, symbols=None):
+    # Return the open positions of the symbols (all symbols if None) by (symbol, positionSide), and the
+    # leverage and margin type of the symbols as {symbol: {'leverage': int, 'margin_type': str}}.
+    # positionRisk lists every symbol of the exchange, the rows of other symbols are skipped unread.
+    positions = {}
+    setup = {}
+    for row in rows:
+        symbol = row['symbol']
+        if symbols is not None and symbol not in symbols:
+            continue
+        if symbol not in setup:
+            state = setup[symbol] = {}
+            if 'leverage' in row:
+                state['leverage'] = int(row['leverage'])
+            if 'marginType' in row:
+                state['margin_type'] = MARGIN_TYPES.get(row['marginType'].lower(), row['marginType'].upper())
+        amount = float(row['positionAmt'])
+        if amount != 0:
+            positions[(symbol, row['positionSide'])] = Position(symbol, row['positionSide'], row['positionAmt'], amount, float(row.get('entryPrice') or 0), float(row.get('markPrice') or 0))
+    return positions, setup
+
+def index_open_orders(rows, symbols=None):
+    # Group the open orders of the symbols (all symbols if None) by (symbol, positionSide).
+    open_orders = {}
+    for order in rows:
+        if symbols is None or order['symbol'] in symbols:
+            open_orders.setdefault((order['symbol'], order['positionSide']), []).append(order)
+    return open_orders
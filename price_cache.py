@@ -0,0 +1,92 @@
+import logging
+import threading
+import http_client  # Shared pooled HTTP transport
+import clock_sync  # Shared clock, the server time the price ages are measured against
+from config import price_cache_ttl, price_max_age
+
+logger = logging.getLogger(__name__)
+
+# Endpoint that returns the price of every symbol for each working_type, and the field holding the price
+PRICE_SOURCES = {
+    'LAST_PRICE': ('/fapi/v1/ticker/price', 'price'),
+    'MARK_PRICE': ('/fapi/v1/premiumIndex', 'markPrice')
+}
+
+class PriceCache:
+    """Last and mark prices of all symbols, each kind loaded with one request and reloaded after ttl seconds.
+
+    Prices carry the server time they were received at, stream prices the time of their event. A price
+    older than max_age seconds, even after a reload, is not returned, so that no stop loss or take profit
+    order is placed at a stale price. Stream events can keep the prices fresh without requests through update.
+    Without a transport and clock the shared ones are used.
+    """
+
+    def __init__(self, ttl, max_age, transport=None, clock=None):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.transport = transport or http_client.transport  # Its rate limiter counts the reloads
+        self.clock = clock or clock_sync.clock
+        self.prices = {working_type: {} for working_type in PRICE_SOURCES}  # working_type -> symbol -> (price, server time in ms)
+        self._locks = {working_type: threading.Lock() for working_type in PRICE_SOURCES}  # One reload per kind at a time
+        self.stats = {'hits': 0, 'refreshes': 0, 'refresh_errors': 0, 'stale': 0}
+
+    def refresh(self, working_type):
+        # Load the prices of all symbols of one kind with one request.
+        endpoint, field = PRICE_SOURCES[working_type]
+        try:
+            response = self.transport.request('GET', endpoint)
+            if response.status_code != 200:
+                logger.error("Failed to get prices from %s. Status code: %s", endpoint, response.status_code)
+                self.stats['refresh_errors'] += 1
+                return False
+            # The time of the response, not the time field of the items: ticker/price reports the last trade,
+            # which on a quiet symbol (or most testnet pairs) is older than max_age however often it is reloaded
+            now = self.clock.now_ms()
+            prices = {item['symbol']: (float(item[field]), now) for item in response.json()}
+        except Exception as e:
+            logger.error("Error getting prices from %s: %s", endpoint, e)
+            self.stats['refresh_errors'] += 1
+            return False
+        self.prices[working_type].update(prices)
+        self.stats['refreshes'] += 1
+        return True
+
+    def update(self, symbol, working_type, price, time_ms):
+        # Record a price from a stream event, unless a newer one is known.
+        current = self.prices[working_type].get(symbol)
+        if current is None or current[1] <= time_ms:
+            self.prices[working_type][symbol] = (float(price), time_ms)
+
+    def age(self, symbol, working_type):
+        # Seconds since the price was valid, or None if there is no price.
+        entry = self.prices[working_type].get(symbol)
+        if entry is None:
+            return None
+        return max(self.clock.now_ms() - entry[1], 0) / 1000
+
+    def get(self, symbol, working_type='LAST_PRICE'):
+        # Return the price of the symbol that matches working_type, reloading all prices of that kind when
+        # it is older than ttl. Returns None if no price younger than max_age is available after the reload.
+        working_type = working_type if working_type in PRICE_SOURCES else 'LAST_PRICE'
+        reload_age = min(self.ttl, self.max_age)  # A stream price that stopped updating is reloaded too
+        age = self.age(symbol, working_type)
+        if age is None or age > reload_age:
+            with self._locks[working_type]:
+                age = self.age(symbol, working_type)  # Another thread may have reloaded meanwhile
+                if age is None or age > reload_age:
+                    self.refresh(working_type)
+                    age = self.age(symbol, working_type)
+        else:
+            self.stats['hits'] += 1
+
+        if age is None or age > self.max_age:
+            logger.warning("No %s of %s younger than %ss (age: %s)", working_type, symbol, self.max_age, age, extra={'symbol': symbol, 'price_age': age})
+            self.stats['stale'] += 1
+            return None
+        return self.prices[working_type][symbol][0]
+
+    def get_stats(self):
+        return dict(self.stats)
+
+# Shared cache used by the stop loss and take profit pricing
+price_cache = PriceCache(price_cache_ttl, price_max_age)
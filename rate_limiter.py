@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+from config import request_weight_limit, order_limit_10s, order_limit_1m, read_weight_reserve
+
+logger = logging.getLogger(__name__)
+
+ORDER_ENDPOINTS = ('/fapi/v1/order', '/fapi/v1/batchOrders')
+
+# Request weight per (method, endpoint), as (weight with symbol, weight without symbol)
+ENDPOINT_WEIGHTS = {
+    ('GET', '/fapi/v1/time'): (1, 1),
+    ('GET', '/fapi/v1/exchangeInfo'): (1, 1),
+    ('GET', '/fapi/v2/positionRisk'): (5, 5),
+    ('GET', '/fapi/v1/openOrders'): (1, 40),
+    ('GET', '/fapi/v1/ticker/price'): (1, 2),
+    ('GET', '/fapi/v1/premiumIndex'): (1, 10),
+    ('POST', '/fapi/v1/order'): (1, 1),
+    ('DELETE', '/fapi/v1/order'): (1, 1),
+    ('POST', '/fapi/v1/batchOrders'): (5, 5),
+    ('DELETE', '/fapi/v1/batchOrders'): (1, 1),
+    ('POST', '/fapi/v1/leverage'): (1, 1),
+    ('POST', '/fapi/v1/marginType'): (1, 1),
+    ('POST', '/fapi/v1/listenKey'): (1, 1),
+    ('PUT', '/fapi/v1/listenKey'): (1, 1),
+}
+
+def request_cost(method, endpoint, params):
+    # Return the request weight and the number of orders a request uses.
+    params = params or {}
+    with_symbol, without_symbol = ENDPOINT_WEIGHTS.get((method, endpoint), (1, 1))
+    weight = with_symbol if 'symbol' in params else without_symbol
+
+    orders = 0
+    if method == 'POST' and endpoint == '/fapi/v1/order':
+        orders = 1
+    elif method == 'POST' and endpoint == '/fapi/v1/batchOrders':
+        orders = len(json.loads(params['batchOrders'])) if 'batchOrders' in params else 1  # Every order in the batch counts
+    return weight, orders
+
+class TokenBucket:
+    """Refills capacity tokens evenly over interval seconds."""
+
+    def __init__(self, capacity, interval):
+        self.capacity = capacity
+        self.rate = capacity / interval
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, reserve=0):
+        # Seconds until amount tokens are available while keeping reserve tokens unused.
+        deficit = amount + reserve - self.tokens
+        return max(deficit, 0) / self.rate
+
+    def sync(self, used):
+        # Never assume more budget than the server reports as left.
+        self.tokens = min(self.tokens, self.capacity - used)
+
+class RateLimiter:
+    """Client-side request weight and order rate limiter that follows the X-MBX-* response headers."""
+
+    def __init__(self, weight_limit, order_limit_10s, order_limit_1m, read_reserve, weight_share=1.0, order_share=1.0):
+        # weight_share and order_share are the parts of the limits this limiter may use when several
+        # processes share them. The server reports the usage of all of them, which is scaled down the same way.
+        self.weight_share = weight_share
+        self.order_share = order_share
+        self.weight = TokenBucket(weight_limit * weight_share, 60)
+        self.orders_10s = TokenBucket(order_limit_10s * order_share, 10)
+        self.orders_1m = TokenBucket(order_limit_1m * order_share, 60)
+        self.read_reserve = self.weight.capacity * read_reserve  # Weight only order requests may use
+        self.paused_until = 0.0  # Set after a 429 or 418 response
+        self._lock = threading.Lock()
+        self.metrics = {
+            'requests': 0,
+            'throttled': 0,  # Requests that had to wait for budget
+            'wait_time': 0.0,
+            'rate_limited_responses': 0,  # 429 and 418 responses
+            'used_weight_1m': 0,  # Last value reported by the server
+            'order_count_10s': 0,
+            'order_count_1m': 0,
+        }
+
+    def acquire(self, method, endpoint, params=None):
+        # Block until the request fits in the budget. Order requests may use the reserved part of the weight budget.
+        weight, orders = request_cost(method, endpoint, params)
+        is_order = endpoint in ORDER_ENDPOINTS
+        reserve = 0 if is_order else self.read_reserve
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for bucket in (self.weight, self.orders_10s, self.orders_1m):
+                    bucket.refill(now)
+
+                wait = max(
+                    self.paused_until - now,
+                    self.weight.wait_time(weight, reserve),
+                    self.orders_10s.wait_time(orders) if orders else 0,
+                    self.orders_1m.wait_time(orders) if orders else 0
+                )
+                if wait <= 0:
+                    self.weight.tokens -= weight
+                    self.orders_10s.tokens -= orders
+                    self.orders_1m.tokens -= orders
+                    self.metrics['requests'] += 1
+                    if waited:
+                        self.metrics['throttled'] += 1
+                        self.metrics['wait_time'] += waited
+                    return
+
+            if not waited:
+                logger.info("Rate limit budget short, waiting %.2fs before %s %s", wait, method, endpoint)
+            time.sleep(min(wait, 1))
+            waited += min(wait, 1)
+
+    def update(self, response):
+        # Sync the budget with the usage the server reports and back off after 429 or 418.
+        headers = response.headers
+        with self._lock:
+            used_weight = headers.get('X-MBX-USED-WEIGHT-1M')
+            if used_weight is not None:
+                self.metrics['used_weight_1m'] = int(used_weight)
+                self.weight.sync(int(used_weight) * self.weight_share)
+            order_count_10s = headers.get('X-MBX-ORDER-COUNT-10S')
+            if order_count_10s is not None:
+                self.metrics['order_count_10s'] = int(order_count_10s)
+                self.orders_10s.sync(int(order_count_10s) * self.order_share)
+            order_count_1m = headers.get('X-MBX-ORDER-COUNT-1M')
+            if order_count_1m is not None:
+                self.metrics['order_count_1m'] = int(order_count_1m)
+                self.orders_1m.sync(int(order_count_1m) * self.order_share)
+
+            if response.status_code in (418, 429):
+                retry_after = int(headers.get('Retry-After', 60))
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self.metrics['rate_limited_responses'] += 1
+                logger.warning("Rate limited (%s), pausing requests for %ss", response.status_code, retry_after)
+
+    def get_metrics(self):
+        # Return the counters together with the remaining budget.
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self.weight, self.orders_10s, self.orders_1m):
+                bucket.refill(now)
+            metrics = dict(self.metrics)
+            metrics['remaining_weight'] = self.weight.tokens
+            metrics['remaining_orders_10s'] = self.orders_10s.tokens
+            metrics['remaining_orders_1m'] = self.orders_1m.tokens
+            metrics['paused_for'] = max(self.paused_until - now, 0)
+        return metrics
+
+# Shared limiter used by the HTTP transport
+limiter = RateLimiter(request_weight_limit, order_limit_10s, order_limit_1m, read_weight_reserve)
@@ -0,0 +1,152 @@
+# Desired-state order reconciliation. Pure functions without API calls, used by handle_orders.
+#
+# For one (symbol, positionSide) the settings and the position decide which orders should be open:
+#   - flat: one trailing stop entry order, and no orders on the closing side
+#   - position: a stop loss, and a trailing stop close order or (with take_profit_enabled) a take profit order,
+#     all for the position quantity. When the quantity changes they are replaced at their old stop price.
+# The open orders are compared with that and only the differences are returned as actions. A new stop loss or
+# take profit order needs the market price; without one it is returned as a 'needs_price' action instead.
+from decimal import Decimal
+from exchange_filters import round_quantity, round_price
+from strategy import entry_side, close_side, entry_quantity, stop_loss_price, take_profit_price
+
+TRAILING_STOP = 'TRAILING_STOP_MARKET'
+STOP_LOSS = 'STOP_MARKET'
+TAKE_PROFIT = 'TAKE_PROFIT_MARKET'
+
+class OrderAction:
+    """A change to the open orders of a side.
+
+    'create' places params, 'cancel' cancels order and 'replace' does both. A replaced protective order is
+    cancelled only after its successor was placed, so the position is never without it. 'needs_price' marks
+    an order that could not be built without the market price, order is the open order it would replace.
+    """
+
+    __slots__ = ('action', 'kind', 'position_side', 'params', 'order', 'label')
+
+    def __init__(self, action, kind, position_side, params, order, label):
+        self.action = action  # 'create', 'cancel', 'replace' or 'needs_price'
+        self.kind = kind  # 'entry', 'close', 'stop_loss', 'take_profit' or 'stale'
+        self.position_side = position_side
+        self.params = params  # Order to place, None for 'cancel'
+        self.order = order  # Open order to cancel, None for 'create'
+        self.label = label
+
+    def __repr__(self):
+        return f"OrderAction({self.action!r}, {self.kind!r}, {self.position_side!r})"
+
+def index_orders(open_orders):
+    # Group open orders by (side, type, positionSide) with one pass.
+    index = {}
+    for order in open_orders:
+        index.setdefault((order['side'], order['type'], order['positionSide']), []).append(order)
+    return index
+
+def remaining_quantity(order):
+    # Quantity of an order that is not filled yet.
+    return Decimal(order['origQty']) - Decimal(order.get('executedQty') or 0)
+
+def matches(order, wanted):
+    # Whether an open order has the quantity, and callback rate if given, in wanted. Stop prices follow the
+    # market price at the time the order is placed and are not compared.
+    if remaining_quantity(order) != Decimal(str(wanted['quantity'])):
+        return False
+    if 'callbackRate' in wanted and Decimal(str(order.get('priceRate') or 0)) != Decimal(str(wanted['callbackRate'])):
+        return False
+    return True
+
+def trailing_stop_params(symbol, side, quantity, callback_rate, position_side, working_type, filters):
+    return {
+        'symbol': symbol,
+        'side': side,
+        'type': TRAILING_STOP,
+        'quantity': round_quantity(filters, abs(quantity)),
+        'callbackRate': callback_rate,
+        'positionSide': position_side,
+        'workingType': working_type
+    }
+
+def stop_params(symbol, side, order_type, quantity, stop_price, position_side, working_type, filters):
+    return {
+        'symbol': symbol,
+        'side': side,
+        'type': order_type,
+        'quantity': round_quantity(filters, quantity),
+        'stopPrice': round_price(filters, stop_price),
+        'positionSide': position_side,
+        'workingType': working_type
+    }
+
+def _converge(actions, kind, position_side, existing, wanted, build, label):
+    # Keep the first existing order that matches wanted and cancel the others. Without a match the first
+    # existing order is replaced by build(order), or build(None) is created if there is none. If build needs
+    # the market price and none was given, the first existing order is kept for now.
+    kept = None
+    for order in existing:
+        if matches(order, wanted):
+            kept = order
+            break
+
+    if kept is None:
+        params = build(existing[0] if existing else None)
+        if params is None:
+            kept = existing[0] if existing else None
+            actions.append(OrderAction('needs_price', kind, position_side, None, kept, label))
+        elif existing:
+            kept = existing[0]
+            actions.append(OrderAction('replace', kind, position_side, params, kept, f"{label} (replaces {kept['orderId']})"))
+        else:
+            actions.append(OrderAction('create', kind, position_side, params, None, label))
+
+    for order in existing:
+        if order is not kept:
+            actions.append(OrderAction('cancel', kind, position_side, None, order, f"{label}: cancel duplicate {order['orderId']}"))
+
+def reconcile_side(symbol, position_side, settings, leverage, position_amt, orders, filters=None, market_price=None):
+    # Return the actions that turn the open orders of one side into the desired ones.
+    # settings is the crypto_settings entry of the symbol, orders the index_orders of its open orders and
+    # filters its SymbolFilters. A new stop loss or take profit order is priced from market_price, or returned as
+    # a 'needs_price' action when it is None, so that the price is only fetched when it is needed. The other
+    # actions do not depend on the price. Replacements keep the stop price of the order they replace.
+    entry, close = entry_side(position_side), close_side(position_side)
+    working_type = settings['working_type']
+    actions = []
+
+    def protective(order_type, order, formula, roi):
+        # Stop loss or take profit order for the position quantity. A replaced order keeps its stop price, so
+        # that a partial fill after an adverse move does not move the stop with the market. A new order is
+        # priced from the market price, or None is returned without one.
+        if order is not None and float(order.get('stopPrice') or 0):
+            stop_price = float(order['stopPrice'])
+        elif market_price is None:
+            return None
+        else:
+            stop_price = formula(market_price, position_side, roi, leverage)
+        return stop_params(symbol, close, order_type, quantity, stop_price, position_side, working_type, filters)
+
+    quantity = abs(float(position_amt))
+    if quantity == 0:
+        wanted = {'quantity': round_quantity(filters, entry_quantity(settings['order_quantity'], leverage)), 'callbackRate': settings['callback_rate']}
+        build = lambda order: trailing_stop_params(symbol, entry, entry_quantity(settings['order_quantity'], leverage), settings['callback_rate'], position_side, working_type, filters)
+        _converge(actions, 'entry', position_side, orders.get((entry, TRAILING_STOP, position_side), []), wanted, build, f"{symbol} {position_side} trailing stop entry order")
+        # Orders that would close a position are left over from the last one
+        for (side, order_type, order_position_side), stale in orders.items():
+            if side == close and order_position_side == position_side:
+                for order in stale:
+                    actions.append(OrderAction('cancel', 'stale', position_side, None, order, f"{symbol} {position_side} cancel order {order['orderId']}"))
+        return actions
+
+    wanted = {'quantity': round_quantity(filters, quantity)}
+    closers = orders.get((close, TRAILING_STOP, position_side), [])
+    if not settings['take_profit_enabled'] or closers:
+        # An open trailing stop close order also covers the take profit
+        wanted_close = dict(wanted, callbackRate=settings['callback_rate_close'])
+        build = lambda order: trailing_stop_params(symbol, close, quantity, settings['callback_rate_close'], position_side, working_type, filters)
+        _converge(actions, 'close', position_side, closers, wanted_close, build, f"{symbol} {position_side} trailing stop close order")
+    else:
+        build = lambda order: protective(TAKE_PROFIT, order, take_profit_price, settings['take_profit_roi'])
+        _converge(actions, 'take_profit', position_side, orders.get((close, TAKE_PROFIT, position_side), []), wanted, build, f"{symbol} {position_side} take profit order")
+
+    build = lambda order: protective(STOP_LOSS, order, stop_loss_price, settings['stop_loss_roi'])
+    _converge(actions, 'stop_loss', position_side, orders.get((close, STOP_LOSS, position_side), []), wanted, build, f"{symbol} {position_side} stop loss order")
+    return actions
@@ -0,0 +1,130 @@
+import functools
+import logging
+import math
+import multiprocessing
+import signal
+import sys
+import time
+from config import accounts, symbols_per_worker, worker_restart_delay, max_concurrent_symbols, cycle_deadline, state_enabled
+from logger import setup_logger
+from accounts import create_account
+from account_snapshot import AccountSnapshot
+from order_management import handle_symbol
+from scheduler import SymbolScheduler
+from state_store import open_store
+from exchange_filters import exchange_filters
+from price_cache import price_cache
+
+CYCLE_INTERVAL = 10  # Seconds between cycles, same as main.py
+MAX_RESTART_DELAY = 300  # Upper limit for the restart backoff
+STABLE_RUN_TIME = 60  # A worker that ran at least this long before exiting is restarted without backoff
+
+logger = logging.getLogger(__name__)
+
+def plan_shards(accounts, symbols_per_worker):
+    # Split the crypto_settings of every account into shards of at most symbols_per_worker symbols.
+    shards = []
+    for settings in accounts:
+        symbols = list(settings['crypto_settings'].items())
+        count = max(1, math.ceil(len(symbols) / symbols_per_worker))
+        for index in range(count):
+            shards.append({
+                'name': f"{settings['name']}-{index}",
+                'account': settings,
+                'count': count,  # Shards of this account, they split its order rate limits
+                'symbols': dict(symbols[index::count])
+            })
+    return shards
+
+def run_worker(shard, weight_share):
+    # Entry point of a worker process. Handles the symbols of one shard of one account like main.py.
+    setup_logger(f"{shard['name']}.jsonl")
+    account = create_account(dict(shard['account'], crypto_settings=shard['symbols']), weight_share, 1 / shard['count'])
+    # The worker handles one account, its exchange info and prices are loaded within the weight share of the account too
+    exchange_filters.transport = account.client.transport
+    price_cache.transport, price_cache.clock = account.client.transport, account.client.clock
+    store = open_store(shard['name']) if state_enabled else None
+    if store is not None:
+        account.attach_store(store)
+    scheduler = SymbolScheduler(functools.partial(handle_symbol, account=account), max_concurrent_symbols, cycle_deadline)
+    account.client.clock.start()
+    logger.info("Worker %s started with %s symbols", shard['name'], len(shard['symbols']))
+
+    seeded = False
+    while True:
+        snapshot = AccountSnapshot.fetch(account.client.api_key, account.client.api_secret, account.client, account.crypto_settings)
+        if snapshot is None:
+            logger.warning("Failed to get account snapshot, retrying...")
+            time.sleep(CYCLE_INTERVAL)
+            continue
+
+        account.account_config.load(snapshot.setup)  # Leverage and margin type as the exchange reports them
+        if not seeded:
+            seeded = True
+            if store is not None:
+                # Only the sides that changed since the worker last ran need handling after a restart
+                position_sides = store.reconcile(snapshot, account.crypto_settings, account.leverage, account.margin_type)
+                scheduler.run_cycle({symbol: account.crypto_settings[symbol] for symbol in position_sides}, snapshot, position_sides)
+                time.sleep(CYCLE_INTERVAL)
+                continue
+
+        scheduler.run_cycle(account.crypto_settings, snapshot)
+        time.sleep(CYCLE_INTERVAL)
+
+class Supervisor:
+    """Runs one worker process per shard and restarts workers that exit."""
+
+    def __init__(self, shards, restart_delay):
+        self.shards = {shard['name']: shard for shard in shards}
+        self.restart_delay = restart_delay
+        self.weight_share = 1 / len(shards)  # Request weight is limited per IP, so all workers split it
+        self.context = multiprocessing.get_context('spawn')  # Workers start clean instead of inheriting threads and sockets
+        self.workers = {}  # shard name -> {'process': Process, 'started': float, 'delay': float, 'restart_at': float}
+
+    def start_worker(self, name):
+        process = self.context.Process(target=run_worker, args=(self.shards[name], self.weight_share), name=f"worker-{name}", daemon=True)
+        process.start()
+        worker = self.workers.setdefault(name, {'delay': self.restart_delay})
+        worker.update(process=process, started=time.monotonic(), restart_at=None)
+
+    def check_workers(self):
+        # Schedule a restart for workers that exited and start the ones whose delay has passed.
+        now = time.monotonic()
+        for name, worker in self.workers.items():
+            process = worker['process']
+            if worker['restart_at'] is None and not process.is_alive():
+                if now - worker['started'] >= STABLE_RUN_TIME:
+                    worker['delay'] = self.restart_delay
+                logger.error("Worker %s exited with code %s, restarting in %ss", name, process.exitcode, worker['delay'])
+                worker['restart_at'] = now + worker['delay']
+                worker['delay'] = min(worker['delay'] * 2, MAX_RESTART_DELAY)
+            elif worker['restart_at'] is not None and now >= worker['restart_at']:
+                self.start_worker(name)
+
+    def stop(self):
+        for worker in self.workers.values():
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        for worker in self.workers.values():
+            worker['process'].join(timeout=10)
+
+    def run(self):
+        for name in self.shards:
+            self.start_worker(name)
+        try:
+            while True:
+                time.sleep(1)
+                self.check_workers()
+        finally:
+            self.stop()
+
+if __name__ == '__main__':
+    setup_logger('runner.jsonl')
+    if not accounts:
+        logger.error("No accounts in config.accounts, nothing to run.")
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Stop the workers on SIGTERM too
+
+    shards = plan_shards(accounts, symbols_per_worker)
+    logger.info("Starting %s workers for %s accounts", len(shards), len(accounts))
+    Supervisor(shards, worker_restart_delay).run()
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from metrics import observe
+
+POSITION_SIDES = ('LONG', 'SHORT')
+
+logger = logging.getLogger(__name__)
+
+class SymbolScheduler:
+    """Run per-symbol work concurrently on a bounded thread pool."""
+
+    def __init__(self, handler, max_in_flight, cycle_deadline):
+        self.handler = handler  # Called as handler(symbol, params, snapshot, position_sides), returns the sides it could not settle
+        self.cycle_deadline = cycle_deadline  # Seconds to wait for a cycle before moving on
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)  # The pool size is the global in-flight cap
+        self._locks = {}  # (symbol, positionSide) -> Lock
+        self._locks_guard = threading.Lock()
+        self.metrics = {
+            'cycles': 0,
+            'last_cycle_time': 0.0,  # Seconds from cycle start until all symbols finished or the deadline hit
+            'max_cycle_time': 0.0,
+            'deadline_misses': 0,
+            'skipped_symbols': 0,  # Symbols skipped because the previous task still held the lock
+            'symbol_lag': {},  # symbol -> seconds from cycle start until its task started
+            'symbol_duration': {},  # symbol -> seconds the task took
+        }
+
+    def _get_locks(self, symbol, position_sides):
+        # Return the locks for the position sides of a symbol, always in the same order.
+        with self._locks_guard:
+            return [self._locks.setdefault((symbol, position_side), threading.Lock()) for position_side in POSITION_SIDES if position_side in position_sides]
+
+    def _run_symbol(self, symbol, params, snapshot, position_sides, cycle_start, handler):
+        # Run the handler for one symbol while holding the locks of the position sides it handles. Returns the
+        # position sides that were not settled: those the handler returned, or all of them if it did not run.
+        started = time.monotonic()
+        self.metrics['symbol_lag'][symbol] = started - cycle_start
+
+        locks = self._get_locks(symbol, position_sides)
+        acquired = []
+        for lock in locks:
+            if not lock.acquire(blocking=False):
+                break
+            acquired.append(lock)
+
+        try:
+            if len(acquired) < len(locks):
+                logger.info("Skipping %s: previous task is still running.", symbol)
+                self.metrics['skipped_symbols'] += 1
+                return set(position_sides)
+            return set(handler(symbol, params, snapshot, position_sides) or ())
+        except Exception as e:
+            logger.exception("Error handling orders for %s: %s", symbol, e)
+            return set(position_sides)
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            self.metrics['symbol_duration'][symbol] = time.monotonic() - started
+            observe('symbol_handle_seconds', self.metrics['symbol_duration'][symbol], symbol=symbol)
+
+    def submit(self, symbol, params, snapshot, position_sides=POSITION_SIDES, queued_at=None, handler=None):
+        # Run the handler, or another one with the same arguments, for one symbol without waiting for it.
+        # The symbol lag is measured from queued_at, by default from now.
+        return self.executor.submit(self._run_symbol, symbol, params, snapshot, tuple(position_sides), queued_at or time.monotonic(), handler or self.handler)
+
+    def run_cycle(self, settings, snapshot, position_sides=None, failed=None):
+        # Run the handler for every symbol in settings and wait until done or the deadline passes.
+        # position_sides optionally maps a symbol to the sides to handle, both sides are handled by default.
+        # failed, if given, receives symbol -> the sides that were not settled, unfinished symbols included.
+        position_sides = position_sides or {}
+        cycle_start = time.monotonic()
+        futures = {symbol: self.submit(symbol, params, snapshot, position_sides.get(symbol, POSITION_SIDES), cycle_start) for symbol, params in settings.items()}
+        done, not_done = wait(futures.values(), timeout=self.cycle_deadline)
+        if failed is not None:
+            for symbol, future in futures.items():
+                sides = future.result() if future in done else set(position_sides.get(symbol, POSITION_SIDES))
+                if sides:
+                    failed[symbol] = sides
+
+        if not_done:
+            logger.warning("Cycle deadline of %ss exceeded, %s symbols still pending.", self.cycle_deadline, len(not_done))
+            self.metrics['deadline_misses'] += 1
+            for future in not_done:
+                future.cancel()  # Tasks not yet started are dropped, running ones finish in the background
+
+        cycle_time = time.monotonic() - cycle_start
+        self.metrics['cycles'] += 1
+        self.metrics['last_cycle_time'] = cycle_time
+        self.metrics['max_cycle_time'] = max(self.metrics['max_cycle_time'], cycle_time)
+        logger.debug("Cycle finished in %.3fs", cycle_time)
+        return cycle_time
+
+    def get_metrics(self):
+        # Return a copy of the scheduler metrics.
+        metrics = dict(self.metrics)
+        metrics['symbol_lag'] = dict(self.metrics['symbol_lag'])
+        metrics['symbol_duration'] = dict(self.metrics['symbol_duration'])
+        return metrics
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from config import state_dir
+
+logger = logging.getLogger(__name__)
+
+CLIENT_ORDER_PREFIX = 'tb-'  # newClientOrderId prefix of the orders placed by the bot
+DUPLICATE_CLIENT_ORDER_ID = -4116  # An open order with this newClientOrderId already exists
+UNKNOWN_SEND_STATUS = -1007  # The exchange timed out, the order may or may not have been placed
+FINISHED_ORDER_RETENTION = 7 * 86400  # Seconds finished orders are kept in the store
+
+# Order statuses in the store
+INTENDED = 'intended'  # Written before the order is sent
+ACKNOWLEDGED = 'acknowledged'  # The exchange answered with an orderId, or reported the newClientOrderId as a duplicate
+UNKNOWN = 'unknown'  # Sent, but no answer came back. The order may exist on the exchange.
+REJECTED = 'rejected'  # The exchange answered with an error
+CANCELLED = 'cancelled'  # Cancelled by the bot
+CLOSED = 'closed'  # Was acknowledged, but is no longer open at startup (filled, expired or cancelled elsewhere)
+MISSING = 'missing'  # Was intended or unknown, but is not open at startup
+PENDING = (INTENDED, UNKNOWN)
+
+# crypto_settings fields that decide the orders of a side
+SETTINGS_FIELDS = ('order_quantity', 'callback_rate', 'callback_rate_close', 'working_type', 'stop_loss_roi', 'take_profit_roi', 'take_profit_enabled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    client_order_id TEXT PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    position_side TEXT NOT NULL,
+    side TEXT NOT NULL,
+    type TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    order_id INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_side ON orders (symbol, position_side, status);
+CREATE INDEX IF NOT EXISTS orders_order_id ON orders (order_id);
+CREATE TABLE IF NOT EXISTS positions (
+    symbol TEXT NOT NULL,
+    position_side TEXT NOT NULL,
+    position_amt TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    settled INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (symbol, position_side)
+);
+CREATE TABLE IF NOT EXISTS symbol_setup (
+    symbol TEXT PRIMARY KEY,
+    leverage INTEGER,
+    margin_type TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+def settings_key(values, leverage, margin_type):
+    # Fingerprint of the settings a side is handled with, the values of SETTINGS_FIELDS in that order.
+    return json.dumps(list(values) + [leverage, margin_type])
+
+def new_client_order_id():
+    # Binance accepts up to 36 characters of [.A-Z:/a-z0-9_-].
+    return CLIENT_ORDER_PREFIX + uuid.uuid4().hex[:24]
+
+class StateStore:
+    """Local SQLite store of the orders sent, the last handled positions and the setup state per symbol.
+
+    Every order gets a newClientOrderId that is written to the store before the order is sent. After a
+    restart or a lost response the id is matched against the open orders of the exchange, and an order
+    whose outcome is unknown is resent with the same id, so the exchange rejects it if it already exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # One connection shared by the scheduler threads
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')  # Survives a crash of the process, commits without an fsync
+        self._conn.executescript(SCHEMA)
+        self._positions = {(row[0], row[1]): (row[2], row[3], row[4]) for row in self._conn.execute('SELECT symbol, position_side, position_amt, settings, settled FROM positions')}
+        self.prune()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, statement, rows):
+        # Run one statement for all rows in a single transaction.
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(statement, rows)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def prune(self, max_age=FINISHED_ORDER_RETENTION):
+        # Delete finished orders older than max_age seconds.
+        with self._lock:
+            self._conn.execute('DELETE FROM orders WHERE status IN (?, ?, ?, ?) AND updated_at < ?', (REJECTED, CANCELLED, CLOSED, MISSING, time.time() - max_age))
+
+    # Orders
+    def client_order_id(self, params):
+        # Return the newClientOrderId for an order. An earlier order of the same symbol, side and type whose
+        # outcome is still open reuses its id, so that resending it cannot create a second order.
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT client_order_id FROM orders WHERE symbol = ? AND position_side = ? AND side = ? AND type = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1',
+                (params['symbol'], params['positionSide'], params['side'], params['type']) + PENDING
+            ).fetchone()
+        return row[0] if row else new_client_order_id()
+
+    def record_intents(self, intents):
+        # Write the orders about to be sent.
+        now = time.time()
+        self._write(
+            'INSERT INTO orders (client_order_id, symbol, position_side, side, type, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (client_order_id) DO UPDATE SET params = excluded.params, status = excluded.status, updated_at = excluded.updated_at',
+            [(intent.params['newClientOrderId'], intent.symbol, intent.position_side, intent.params['side'], intent.params['type'], json.dumps(intent.params, default=str), INTENDED, now, now) for intent in intents]
+        )
+
+    def record_results(self, intents):
+        # Write the outcome of sent orders and cancels.
+        now = time.time()
+        rows = []
+        cancelled = []
+        for intent in intents:
+            if intent.action == 'cancel':
+                if intent.error is None:
+                    cancelled.append((CANCELLED, now, intent.params['orderId']))
+                continue
+            client_order_id = intent.params['newClientOrderId']
+            if intent.error is None:
+                rows.append((ACKNOWLEDGED, intent.response['orderId'], None, now, client_order_id))
+                continue
+            code = intent.error.get('code') if isinstance(intent.error, dict) else None
+            if code == DUPLICATE_CLIENT_ORDER_ID:
+                status = ACKNOWLEDGED  # Placed by an earlier attempt whose answer was lost
+            elif code is None or code == UNKNOWN_SEND_STATUS:
+                status = UNKNOWN
+            else:
+                status = REJECTED
+            rows.append((status, None, json.dumps(intent.error, default=str), now, client_order_id))
+        if rows:
+            self._write('UPDATE orders SET status = ?, order_id = COALESCE(?, order_id), error = ?, updated_at = ? WHERE client_order_id = ?', rows)
+        if cancelled:
+            self._write('UPDATE orders SET status = ?, updated_at = ? WHERE order_id = ?', cancelled)
+
+    def get_orders(self, statuses):
+        # Return the stored orders with one of the statuses as dicts.
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT client_order_id, symbol, position_side, side, type, status, order_id FROM orders WHERE status IN ({', '.join('?' * len(statuses))})", tuple(statuses))
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    # Positions
+    def record_handled(self, symbol, position_sides, snapshot, settings, failed):
+        # Remember the position and settings a side was last handled with, and whether all of its orders went
+        # through. Only changed rows are written, a steady cycle does not touch the database.
+        now = time.time()
+        rows = []
+        for position_side in position_sides:
+            position = snapshot.get_position(symbol, position_side)
+            state = (position.position_amt if position else '0', settings, 0 if position_side in failed else 1)
+            if self._positions.get((symbol, position_side)) != state:
+                self._positions[(symbol, position_side)] = state
+                rows.append((symbol, position_side) + state + (now,))
+        if rows:
+            self._write('INSERT OR REPLACE INTO positions (symbol, position_side, position_amt, settings, settled, updated_at) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    # Setup state
+    def load_setup(self):
+        # Return {symbol: {'leverage': int, 'margin_type': str}} of the known settings.
+        with self._lock:
+            rows = self._conn.execute('SELECT symbol, leverage, margin_type FROM symbol_setup').fetchall()
+        setup = {}
+        for symbol, symbol_leverage, symbol_margin_type in rows:
+            state = setup[symbol] = {}
+            if symbol_leverage is not None:
+                state['leverage'] = symbol_leverage
+            if symbol_margin_type is not None:
+                state['margin_type'] = symbol_margin_type
+        return setup
+
+    def save_setup(self, symbol, state):
+        self._write('INSERT OR REPLACE INTO symbol_setup (symbol, leverage, margin_type, updated_at) VALUES (?, ?, ?, ?)', [(symbol, state.get('leverage'), state.get('margin_type'), time.time())])
+
+    # Startup
+    def reconcile(self, snapshot, settings, leverage, margin_type):
+        # Compare the store with a fresh snapshot after a restart. Pending orders that are open on the
+        # exchange are acknowledged, the other stored orders are closed. Returns {symbol: sides} of the sides
+        # that changed, or were not settled, since they were last handled. All other sides are up to date.
+        open_orders = {}
+        for orders in snapshot.open_orders.values():
+            for order in orders:
+                open_orders[order.get('clientOrderId')] = order
+
+        dirty = {}
+        rows = []
+        now = time.time()
+        for order in self.get_orders((INTENDED, UNKNOWN, ACKNOWLEDGED)):
+            found = open_orders.get(order['client_order_id'])
+            if found is not None:
+                if order['status'] != ACKNOWLEDGED or order['order_id'] != found['orderId']:
+                    rows.append((ACKNOWLEDGED, found['orderId'], now, order['client_order_id']))
+                continue
+            rows.append((CLOSED if order['status'] == ACKNOWLEDGED else MISSING, order['order_id'], now, order['client_order_id']))
+            dirty.setdefault(order['symbol'], set()).add(order['position_side'])
+        if rows:
+            self._write('UPDATE orders SET status = ?, order_id = ?, updated_at = ? WHERE client_order_id = ?', rows)
+
+        for symbol, params in settings.items():
+            for position_side in ('LONG', 'SHORT'):
+                position = snapshot.get_position(symbol, position_side)
+                stored = self._positions.get((symbol, position_side))
+                current = (position.position_amt if position else '0', settings_key([params[field] for field in SETTINGS_FIELDS], leverage, margin_type))
+                if stored is None or stored[:2] != current or not stored[2]:
+                    dirty.setdefault(symbol, set()).add(position_side)
+
+        dirty = {symbol: tuple(sides) for symbol, sides in dirty.items() if symbol in settings}
+        logger.info("Startup reconciliation: %s of %s symbols changed since the last run, %s stored orders updated", len(dirty), len(settings), len(rows))
+        return dirty
+
+def open_store(name):
+    # Open the state database <name>.db in state_dir.
+    os.makedirs(state_dir, exist_ok=True)
+    return StateStore(os.path.join(state_dir, f"{name}.db"))
@@ -0,0 +1,32 @@
+# Order rules shared by handle_orders and the backtest. Pure functions without API calls.
+
+def entry_side(position_side):
+    # Side of the trailing stop order that opens a position.
+    return 'BUY' if position_side == 'LONG' else 'SELL'
+
+def close_side(position_side):
+    # Side of the orders that close a position.
+    return 'SELL' if position_side == 'LONG' else 'BUY'
+
+def entry_quantity(order_quantity, leverage):
+    # Quantity of the trailing stop order that opens a position.
+    return order_quantity * leverage
+
+def stop_loss_price(market_price, position_side, stop_loss_roi, leverage):
+    # Calculate stop loss price based on leverage and ROI.
+    if position_side == 'LONG':
+        return market_price * (1 + stop_loss_roi / leverage / 100)
+    return market_price * (1 - stop_loss_roi / leverage / 100)
+
+def position_roi(entry_price, mark_price, position_side, leverage):
+    # Return on investment percentage of a position at the mark price, the inverse of stop_loss_price.
+    if entry_price == 0:
+        return 0.0
+    change = (mark_price / entry_price - 1) * leverage * 100
+    return change if position_side == 'LONG' else -change
+
+def take_profit_price(market_price, position_side, take_profit_roi, leverage):
+    # Calculate take profit price based on leverage and ROI.
+    if position_side == 'LONG':
+        return market_price * (1 + take_profit_roi / leverage / 100)
+    return market_price * (1 - take_profit_roi / leverage / 100)
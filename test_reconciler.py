@@ -0,0 +1,159 @@
+# Tests of the order reconciler. Run with python -m unittest test_reconciler (or pytest).
+import unittest
+from decimal import Decimal
+from exchange_filters import SymbolFilters
+from reconciler import index_orders, reconcile_side, remaining_quantity, TRAILING_STOP, STOP_LOSS, TAKE_PROFIT
+
+SYMBOL = 'BTCUSDT'
+LEVERAGE = 10
+FILTERS = SymbolFilters(Decimal('0.001'), Decimal('0.1'), Decimal('0.001'), Decimal(1000), Decimal(5))
+SETTINGS = {
+    'order_quantity': 0.001,
+    'callback_rate': 0.5,
+    'callback_rate_close': 0.3,
+    'working_type': 'MARK_PRICE',
+    'stop_loss_roi': -5,
+    'take_profit_roi': 10,
+    'take_profit_enabled': False
+}
+
+def order(order_id, side, order_type, position_side, quantity, executed='0', price_rate='0', stop_price='0'):
+    # Open order in the /fapi/v1/openOrders format.
+    return {
+        'orderId': order_id,
+        'symbol': SYMBOL,
+        'side': side,
+        'type': order_type,
+        'positionSide': position_side,
+        'origQty': quantity,
+        'executedQty': executed,
+        'priceRate': price_rate,
+        'stopPrice': stop_price
+    }
+
+def reconcile(position_side, position_amt, orders, market_price=None, **settings):
+    return reconcile_side(SYMBOL, position_side, dict(SETTINGS, **settings), LEVERAGE, position_amt, index_orders(orders), FILTERS, market_price)
+
+def summary(actions):
+    # (action, kind) of every action, in order.
+    return [(action.action, action.kind) for action in actions]
+
+class FlatSideTest(unittest.TestCase):
+
+    def test_entry_order_is_created(self):
+        actions = reconcile('LONG', 0, [])
+        self.assertEqual(summary(actions), [('create', 'entry')])
+        params = actions[0].params
+        self.assertEqual((params['side'], params['type'], params['quantity'], params['callbackRate']), ('BUY', TRAILING_STOP, '0.010', 0.5))
+
+    def test_matching_entry_order_is_kept(self):
+        self.assertEqual(reconcile('SHORT', 0, [order(1, 'SELL', TRAILING_STOP, 'SHORT', '0.010', price_rate='0.5')]), [])
+
+    def test_entry_order_with_other_callback_rate_is_replaced(self):
+        actions = reconcile('LONG', 0, [order(1, 'BUY', TRAILING_STOP, 'LONG', '0.010', price_rate='1.0')])
+        self.assertEqual(summary(actions), [('replace', 'entry')])
+        self.assertEqual(actions[0].order['orderId'], 1)
+
+    def test_duplicate_entry_orders_are_cancelled(self):
+        orders = [order(1, 'BUY', TRAILING_STOP, 'LONG', '0.010', price_rate='0.5'), order(2, 'BUY', TRAILING_STOP, 'LONG', '0.010', price_rate='0.5')]
+        actions = reconcile('LONG', 0, orders)
+        self.assertEqual(summary(actions), [('cancel', 'entry')])
+        self.assertEqual(actions[0].order['orderId'], 2)
+
+    def test_closing_orders_of_the_last_position_are_cancelled(self):
+        orders = [
+            order(1, 'BUY', TRAILING_STOP, 'LONG', '0.010', price_rate='0.5'),
+            order(2, 'SELL', STOP_LOSS, 'LONG', '0.010', stop_price='95000'),
+            order(3, 'SELL', TRAILING_STOP, 'LONG', '0.010', price_rate='0.3')
+        ]
+        actions = reconcile('LONG', 0, orders)
+        self.assertEqual(summary(actions), [('cancel', 'stale'), ('cancel', 'stale')])
+        self.assertEqual(sorted(action.order['orderId'] for action in actions), [2, 3])
+
+    def test_other_side_is_ignored(self):
+        orders = [order(1, 'SELL', STOP_LOSS, 'SHORT', '0.010', stop_price='105000')]
+        self.assertEqual(summary(reconcile('LONG', 0, orders)), [('create', 'entry')])
+
+class PartialFillTest(unittest.TestCase):
+
+    def test_remaining_quantity(self):
+        self.assertEqual(remaining_quantity(order(1, 'SELL', STOP_LOSS, 'LONG', '0.010', executed='0.004')), Decimal('0.006'))
+        self.assertEqual(remaining_quantity({'origQty': '0.010'}), Decimal('0.010'))
+
+    def test_partially_filled_entry_leaves_the_remainder_open(self):
+        # The entry order filled 0.004 of 0.010: the position is protected and the entry order is left alone
+        orders = [order(1, 'BUY', TRAILING_STOP, 'LONG', '0.010', executed='0.004', price_rate='0.5')]
+        actions = reconcile('LONG', 0.004, orders, 100000.0)
+        self.assertEqual(summary(actions), [('create', 'close'), ('create', 'stop_loss')])
+        self.assertEqual([action.params['quantity'] for action in actions], ['0.004', '0.004'])
+
+    def test_partially_filled_orders_match_the_rest_of_the_position(self):
+        # Close orders that filled 0.004 of 0.010 still cover the remaining 0.006 of the position
+        orders = [
+            order(1, 'SELL', TRAILING_STOP, 'LONG', '0.010', executed='0.004', price_rate='0.3'),
+            order(2, 'SELL', STOP_LOSS, 'LONG', '0.010', executed='0.004', stop_price='95000')
+        ]
+        self.assertEqual(reconcile('LONG', 0.006, orders), [])
+
+    def test_orders_are_resized_to_the_unfilled_position(self):
+        orders = [
+            order(1, 'SELL', TRAILING_STOP, 'LONG', '0.010', price_rate='0.3'),
+            order(2, 'SELL', STOP_LOSS, 'LONG', '0.010', executed='0.002', stop_price='95000')
+        ]
+        actions = reconcile('LONG', 0.006, orders)
+        self.assertEqual(summary(actions), [('replace', 'close'), ('replace', 'stop_loss')])
+        self.assertEqual([action.params['quantity'] for action in actions], ['0.006', '0.006'])
+
+class ReplaceTest(unittest.TestCase):
+
+    def test_stop_loss_keeps_its_stop_price(self):
+        orders = [order(1, 'SELL', TRAILING_STOP, 'LONG', '0.006', price_rate='0.3'), order(2, 'SELL', STOP_LOSS, 'LONG', '0.010', stop_price='95000')]
+        actions = reconcile('LONG', 0.006, orders, 80000.0)
+        self.assertEqual(summary(actions), [('replace', 'stop_loss')])
+        self.assertEqual(actions[0].params['stopPrice'], '95000.0')
+        self.assertEqual(actions[0].order['orderId'], 2)
+
+    def test_take_profit_keeps_its_stop_price(self):
+        orders = [order(1, 'BUY', STOP_LOSS, 'SHORT', '0.004', stop_price='105000'), order(2, 'BUY', TAKE_PROFIT, 'SHORT', '0.010', stop_price='90000')]
+        actions = reconcile('SHORT', -0.004, orders, take_profit_enabled=True)
+        self.assertEqual(summary(actions), [('replace', 'take_profit')])
+        self.assertEqual((actions[0].params['side'], actions[0].params['quantity'], actions[0].params['stopPrice']), ('BUY', '0.004', '90000.0'))
+
+    def test_replace_needs_no_price(self):
+        orders = [order(1, 'SELL', TRAILING_STOP, 'LONG', '0.010', price_rate='0.3'), order(2, 'SELL', STOP_LOSS, 'LONG', '0.010', stop_price='95000')]
+        actions = reconcile('LONG', 0.006, orders)
+        self.assertNotIn('needs_price', [action.action for action in actions])
+        self.assertEqual(summary(actions), [('replace', 'close'), ('replace', 'stop_loss')])
+
+class PriceTest(unittest.TestCase):
+
+    def test_new_stop_loss_needs_a_price(self):
+        actions = reconcile('LONG', 0.01, [])
+        self.assertEqual(summary(actions), [('create', 'close'), ('needs_price', 'stop_loss')])
+        self.assertIsNone(actions[1].params)
+
+    def test_new_stop_loss_is_priced_from_the_market_price(self):
+        actions = reconcile('LONG', 0.01, [], 100000.0)
+        self.assertEqual(summary(actions), [('create', 'close'), ('create', 'stop_loss')])
+        self.assertEqual(actions[1].params['stopPrice'], '99500.0')  # 5% ROI at 10x leverage is 0.5% below
+        actions = reconcile('SHORT', -0.01, [], 100000.0)
+        self.assertEqual(actions[1].params['stopPrice'], '100500.0')
+
+    def test_take_profit_and_stop_loss_need_a_price(self):
+        orders = [order(1, 'BUY', TRAILING_STOP, 'LONG', '0.010', price_rate='0.5')]
+        actions = reconcile('LONG', 0.01, orders, take_profit_enabled=True)
+        self.assertEqual(summary(actions), [('needs_price', 'take_profit'), ('needs_price', 'stop_loss')])
+        actions = reconcile('LONG', 0.01, orders, 100000.0, take_profit_enabled=True)
+        self.assertEqual([action.params['stopPrice'] for action in actions], ['101000.0', '99500.0'])
+
+    def test_duplicates_are_cancelled_without_a_price(self):
+        orders = [
+            order(1, 'SELL', TRAILING_STOP, 'LONG', '0.010', price_rate='0.3'),
+            order(2, 'SELL', TRAILING_STOP, 'LONG', '0.010', price_rate='0.3')
+        ]
+        actions = reconcile('LONG', 0.01, orders)
+        self.assertEqual(summary(actions), [('cancel', 'close'), ('needs_price', 'stop_loss')])
+        self.assertEqual(actions[0].order['orderId'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import json
+import logging
+import threading
+import time
+import http_client  # Shared pooled HTTP transport
+
+try:
+    import websocket  # websocket-client, only needed for the event-driven mode
+except ImportError:
+    websocket = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_CONNECTED = 'streamConnected'  # Event passed to on_event after every connect, events sent while disconnected are lost
+
+def create_listen_key(api_key, transport=None):
+    # Start a user data stream and return its listen key.
+    headers = {
+        'X-MBX-APIKEY': api_key
+    }
+    response = (transport or http_client.transport).request('POST', '/fapi/v1/listenKey', headers=headers)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Listen key response: %s", response.text)
+    return response.json().get('listenKey')
+
+def keepalive_listen_key(api_key, transport=None):
+    # Extend the validity of the user data stream by 60 minutes.
+    headers = {
+        'X-MBX-APIKEY': api_key
+    }
+    response = (transport or http_client.transport).request('PUT', '/fapi/v1/listenKey', headers=headers)
+    return response.status_code == 200
+
+class FuturesStream:
+    """Combined user data and mark price stream. Every event is passed to on_event.
+
+    After every connect, reconnects included, on_event also gets a STREAM_CONNECTED event with the
+    time.monotonic() of the connect in 'time'.
+    """
+
+    def __init__(self, ws_base_url, api_key, symbols, on_event, keepalive_interval=1800, reconnect_delay=5, transport=None):
+        if websocket is None:
+            raise ImportError("The event-driven mode requires the websocket-client package (pip install websocket-client)")
+        self.ws_base_url = ws_base_url
+        self.api_key = api_key
+        self.symbols = list(symbols)
+        self.on_event = on_event  # Called from the stream thread with the event payload
+        self.keepalive_interval = keepalive_interval  # Seconds between listen key keepalives
+        self.reconnect_delay = reconnect_delay  # Seconds to wait before reconnecting
+        self.transport = transport  # Transport of the account the listen key requests go through, the shared one if None
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._app = None
+        self._threads = []
+
+    def get_url(self, listen_key):
+        # Build the combined stream URL for the listen key and the mark price of each symbol.
+        streams = [listen_key] + [f"{symbol.lower()}@markPrice@1s" for symbol in self.symbols]
+        return f"{self.ws_base_url}/stream?streams={'/'.join(streams)}"
+
+    def _on_message(self, app, message):
+        payload = json.loads(message)
+        event = payload.get('data', payload)  # Combined streams wrap the event in 'data'
+        if event.get('e') == 'listenKeyExpired':
+            logger.info("Listen key expired, reconnecting...")
+            app.close()
+            return
+        try:
+            self.on_event(event)
+        except Exception as e:
+            logger.exception("Error handling stream event: %s", e)
+
+    def _on_open(self, app):
+        logger.info("Stream connected.")
+        self.connected.set()
+        try:
+            self.on_event({'e': STREAM_CONNECTED, 'time': time.monotonic()})
+        except Exception as e:
+            logger.exception("Error handling stream event: %s", e)
+
+    def _on_error(self, app, error):
+        logger.error("Stream error: %s", error)
+
+    def _on_close(self, app, status_code, message):
+        logger.info("Stream closed: %s %s", status_code, message)
+        self.connected.clear()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval):
+            try:
+                if not keepalive_listen_key(self.api_key, self.transport):
+                    logger.warning("Listen key keepalive failed.")
+            except Exception as e:
+                logger.warning("Error keeping listen key alive: %s", e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                listen_key = create_listen_key(self.api_key, self.transport)
+                if not listen_key:
+                    raise RuntimeError("No listen key received")
+                self._app = websocket.WebSocketApp(
+                    self.get_url(listen_key),
+                    on_open=self._on_open,
+                    on_message=self._on_message,
+                    on_error=self._on_error,
+                    on_close=self._on_close
+                )
+                self._app.run_forever(ping_interval=60, ping_timeout=10)
+            except Exception as e:
+                logger.error("Error running stream: %s", e)
+            if not self._stop.is_set():
+                time.sleep(self.reconnect_delay)
+
+    def start(self):
+        # Connect in background threads and keep the listen key alive.
+        for target, name in ((self._run, 'futures-stream'), (self._keepalive_loop, 'listen-key-keepalive')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        if self._app is not None:
+            self._app.close()